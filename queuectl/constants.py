@@ -11,11 +11,19 @@ VALID_STATES = [
     "completed",   # successfully executed
     "failed",      # failed but eligible for retry
     "dead",        # permanently failed, moved to DLQ
+    "blocked",     # waiting for the jobs in its depends_on to complete
+    "cancelled",   # a dependency ended up in the DLQ (on_dependency_failure = cancel)
 ]
 
 # Global in-process shutdown flag
 SHUTDOWN = False
-SHUTDOWN_FILE = os.path.expanduser("~/.queuectl/stop.flag")
+# State directory (database, stop flag), QUEUECTL_HOME overrides it e.g. for benchmarks
+QUEUECTL_HOME = os.environ.get("QUEUECTL_HOME", os.path.expanduser("~/.queuectl"))
+SHUTDOWN_FILE = os.path.join(QUEUECTL_HOME, "stop.flag")
+WAKE_DIR = os.path.join(QUEUECTL_HOME, "wake")
+SCHEDULER_WAKE_DIR = os.path.join(WAKE_DIR, "scheduler")
+LOGS_DIR = os.path.join(QUEUECTL_HOME, "logs")
+CACHE_DIR = os.path.join(QUEUECTL_HOME, "cache")
 
 
 # Worker exit reason codes
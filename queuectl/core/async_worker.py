@@ -0,0 +1,202 @@
+import os
+import time
+import signal
+import asyncio
+from queuectl.core.worker import (
+    fetch_next_jobs, start_job, finish_job, next_claim_at, should_stop, handle_sigterm,
+    job_argv, SPAWN_OPTIONS,
+)
+from queuectl.core.notify import open_wake_socket, close_wake_socket
+from queuectl.core.config_manager import get_config_int
+from queuectl.core.lease import start_heartbeat
+from queuectl.core.callables import (
+    job_call, call_job, use_pool, submit, shutdown_pool, kill_pool, preload_modules,
+)
+from queuectl.core.joblogs import LogWriter, new_log_path, capture_enabled, pump_async
+from queuectl.core.result_cache import cache_key, lookup as cache_lookup, store as cache_store
+from queuectl.core.limits import job_limits, spawn_options, apply_limits, start_timeout, failure_reason
+from concurrent.futures.process import BrokenProcessPool
+import queuectl.constants as constants
+
+
+"""
+Async Worker Mode (queuectl worker start --mode async --concurrency N)
+
+- One event loop per worker process runs up to N jobs at once via asyncio.create_subprocess_shell
+  (asyncio.create_subprocess_exec for argv jobs, an executor for callable jobs)
+- Claims only as many due jobs as there are free slots
+- Completions go through the same transitions as the sync worker (completed / retry_job / DLQ)
+- Stop flag or SIGTERM stops claiming, in-flight jobs are awaited before exit
+- Leases of in-flight jobs are kept alive by the same heartbeat thread as the sync worker
+"""
+
+
+# run one claimed job as a subprocess without blocking the loop
+async def run_job(job, held: set, concurrency: int = 1):
+    pid = os.getpid()
+    job_id = job["id"]
+    cmd = job["command"]
+    print(f"[Worker {pid}] Processing job : {job_id} : {cmd}")
+
+    if not start_job(job):
+        held.discard(job_id)
+        return
+
+    started_at = time.time()
+    log_path = new_log_path(job) if capture_enabled() and not job.get("callable") else None
+    key = None
+    if job.get("cacheable"):
+        # input files are hashed off the loop, they can be large
+        key = await asyncio.get_running_loop().run_in_executor(None, cache_key, job)
+    exit_code = cache_lookup(key, log_path) if key else None
+
+    if exit_code is not None:
+        reason = "cached"
+    elif job.get("callable"):
+        exit_code, reason = await run_callable_async(job, concurrency)
+    else:
+        exit_code, reason = await run_subprocess(job, log_path)
+    if key and exit_code == 0 and reason is None:
+        cache_store(key, exit_code, log_path)
+
+    finish_job(job, exit_code, started_at, log_path, reason)
+    held.discard(job_id)
+
+
+# command / argv job as a subprocess, returns (exit code, failure reason) like worker.run_command
+async def run_subprocess(job, log_path: str = None):
+    writer = LogWriter(log_path) if log_path else None
+    # our own pipe rather than PIPE: we close it once the job exited, even while a background
+    # child still holds the write end (wait() would otherwise wait for that child too)
+    pipe = os.pipe() if writer else None
+    output = {"stdin": asyncio.subprocess.DEVNULL, "stdout": pipe[1],
+              "stderr": asyncio.subprocess.STDOUT} if writer else {}
+    limits = job_limits(job)
+    options = spawn_options(limits, SPAWN_OPTIONS)
+    timeout = None
+    transport = None
+    try:
+        argv = job_argv(job)
+        try:
+            if argv:
+                proc = await asyncio.create_subprocess_exec(*argv, **output, **options)
+            else:
+                proc = await asyncio.create_subprocess_shell(job["command"], **output, **options)
+        finally:
+            if pipe:
+                os.close(pipe[1])
+        apply_limits(proc.pid, limits)
+        # same timer thread as the sync worker, killpg needs nothing from the loop
+        timeout = start_timeout(proc.pid, limits["timeout_s"])
+        if writer:
+            reader = asyncio.StreamReader()
+            transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(pipe[0], "rb", 0))
+            pipe = None
+            await pump_async(reader, writer, proc)
+        exit_code = await proc.wait()
+        return exit_code, failure_reason(exit_code, limits, bool(timeout and timeout[1].is_set()))
+    except Exception as e:
+        print(f"[Worker {os.getpid()}] Command error: {e}")
+        return -1, "error"
+    finally:
+        if transport:
+            transport.close()
+        elif pipe:
+            os.close(pipe[0])
+        if writer:
+            writer.close()
+        if timeout:
+            timeout[0]()
+
+
+# callables run in the worker's pool (one process per slot), or inline on the default thread pool
+# so the loop keeps going. With a timeout they always use the pool: killing it is the only way to
+# stop them, the other callables running in it then fail and go through the retry path.
+# Returns (exit code, failure reason).
+async def run_callable_async(job, pool_size: int):
+    spec, args, kwargs = job_call(job)
+    timeout = job_limits(job)["timeout_s"]
+    try:
+        if use_pool() or timeout:
+            exit_code = await asyncio.wait_for(asyncio.wrap_future(submit(pool_size, spec, args, kwargs)), timeout)
+        else:
+            exit_code = await asyncio.get_running_loop().run_in_executor(None, call_job, spec, args, kwargs)
+        return exit_code, failure_reason(exit_code, {})
+    except asyncio.TimeoutError:
+        print(f"[Worker {os.getpid()}] Callable {spec} timed out after {timeout:g}s, killing its pool.")
+        kill_pool()
+        return -signal.SIGKILL, "timeout"
+    except BrokenProcessPool as e:
+        print(f"[Worker {os.getpid()}] Callable pool crashed running {spec}: {e}")
+        shutdown_pool(wait=False)
+        return 1, "exit"
+
+
+async def worker_main(concurrency: int, queues=None):
+    pid = os.getpid()
+    loop = asyncio.get_running_loop()
+    in_flight = set()
+    held = set()  # ids of in-flight jobs, their leases are extended by the heartbeat thread
+    heartbeat = start_heartbeat(held)
+
+    # wakeups (producers, stop, signals) all set this event
+    wake = asyncio.Event()
+    wake_sock = open_wake_socket()
+    if wake_sock is not None:
+        def on_wakeup():
+            try:
+                while wake_sock.recv(64):
+                    pass
+            except BlockingIOError:
+                pass
+            wake.set()
+        loop.add_reader(wake_sock.fileno(), on_wakeup)
+
+    def on_signal(sig):
+        handle_sigterm(sig, None)
+        wake.set()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, on_signal, sig)
+
+    preload_modules()
+    print(f"[Worker {pid}] Started (async, concurrency {concurrency})")
+
+    while not should_stop():
+        free = concurrency - len(in_flight)
+        if free > 0:
+            for job in fetch_next_jobs(free, queues):
+                held.add(job["id"])
+                in_flight.add(asyncio.create_task(run_job(job, held, concurrency)))
+
+        # wait for a finished job, a wakeup, or the next due time (poll_interval as fallback)
+        timeout = get_config_int("poll_interval", 2)
+        if len(in_flight) < concurrency:
+            due = next_claim_at(queues)
+            if due is not None:
+                timeout = max(0.0, min(timeout, due - time.time()))
+
+        wake.clear()
+        wake_task = asyncio.create_task(wake.wait())
+        done, _ = await asyncio.wait(
+            in_flight | {wake_task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        wake_task.cancel()
+        in_flight -= done
+
+    if os.path.exists(constants.SHUTDOWN_FILE):
+        print(f"[Worker {pid}] Detected stop flag — shutting down gracefully.")
+    if in_flight:
+        print(f"[Worker {pid}] Waiting for {len(in_flight)} in-flight job(s) to finish.")
+        await asyncio.gather(*in_flight, return_exceptions=True)
+
+    heartbeat.set()
+    shutdown_pool()
+    if wake_sock is not None:
+        loop.remove_reader(wake_sock.fileno())
+    close_wake_socket(wake_sock)
+    print(f"[Worker {pid}] Stopped.")
+
+
+def run_async_worker_loop(concurrency: int = 10, queues=None):
+    asyncio.run(worker_main(max(1, concurrency), queues))
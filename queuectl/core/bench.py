@@ -0,0 +1,451 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import tempfile
+import platform
+import multiprocessing
+from queuectl.core.stats import nearest_rank, QUANTILES
+
+
+"""
+Built-in Benchmark Suite (queuectl bench)
+
+- Runs against a throwaway QUEUECTL_HOME (temp dir), never the real ~/.queuectl database
+- enqueue_single: enqueue_job one job at a time (one transaction + wakeup each)
+- enqueue_bulk: enqueue_many in enqueue_batch_size chunks
+- claim: N processes draining a seeded table with fetch_next_jobs, N in 1..64
+- latency: real workers running no-op commands, enqueue -> start -> finish per job
+- spawn: process starts/sec of `true` via shell + preexec_fn (the old path), shell + process group
+  options, and argv without a shell
+- broker: N processes claiming + finishing no-op jobs directly on SQLite vs through a broker on
+  127.0.0.1 (the same steps a worker takes, minus running the command)
+- Reports rates, p50/p95/p99 latencies (ms) and 'database is locked' counts as one JSON-able dict
+"""
+
+SCENARIOS = ("enqueue_single", "enqueue_bulk", "claim", "latency", "spawn", "broker")
+DEFAULTS = {
+    "jobs": 5000,
+    "workers": [1, 4, 16, 64],
+    "prefetch": [1],
+    "latency_jobs": 500,
+    "latency_workers": 4,
+    "spawns": 300,
+}
+# rates compared against a baseline by compare_results(), higher is better
+RATE_KEYS = ("jobs_per_sec", "claims_per_sec", "spawns_per_sec")
+
+
+# run the selected scenarios in a fresh process bound to a temp QUEUECTL_HOME, returns the report
+def run_bench(scenarios=None, jobs=None, workers=None, prefetch=None,
+              latency_jobs=None, latency_workers=None, spawns=None):
+    opts = dict(DEFAULTS)
+    for key, value in (("jobs", jobs), ("workers", workers), ("prefetch", prefetch),
+                       ("latency_jobs", latency_jobs), ("latency_workers", latency_workers),
+                       ("spawns", spawns)):
+        if value is not None:
+            opts[key] = value
+    if isinstance(opts["prefetch"], int):
+        opts["prefetch"] = [opts["prefetch"]]
+    scenarios = list(scenarios or SCENARIOS)
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenario(s): {', '.join(sorted(unknown))}. Choose from {', '.join(SCENARIOS)}.")
+
+    home = tempfile.mkdtemp(prefix="queuectl-bench-")
+    previous = os.environ.get("QUEUECTL_HOME")
+    os.environ["QUEUECTL_HOME"] = home
+    try:
+        # spawn, not fork: paths are bound at import time, the driver must import queuectl afresh
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+        driver = ctx.Process(target=_driver, args=(scenarios, opts, results))
+        driver.start()
+        report = results.get()
+        driver.join()
+    finally:
+        if previous is None:
+            os.environ.pop("QUEUECTL_HOME", None)
+        else:
+            os.environ["QUEUECTL_HOME"] = previous
+        shutil.rmtree(home, ignore_errors=True)
+
+    if "error" in report:
+        raise RuntimeError(report["error"])
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "cpus": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "options": opts,
+        },
+        "results": report,
+    }
+
+
+# rate regressions against a previous report: [(metric, baseline, current)] more than `tolerance` slower
+def compare_results(baseline: dict, current: dict, tolerance: float = 0.1):
+    regressions = []
+    old, new = _flatten(baseline.get("results", {})), _flatten(current.get("results", {}))
+    for name, value in new.items():
+        if name.rsplit(".", 1)[-1] not in RATE_KEYS or name not in old:
+            continue
+        if old[name] and value < old[name] * (1 - tolerance):
+            regressions.append((name, old[name], value))
+    return regressions
+
+
+def _flatten(results: dict, prefix: str = ""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+# nearest-rank percentiles (ms) of a list of durations in seconds
+def percentiles(samples):
+    ordered = sorted(samples)
+    result = {}
+    for q in QUANTILES:
+        value = nearest_rank(ordered, q)
+        result[f"p{q}_ms"] = round(value * 1000, 3) if value is not None else None
+    return result
+
+
+def _is_locked(e: Exception) -> bool:
+    return isinstance(e, sqlite3.OperationalError) and "locked" in str(e)
+
+
+def _driver(scenarios, opts, results):
+    # worker / manager chatter would drown the report
+    sys.stdout = open(os.devnull, "w")
+    try:
+        from queuectl.storage.db import init_db
+        init_db()
+        report = {}
+        for name in scenarios:
+            report[name] = globals()[f"bench_{name}"](opts)
+        results.put(report)
+    except Exception as e:
+        results.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def _reset():
+    from queuectl.storage.db import get_connection
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM jobs")
+
+
+def _seed(count: int, prefix: str = "bench"):
+    from queuectl.storage.db import insert_jobs
+    _reset()
+    for start in range(0, count, 1000):
+        batch = [(i, {"id": f"{prefix}-{i}", "command": "true"}) for i in range(start, min(count, start + 1000))]
+        insert_jobs(batch, max_retries=0)
+
+
+def bench_enqueue_single(opts):
+    from queuectl.core.job_manager import enqueue_job
+    _reset()
+    samples, locked = [], 0
+    start = time.perf_counter()
+    for i in range(opts["jobs"]):
+        t = time.perf_counter()
+        try:
+            enqueue_job({"id": f"single-{i}", "command": "true"})
+        except sqlite3.OperationalError as e:
+            if not _is_locked(e):
+                raise
+            locked += 1
+        samples.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    return {"jobs": opts["jobs"], "seconds": round(elapsed, 3),
+            "jobs_per_sec": round(opts["jobs"] / elapsed, 1), "locked": locked, **percentiles(samples)}
+
+
+def bench_enqueue_bulk(opts):
+    from queuectl.core.job_manager import enqueue_many
+    from queuectl.core.config_manager import get_config_int
+    _reset()
+    batch_size = get_config_int("enqueue_batch_size", 1000)
+    samples = []
+    start = time.perf_counter()
+    for offset in range(0, opts["jobs"], batch_size):
+        chunk = [{"id": f"bulk-{i}", "command": "true"}
+                 for i in range(offset, min(opts["jobs"], offset + batch_size))]
+        t = time.perf_counter()
+        enqueue_many(chunk, batch_size=batch_size)
+        samples.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    # percentiles are per batch transaction here
+    return {"jobs": opts["jobs"], "batch_size": batch_size, "seconds": round(elapsed, 3),
+            "jobs_per_sec": round(opts["jobs"] / elapsed, 1), **percentiles(samples)}
+
+
+def _claim_until_empty(prefetch: int, ready, out):
+    from queuectl.core import worker
+
+    ready.wait()
+    samples, claimed = [], 0
+    while True:
+        t = time.perf_counter()
+        jobs = worker.fetch_next_jobs(prefetch)
+        samples.append(time.perf_counter() - t)
+        if not jobs:
+            # a failed claim (locked) also returns nothing, only stop once the table is drained
+            if worker.next_due_at() is not None:
+                continue
+            break
+        claimed += len(jobs)
+    out.put((claimed, samples, dict(worker.claim_errors)))
+
+
+# row key for a workers x prefetch run, prefetch 1 keeps the plain name (comparable with old baselines)
+def _row_key(prefix: str, count: int, prefetch: int) -> str:
+    return f"{prefix}workers_{count}" + (f"_prefetch_{prefetch}" if prefetch != 1 else "")
+
+
+def bench_claim(opts):
+    ctx = multiprocessing.get_context("fork")
+    report = {}
+    for prefetch, count in [(p, n) for p in opts["prefetch"] for n in opts["workers"]]:
+        _seed(opts["jobs"])
+        ready, out = ctx.Event(), ctx.Queue()
+        procs = [ctx.Process(target=_claim_until_empty, args=(prefetch, ready, out))
+                 for _ in range(count)]
+        for p in procs:
+            p.start()
+        start = time.perf_counter()
+        ready.set()
+        claimed, samples, locked, other = 0, [], 0, 0
+        for _ in procs:
+            c, s, errors = out.get()
+            claimed, locked, other = claimed + c, locked + errors["locked"], other + errors["other"]
+            samples += s
+        elapsed = time.perf_counter() - start
+        for p in procs:
+            p.join()
+        report[_row_key("", count, prefetch)] = {
+            "workers": count, "prefetch": prefetch, "claimed": claimed,
+            "seconds": round(elapsed, 3), "claims_per_sec": round(claimed / elapsed, 1),
+            "locked": locked, "errors": other, **percentiles(samples),
+        }
+    return report
+
+
+# same steps as run_worker_loop, with timestamps around start / finish
+def _timed_worker(out):
+    from queuectl.core import worker
+    from queuectl.core.notify import open_wake_socket, close_wake_socket
+
+    wake_sock = open_wake_socket()
+    while not worker.should_stop():
+        jobs = worker.fetch_next_jobs(1)
+        if not jobs:
+            worker.wait_for_work(wake_sock)
+            continue
+        job = jobs[0]
+        started = time.time()
+        if worker.start_job(job):
+            exit_code, reason = worker.execute_job(job)
+            worker.finish_job(job, exit_code, started, reason=reason)
+        out.put((job["id"], started, time.time()))
+    close_wake_socket(wake_sock)
+    out.put(dict(worker.claim_errors))
+
+
+def bench_latency(opts):
+    from queuectl.core.job_manager import enqueue_job
+    from queuectl.constants import SHUTDOWN_FILE
+    from queuectl.core.notify import notify_workers
+
+    _reset()
+    ctx = multiprocessing.get_context("fork")
+    out = ctx.Queue()
+    procs = [ctx.Process(target=_timed_worker, args=(out,)) for _ in range(opts["latency_workers"])]
+    for p in procs:
+        p.start()
+    time.sleep(0.5)  # let workers bind their wakeup sockets and go idle
+
+    enqueued = {}
+    for i in range(opts["latency_jobs"]):
+        job_id = f"latency-{i}"
+        enqueued[job_id] = time.time()
+        enqueue_job({"id": job_id, "command": "true"})
+        time.sleep(0.002)  # a steady trickle, not a pre-filled table
+
+    waits, runs, totals = [], [], []
+    for _ in range(opts["latency_jobs"]):
+        job_id, started, finished = out.get()
+        waits.append(started - enqueued[job_id])
+        runs.append(finished - started)
+        totals.append(finished - enqueued[job_id])
+
+    open(SHUTDOWN_FILE, "w").close()
+    notify_workers()
+    locked = other = 0
+    for _ in procs:
+        errors = out.get()
+        locked, other = locked + errors["locked"], other + errors["other"]
+    for p in procs:
+        p.join()
+    os.remove(SHUTDOWN_FILE)
+
+    return {
+        "jobs": opts["latency_jobs"], "workers": opts["latency_workers"],
+        "locked": locked, "errors": other,
+        "enqueue_to_start": percentiles(waits),
+        "start_to_finish": percentiles(runs),
+        "enqueue_to_finish": percentiles(totals),
+    }
+
+
+def bench_spawn(opts):
+    import subprocess
+    from queuectl.core.worker import SPAWN_OPTIONS
+
+    paths = {
+        "shell_preexec": lambda: subprocess.run("true", shell=True, preexec_fn=os.setpgrp),
+        "shell": lambda: subprocess.run("true", shell=True, **SPAWN_OPTIONS),
+        "argv": lambda: subprocess.run(["true"], **SPAWN_OPTIONS),
+    }
+    report = {}
+    for name, spawn in paths.items():
+        samples = []
+        start = time.perf_counter()
+        for _ in range(opts["spawns"]):
+            t = time.perf_counter()
+            spawn()
+            samples.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+        report[name] = {"path": name, "spawns": opts["spawns"], "seconds": round(elapsed, 3),
+                        "spawns_per_sec": round(opts["spawns"] / elapsed, 1), **percentiles(samples)}
+    return report
+
+
+def _drain(address, prefetch: int, ready, out):
+    from queuectl.core import worker
+    from queuectl.core.broker import BrokerClient
+
+    client = BrokerClient(address) if address else None
+    ready.wait()
+    samples, done = [], 0
+    while True:
+        if client:
+            jobs = client.call("claim", limit=prefetch)["jobs"]
+        else:
+            jobs = worker.fetch_next_jobs(prefetch)
+            if not jobs and worker.next_due_at() is not None:
+                continue  # locked, not drained
+        if not jobs:
+            break
+        for job in jobs:
+            t = time.perf_counter()
+            if client:
+                client.call("finish", job=job, exit_code=0, started_at=time.time())
+            else:
+                worker.finish_job(job, 0, time.time())
+            samples.append(time.perf_counter() - t)
+        done += len(jobs)
+    out.put((done, samples))
+
+
+def _free_port() -> int:
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve_broker(address):
+    from queuectl.core.broker import serve
+    serve(address)
+
+
+def bench_broker(opts):
+    import signal
+    import socket
+    ctx = multiprocessing.get_context("fork")
+    address = f"127.0.0.1:{_free_port()}"
+    server = ctx.Process(target=_serve_broker, args=(address,))
+    server.start()
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", int(address.rsplit(":", 1)[1])), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        report = {}
+        for prefetch, count in [(p, n) for p in opts["prefetch"] for n in opts["workers"]]:
+            for path in ("direct", "broker"):
+                _seed(opts["jobs"])
+                ready, out = ctx.Event(), ctx.Queue()
+                procs = [ctx.Process(target=_drain, args=(address if path == "broker" else None, prefetch, ready, out))
+                         for _ in range(count)]
+                for p in procs:
+                    p.start()
+                start = time.perf_counter()
+                ready.set()
+                done, samples = 0, []
+                for _ in procs:
+                    d, s = out.get()
+                    done, samples = done + d, samples + s
+                elapsed = time.perf_counter() - start
+                for p in procs:
+                    p.join()
+                # percentiles are per finish (the claim is amortised over prefetch)
+                report[_row_key(f"{path}_", count, prefetch)] = {
+                    "path": path, "workers": count, "prefetch": prefetch, "jobs": done,
+                    "seconds": round(elapsed, 3), "jobs_per_sec": round(done / elapsed, 1), **percentiles(samples),
+                }
+    finally:
+        os.kill(server.pid, signal.SIGTERM)
+        server.join()
+    return report
+
+
+# human-readable summary of a run_bench() report
+def format_report(report: dict) -> str:
+    lines = []
+    for name, result in report["results"].items():
+        rows = result.values() if name in ("claim", "spawn", "broker") else [result]
+        for row in rows:
+            if "path" in row and "workers" in row:
+                label = f"{name} ({row['path']}, {row['workers']} workers)"
+            elif "path" in row:
+                label = f"{name} ({row['path']})"
+            elif "workers" in row:
+                label = f"{name} ({row['workers']} workers)"
+            else:
+                label = name
+            if row.get("prefetch", 1) != 1:
+                label = label[:-1] + f", prefetch {row['prefetch']})"
+            rate = next((row[k] for k in RATE_KEYS if k in row), None)
+            parts = [f"{label:<40}"]
+            if rate is not None:
+                parts.append(f"{rate:>10.0f}/s")
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                if key in row:
+                    parts.append(f"{key[:3]} {row[key]}ms")
+            for key in ("enqueue_to_start", "start_to_finish", "enqueue_to_finish"):
+                if key in row:
+                    p = row[key]
+                    parts.append(f"{key} p50/p95/p99 {p['p50_ms']}/{p['p95_ms']}/{p['p99_ms']}ms")
+            if "locked" in row:
+                parts.append(f"locked {row['locked']}")
+            lines.append("  ".join(parts))
+    return "\n".join(lines)
+
+
+def load_report(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,542 @@
+import os
+import hmac
+import json
+import time
+import random
+import socket
+import struct
+import ipaddress
+import selectors
+import threading
+from collections import deque
+from queuectl.storage.db import get_connection, close_connection
+from queuectl.core.config_manager import get_config_int, config_snapshot, use_remote_config
+from queuectl.core.notify import open_wake_socket, close_wake_socket, wait_for_wakeup, notify_workers
+from queuectl.core.lease import start_heartbeat, renew_leases, reap_expired_leases
+from queuectl.core.retention import run_gc
+from queuectl.core.scheduler import open_scheduler, close_scheduler, load_schedules, fire_due_schedules
+from queuectl.core.callables import preload_modules, shutdown_pool
+from queuectl.core.joblogs import new_log_path, capture_enabled
+from queuectl.core.worker import (
+    claim_jobs, record_finish, requeue_claims, next_claim_at, start_job, execute_job, failure_message,
+)
+import queuectl.constants as constants
+from queuectl.constants import SHUTDOWN_FILE
+
+
+"""
+Claim Broker (queuectl broker, worker start --broker host:port)
+
+- One broker process owns the SQLite database; workers on other hosts talk to it over TCP
+  (host:port) or a Unix socket (unix:/path) instead of opening the file (no SQLite over NFS)
+- Frames: 4-byte big-endian length + a compact JSON object. Requests carry "op" and "owner"
+  (the worker's id, negative so it never matches a local pid in jobs.worker_pid), one reply each
+- Ops: claim, finish, heartbeat, release, config, wait (long poll until work may be due, max_wait)
+- Shared secret: with QUEUECTL_BROKER_TOKEN set, every request must carry it as "token" (the broker
+  drops the connection otherwise). Without it the broker only listens on loopback or a Unix socket
+- Client sockets are non-blocking, replies queue in a per-client buffer flushed on EVENT_WRITE, so a
+  worker that stops reading can't stall the others
+- Everything that arrives in one select() round is run in one BEGIN IMMEDIATE transaction, each
+  request under its own savepoint, so N workers cost one commit instead of N
+- The broker binds a wakeup socket like a worker: local enqueues and its own finishes answer the
+  waiting workers at once
+- It also reaps expired leases, runs gc (gc_interval, in a thread with its own connection) and fires
+  schedules, remote managers don't touch the database. Broker workers skip the result cache and
+  keep their logs on their own host
+"""
+
+MAX_FRAME = 16 * 1024 * 1024
+MAX_PENDING = 4 * MAX_FRAME  # unsent reply bytes per client before the broker gives up on it
+TOKEN_ENV = "QUEUECTL_BROKER_TOKEN"
+_HEADER = struct.Struct("!I")
+
+
+# "host:port" -> ("tcp", (host, port)), "unix:/path" or "/path" -> ("unix", path)
+def parse_address(spec: str):
+    if spec.startswith("unix:"):
+        return "unix", spec[len("unix:"):]
+    if "/" in spec:
+        return "unix", spec
+    host, sep, port = spec.rpartition(":")
+    if not sep or not port.isdigit():
+        raise ValueError(f"Invalid broker address '{spec}'. Use host:port or unix:/path/to.sock.")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+def encode_frame(msg: dict) -> bytes:
+    body = json.dumps(msg, separators=(",", ":")).encode()
+    return _HEADER.pack(len(body)) + body
+
+
+# split complete frames off the front of `buf` (a bytearray), returns the decoded messages
+def decode_frames(buf: bytearray):
+    messages = []
+    while len(buf) >= _HEADER.size:
+        (size,) = _HEADER.unpack_from(buf)
+        if size > MAX_FRAME:
+            raise ValueError(f"Frame of {size} bytes exceeds the {MAX_FRAME} byte limit.")
+        if len(buf) < _HEADER.size + size:
+            break
+        messages.append(json.loads(buf[_HEADER.size:_HEADER.size + size]))
+        del buf[:_HEADER.size + size]
+    return messages
+
+
+def _recv_exact(sock, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def recv_frame(sock) -> dict:
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    if size > MAX_FRAME:
+        raise ValueError(f"Frame of {size} bytes exceeds the {MAX_FRAME} byte limit.")
+    return json.loads(_recv_exact(sock, size))
+
+
+def _is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+def _listen(address: str, token: str = None):
+    kind, where = parse_address(address)
+    if kind == "tcp" and not token and not _is_loopback(where[0]):
+        raise ValueError(f"Refusing to listen on {where[0]} without a shared token. "
+                         f"Set {TOKEN_ENV} on the broker and worker hosts.")
+    if kind == "unix":
+        if os.path.exists(where):
+            os.remove(where)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(where)
+    else:
+        sock = socket.create_server(where)
+    sock.listen(128)
+    sock.setblocking(False)
+    return sock
+
+
+# ---------------------------------------------------------------- broker side
+
+# the broker's view of the config table, sent to workers whose revision is behind
+_config = {"values": None, "rev": 0}
+
+
+def _config_fields(msg: dict) -> dict:
+    if msg.get("config_rev") == _config["rev"]:
+        return {}
+    return {"config": _config["values"], "config_rev": _config["rev"]}
+
+
+# one request inside the batch transaction, returns its reply (None: a wait, answered later)
+def _handle(cur, client: dict, msg: dict):
+    op = msg.get("op")
+    owner = int(msg["owner"])
+    if op == "claim":
+        queues = [tuple(q) for q in msg["queues"]] if msg.get("queues") else None
+        jobs, client["held"] = claim_jobs(cur, max(1, int(msg.get("limit", 1))), queues, owner)
+        forced = [j["id"] for j in jobs if j["force_retry"]]
+        if forced:
+            # start_job's bookkeeping for a forced run, the worker has no database
+            cur.execute(f"UPDATE jobs SET attempts = attempts + 1 WHERE id IN ({','.join('?' * len(forced))})", forced)
+        return {"jobs": jobs, **_config_fields(msg)}
+    if op == "finish":
+        return record_finish(cur, msg["job"], msg["exit_code"], msg["started_at"], msg.get("log_path"),
+                             msg.get("reason"), owner, msg.get("finished_at"))
+    if op == "heartbeat":
+        until = time.time() + get_config_int("lease_seconds", 30)
+        return {"held": renew_leases(cur, msg.get("ids") or [], until, owner)}
+    if op == "release":
+        released = requeue_claims(cur, msg.get("ids") or [], owner)
+        return {"released": released, "wake": released > 0}
+    if op == "config":
+        return {"config": _config["values"], "config_rev": _config["rev"]}
+    if op == "wait":
+        queues = [tuple(q) for q in msg["queues"]] if msg.get("queues") else None
+        now = time.time()
+        due = next_claim_at(queues, client.get("held", {}))
+        if due is not None and due <= now:
+            return {"ready": True}
+        timeout = max(0.0, float(msg.get("max_wait", 2)))
+        client["wait_until"] = now + (timeout if due is None else min(timeout, due - now))
+        return None
+    raise ValueError(f"Unknown op '{op}'.")
+
+
+# Run one round of requests in a single write transaction. Returns ([(client, reply)], wake):
+# wake is True when a request freed work for the waiting workers.
+def _run_batch(batch):
+    conn = get_connection()
+    cur = conn.cursor()
+    replies, wake = [], False
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        values = config_snapshot()
+        if values != _config["values"]:
+            _config["values"], _config["rev"] = dict(values), _config["rev"] + 1
+        for client, msg in batch:
+            cur.execute("SAVEPOINT request;")
+            try:
+                reply = _handle(cur, client, msg)
+                cur.execute("RELEASE request;")
+            except Exception as e:
+                # only this request's changes go, the rest of the batch still commits
+                cur.execute("ROLLBACK TO request;")
+                cur.execute("RELEASE request;")
+                reply = {"error": f"{type(e).__name__}: {e}"}
+            if reply is not None:
+                wake = wake or bool(reply.pop("wake", False))
+                replies.append((client, reply))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        for client, _ in batch:
+            client.pop("wait_until", None)
+        return [(client, {"error": f"{type(e).__name__}: {e}"}) for client, _ in batch], False
+    return replies, wake
+
+
+# queue a reply and write what the socket takes now, the rest goes out on EVENT_WRITE
+def _send(sel, client: dict, reply: dict):
+    if client.get("closed"):
+        return
+    client["out"] += encode_frame(reply)
+    if len(client["out"]) > MAX_PENDING:
+        _drop(sel, client)  # not reading its replies
+        return
+    _flush(sel, client)
+
+
+def _flush(sel, client: dict):
+    try:
+        sent = client["sock"].send(client["out"])
+        del client["out"][:sent]
+    except BlockingIOError:
+        pass
+    except OSError:
+        _drop(sel, client)
+        return
+    events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client["out"] else 0)
+    if events != client["events"]:
+        sel.modify(client["sock"], events, client)
+        client["events"] = events
+
+
+def _authorized(msg: dict, token: str) -> bool:
+    return not token or hmac.compare_digest(str(msg.get("token", "")).encode(), token.encode())
+
+
+def _drop(sel, client: dict):
+    if client.get("closed"):
+        return
+    client["closed"] = True
+    try:
+        sel.unregister(client["sock"])
+    except (KeyError, ValueError):
+        pass
+    client["sock"].close()
+
+
+# one retention run on this thread's own connection
+def _gc(pid: int):
+    try:
+        result = run_gc()
+        if result["moved"]:
+            print(f"[Broker {pid}] Archived {result['moved']} finished job(s) older than {result['cutoff']}.")
+    except Exception as e:
+        print(f"[Broker {pid}] Retention run failed: {e}")
+    finally:
+        close_connection()
+
+
+# housekeeping the worker managers do for local workers: leases, retention, schedules
+def _housekeeping(state: dict, sched: dict):
+    pid = os.getpid()
+    now = time.monotonic()
+    if now >= state["next_reap"]:
+        state["next_reap"] = now + 2
+        try:
+            reaped = reap_expired_leases()
+            if reaped:
+                print(f"[Broker {pid}] Reclaimed {reaped} job(s) with expired leases.")
+        except Exception as e:
+            print(f"[Broker {pid}] Lease reaper failed: {e}")
+        interval = get_config_int("gc_interval", 0)
+        gc = state["gc"]
+        if interval > 0 and now >= state["next_gc"] and not (gc and gc.is_alive()):
+            state["next_gc"] = now + interval
+            # off the select loop: archiving a large backlog (or a vacuum) would stall every worker
+            state["gc"] = threading.Thread(target=_gc, args=(pid,), name="queuectl-gc", daemon=True)
+            state["gc"].start()
+    try:
+        if now >= sched["refresh_at"]:
+            load_schedules(sched)
+        fired = fire_due_schedules(sched)
+        if fired:
+            print(f"[Broker {pid}] Enqueued {fired} scheduled job(s).")
+    except Exception as e:
+        print(f"[Broker {pid}] Scheduler failed: {e}")
+
+
+# serve workers on `address` until SIGTERM / SIGINT. `token` defaults to $QUEUECTL_BROKER_TOKEN.
+def serve(address: str, token: str = None):
+    pid = os.getpid()
+    token = token if token is not None else os.environ.get(TOKEN_ENV) or None
+    listener = _listen(address, token)
+    sel = selectors.DefaultSelector()
+    sel.register(listener, selectors.EVENT_READ, "listen")
+    wake_sock = open_wake_socket(label="Broker")
+    if wake_sock is not None:
+        sel.register(wake_sock, selectors.EVENT_READ, "wake")
+    sched = open_scheduler()
+    if sched["sock"] is not None:
+        sel.register(sched["sock"], selectors.EVENT_READ, "schedules")
+    clients = []
+    state = {"next_reap": 0.0, "next_gc": time.monotonic(), "gc": None, "requests": 0, "batches": 0}
+    print(f"[Broker {pid}] Listening on {address}" + (" (token required)" if token else "") + ". Press Ctrl+C to stop.")
+
+    try:
+        while not constants.SHUTDOWN:
+            waiting = [c for c in clients if "wait_until" in c]
+            timeout = 2.0
+            if waiting:
+                timeout = min(timeout, min(c["wait_until"] for c in waiting) - time.time())
+            if sched["heap"]:
+                timeout = min(timeout, sched["heap"][0][0] - time.time())
+            try:
+                events = sel.select(max(0.0, timeout))
+            except InterruptedError:
+                continue
+
+            batch, woke = [], False
+            for key, mask in events:
+                if key.data == "listen":
+                    try:
+                        sock, _ = listener.accept()
+                    except BlockingIOError:
+                        continue
+                    if sock.family != socket.AF_UNIX:
+                        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    sock.setblocking(False)
+                    client = {"sock": sock, "buf": bytearray(), "out": bytearray(), "events": selectors.EVENT_READ}
+                    clients.append(client)
+                    sel.register(sock, selectors.EVENT_READ, client)
+                elif key.data == "wake":
+                    wait_for_wakeup(wake_sock, 0)
+                    woke = True
+                elif key.data == "schedules":
+                    wait_for_wakeup(sched["sock"], 0)
+                    load_schedules(sched)
+                else:
+                    client = key.data
+                    if mask & selectors.EVENT_WRITE:
+                        _flush(sel, client)
+                    if not mask & selectors.EVENT_READ or client.get("closed"):
+                        continue
+                    try:
+                        data = client["sock"].recv(65536)
+                        if not data:
+                            raise ConnectionError("closed")
+                        client["buf"] += data
+                        messages = decode_frames(client["buf"])
+                    except BlockingIOError:
+                        continue
+                    except (OSError, ValueError):
+                        _drop(sel, client)  # its claims come back when their leases expire
+                        continue
+                    if not all(_authorized(msg, token) for msg in messages):
+                        print(f"[Broker {pid}] Dropped a connection with a wrong or missing token.")
+                        _send(sel, client, {"error": f"PermissionError: wrong or missing {TOKEN_ENV}"})
+                        _drop(sel, client)
+                        continue
+                    batch += [(client, msg) for msg in messages]
+
+            if batch:
+                replies, wake = _run_batch(batch)
+                state["requests"] += len(batch)
+                state["batches"] += 1
+                for client, reply in replies:
+                    _send(sel, client, reply)
+                if wake:
+                    notify_workers()  # local workers; our own socket fires too
+                    woke = True
+
+            now = time.time()
+            for client in [c for c in clients if "wait_until" in c]:
+                if woke or client["wait_until"] <= now:
+                    del client["wait_until"]
+                    _send(sel, client, {"ready": woke})
+            clients = [c for c in clients if not c.get("closed")]
+            _housekeeping(state, sched)
+    finally:
+        for client in clients:
+            _drop(sel, client)
+        listener.close()
+        if state["gc"]:
+            state["gc"].join()
+        kind, where = parse_address(address)
+        if kind == "unix" and os.path.exists(where):
+            os.remove(where)
+        close_wake_socket(wake_sock)
+        close_scheduler(sched)
+        print(f"[Broker {pid}] Stopped after {state['requests']} request(s) in {state['batches']} transaction(s).")
+
+
+# ---------------------------------------------------------------- worker side
+
+class BrokerClient:
+    """
+    Blocking request / reply connection to a broker, reconnected on the next call after an error.
+    call() raises ConnectionError when the broker can't be reached and RuntimeError for an
+    error reply. Config snapshots in replies are applied to this process's config reads.
+    Requests carry `token` (default $QUEUECTL_BROKER_TOKEN) when one is set.
+    """
+
+    def __init__(self, address: str, owner: int = None, token: str = None):
+        self.address = address
+        self.token = token if token is not None else os.environ.get(TOKEN_ENV) or None
+        # negative, so it can't collide with the pid of a worker using the database directly
+        self.owner = owner if owner is not None else -random.randrange(1, 2 ** 62)
+        self.config_rev = None
+        self.sock = None
+
+    def connect(self):
+        kind, where = parse_address(self.address)
+        if kind == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(where)
+        else:
+            sock = socket.create_connection(where, timeout=10)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def call(self, op: str, timeout: float = 30.0, **fields) -> dict:
+        try:
+            if self.sock is None:
+                self.connect()
+            self.sock.settimeout(timeout)
+            msg = dict(fields, op=op, owner=self.owner)
+            if self.token:
+                msg["token"] = self.token
+            self.sock.sendall(encode_frame(msg))
+            reply = recv_frame(self.sock)
+        except (OSError, ValueError) as e:
+            self.close()
+            raise ConnectionError(f"broker {self.address}: {e}") from None
+        if "config" in reply:
+            use_remote_config(reply["config"])
+            self.config_rev = reply["config_rev"]
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply
+
+
+# report a finished job, retrying while the broker is unreachable (at most one lease long:
+# after that the reaper has taken the job back anyway). None when it couldn't be reported.
+def _finish_remote(client: BrokerClient, job, exit_code: int, started_at: float, log_path: str, reason: str):
+    finished_at = time.time()
+    give_up = finished_at + get_config_int("lease_seconds", 30)
+    while True:
+        try:
+            return client.call("finish", job=job, exit_code=exit_code, started_at=started_at,
+                               finished_at=finished_at, log_path=log_path, reason=reason)
+        except (ConnectionError, RuntimeError) as e:
+            if time.time() >= give_up:
+                print(f"[Worker {os.getpid()}] Could not report job {job['id']} to the broker: {e}")
+                return None
+            time.sleep(1)
+
+
+# run_worker_loop for a worker without database access, everything goes through the broker
+def run_broker_worker_loop(address: str, queues=None):
+    pid = os.getpid()
+    client = BrokerClient(address)
+    # the config comes from the broker, nothing below may read it before
+    while not constants.SHUTDOWN and not os.path.exists(SHUTDOWN_FILE):
+        try:
+            client.call("config")
+            break
+        except (ConnectionError, RuntimeError) as e:
+            print(f"[Worker {pid}] Waiting for broker: {e}")
+            time.sleep(2)
+    if client.config_rev is None:
+        return
+
+    buffer = deque()  # jobs claimed by this worker but not started yet
+    held = set()  # ids whose lease the heartbeat keeps extending (buffered + running)
+    beat_client = BrokerClient(address, client.owner, client.token)  # own connection, the loop may be in a long poll
+
+    def extend(ids, lease_seconds):
+        return beat_client.call("heartbeat", ids=ids)["held"] if ids else 0
+
+    heartbeat = start_heartbeat(held, extend)
+    preload_modules()
+    print(f"[Worker {pid}] Started (broker {address}" + (f", queues: {', '.join(f'{n}:{w:g}' for n, w in queues)})" if queues else ")"))
+
+    while not constants.SHUTDOWN:
+        if os.path.exists(SHUTDOWN_FILE):
+            constants.SHUTDOWN = True
+            print(f"[Worker {pid}] Detected stop flag — shutting down gracefully.")
+            break
+
+        if not buffer:
+            poll_interval = get_config_int("poll_interval", 2)
+            try:
+                reply = client.call("claim", limit=max(1, get_config_int("prefetch", 1)), queues=queues,
+                                    config_rev=client.config_rev)
+                buffer.extend(reply["jobs"])
+                held.update(j["id"] for j in buffer)
+                if not buffer:
+                    # long poll: the broker answers when work may be due, at the latest after poll_interval
+                    client.call("wait", timeout=poll_interval + 10, queues=queues, max_wait=poll_interval)
+            except (ConnectionError, RuntimeError) as e:
+                print(f"[Worker {pid}] Broker request failed: {e}")
+                time.sleep(poll_interval)
+            continue
+
+        job = buffer.popleft()
+        job_id = job["id"]
+        print(f"[Worker {pid}] Processing job : {job_id} : {job['command']}")
+
+        if not start_job(job, count_forced=False):
+            held.discard(job_id)
+            continue
+
+        log_path = new_log_path(job) if capture_enabled() and not job.get("callable") else None
+        started_at = time.time()
+        exit_code, reason = execute_job(job, log_path, use_cache=False)
+        failure = failure_message(job, exit_code, reason)
+        if failure:
+            print(f"[Worker {pid}] {failure}")
+        result = _finish_remote(client, job, exit_code, started_at, log_path, reason)
+        if result:
+            print(f"[Worker {pid}] {result['message']}")
+        held.discard(job_id)
+
+        if constants.SHUTDOWN:
+            print(f"[Worker {pid}] Graceful shutdown, exiting after current job.")
+            break
+
+    if buffer:
+        try:
+            released = client.call("release", ids=[j["id"] for j in buffer])["released"]
+            print(f"[Worker {pid}] Released {released} prefetched job(s) back to pending.")
+        except (ConnectionError, RuntimeError) as e:
+            print(f"[Worker {pid}] Could not release prefetched jobs ({e}), their leases will expire.")
+
+    heartbeat.set()
+    shutdown_pool()
+    client.close()
+    print(f"[Worker {pid}] Stopped.")
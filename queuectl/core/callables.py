@@ -0,0 +1,168 @@
+import os
+import re
+import sys
+import json
+import importlib
+import traceback
+import signal
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from queuectl.core.config_manager import get_cached_config
+from queuectl.core.limits import job_limits, failure_reason
+
+
+"""
+In-process Python Callable Jobs ({"callable": "pkg.module:func", "args": [...], "kwargs": {...}})
+
+- Run inside the already warm worker process, no interpreter start or re-import per job
+- `preload` config: comma-separated modules imported once when a worker starts
+- `callable_isolation` config: 'inline' (default) runs in the worker itself,
+  'pool' in a per-worker subprocess pool (a crash or leak stays there). Pool processes come from a
+  forkserver that imported the preload modules once, never from a fork of the worker: by then it
+  runs the heartbeat thread, and a fork of a threaded process can deadlock on a lock held there
+- Returning normally is success (exit code 0), an exception is a failure (1),
+  sys.exit(n) maps to n, so results go through the usual completed / retry_job / DLQ path
+- A callable with a timeout (timeout_s / job_timeout_s) always runs in the pool, whatever the
+  isolation: past the timeout the pool's processes are killed (reason 'timeout') and the next job
+  gets a fresh pool. max_rss_mb / cpu_seconds don't apply to callables
+"""
+
+CALLABLE_RE = re.compile(r"^[A-Za-z_][\w.]*:[A-Za-z_][\w.]*$")
+
+_pool = None  # this worker's subprocess pool (callable_isolation = pool)
+_pool_pids = None  # queue its processes put their pid on when they start, read by kill_pool
+
+
+def validate_spec(spec: str):
+    if not isinstance(spec, str) or not CALLABLE_RE.match(spec):
+        raise ValueError("'callable' must look like 'package.module:function'.")
+
+
+# "pkg.module:Class.method" -> the function object (module import is cached in sys.modules)
+def load_callable(spec: str):
+    module_name, _, attr = spec.partition(":")
+    target = importlib.import_module(module_name)
+    for part in attr.split("."):
+        target = getattr(target, part)
+    if not callable(target):
+        raise TypeError(f"'{spec}' is not callable.")
+    return target
+
+
+# run one callable job, returns an exit code like a command would
+def call_job(spec: str, args=None, kwargs=None) -> int:
+    try:
+        load_callable(spec)(*(args or []), **(kwargs or {}))
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    except Exception:
+        print(f"[Worker {os.getpid()}] Callable {spec} raised:\n{traceback.format_exc().rstrip()}")
+        return 1
+
+
+# import the `preload` modules once (worker start, and pool processes)
+def preload_modules(names=None):
+    if names is None:
+        names = get_cached_config("preload", "")
+    for name in (n.strip() for n in names.split(",")):
+        if not name:
+            continue
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            print(f"[Worker {os.getpid()}] Could not preload {name}: {e}")
+
+
+def use_pool() -> bool:
+    return get_cached_config("callable_isolation", "inline").strip().lower() == "pool"
+
+
+# pool process initializer: report the pid (for kill_pool), then import a changed `preload`
+def _init_pool_process(pids, preload: str):
+    pids.put(os.getpid())
+    preload_modules(preload)
+
+
+# this worker's pool. Its processes fork from the (single-threaded) forkserver, which imports the
+# preload modules up front, so they start warm; the initializer only covers a changed `preload`.
+def get_pool(size: int = 1):
+    global _pool, _pool_pids
+    if _pool is None:
+        preload = get_cached_config("preload", "")
+        ctx = multiprocessing.get_context("forkserver")
+        # only read when the server starts (first pool of this worker)
+        ctx.set_forkserver_preload([__name__] + [n.strip() for n in preload.split(",") if n.strip()])
+        _pool_pids = ctx.SimpleQueue()
+        _pool = ProcessPoolExecutor(
+            max_workers=size,
+            mp_context=ctx,
+            initializer=_init_pool_process,
+            initargs=(_pool_pids, preload),
+        )
+    return _pool
+
+
+# submit to the pool, replacing a pool an earlier crash left broken
+def submit(size: int, *call):
+    try:
+        return get_pool(size).submit(call_job, *call)
+    except BrokenProcessPool:
+        shutdown_pool(wait=False)
+        return get_pool(size).submit(call_job, *call)
+
+
+# kill the pool's processes (the only way to stop a callable past its timeout), in-flight calls
+# fail with BrokenProcessPool; the next submit starts a fresh pool
+def kill_pool():
+    global _pool, _pool_pids
+    pool, pids, _pool, _pool_pids = _pool, _pool_pids, None, None
+    if pool is None:
+        return
+    while not pids.empty():
+        try:
+            os.kill(pids.get(), signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    if sys.version_info >= (3, 9):
+        pool.shutdown(wait=False, cancel_futures=True)
+    else:
+        pool.shutdown(wait=False)
+
+
+def shutdown_pool(wait: bool = True):
+    global _pool, _pool_pids
+    if _pool is not None:
+        _pool.shutdown(wait=wait)
+        _pool, _pool_pids = None, None
+
+
+# callable job fields from a claimed row
+def job_call(job):
+    call_args = json.loads(job["call_args"]) if job.get("call_args") else {}
+    return job["callable"], call_args.get("args") or [], call_args.get("kwargs") or {}
+
+
+# run a claimed callable job in this process or the pool (sync worker), returns
+# (exit code, failure reason) like worker.run_command
+def run_callable(job):
+    spec, args, kwargs = job_call(job)
+    timeout = job_limits(job)["timeout_s"]
+    if not use_pool() and not timeout:
+        exit_code = call_job(spec, args, kwargs)
+        return exit_code, failure_reason(exit_code, {})
+    try:
+        exit_code = submit(1, spec, args, kwargs).result(timeout)
+        return exit_code, failure_reason(exit_code, {})
+    except FutureTimeout:
+        print(f"[Worker {os.getpid()}] Callable {spec} timed out after {timeout:g}s, killing its pool.")
+        kill_pool()
+        return -signal.SIGKILL, "timeout"
+    except BrokenProcessPool as e:
+        # the pool process died (segfault, OOM kill): fail this job, start a fresh pool next time
+        print(f"[Worker {os.getpid()}] Callable pool crashed running {spec}: {e}")
+        shutdown_pool(wait=False)
+        return 1, "exit"
@@ -0,0 +1,138 @@
+import math
+from queuectl.storage.db import get_connection
+from queuectl.core.notify import notify_workers
+
+
+"""
+Concurrency Groups and Rate Limits per concurrency_key (queuectl concurrency set|list|remove)
+
+- Jobs may carry a concurrency_key (e.g. "billing-db"), limits live in the concurrency_limits table
+- max_in_flight: at most that many jobs of the key in 'processing' at once
+- rate / burst: token bucket, `rate` claims per second with up to `burst` at once
+- Checked inside the claim transaction (BEGIN IMMEDIATE): in-flight counts come from a partial
+  index on processing keyed jobs, blocked keys are excluded from the claim query, so a worker
+  never claims a job it would then have to hold back
+- Keys without a row in concurrency_limits are unlimited
+"""
+
+
+def set_limit(key: str, max_in_flight: int = None, rate: float = None, burst: float = None):
+    if not key or not key.strip():
+        raise ValueError("Concurrency key must be a non-empty string.")
+    if max_in_flight is None and rate is None:
+        raise ValueError("Give --max and/or --rate.")
+    if max_in_flight is not None and max_in_flight < 1:
+        raise ValueError("--max must be at least 1.")
+    if rate is not None and rate <= 0:
+        raise ValueError("--rate must be positive.")
+    if burst is not None and (rate is None or burst < 1):
+        raise ValueError("--burst needs --rate and must be at least 1.")
+    if rate is not None and burst is None:
+        burst = max(1.0, rate)
+
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO concurrency_limits (key, max_in_flight, rate, burst, tokens, refilled_at)
+            VALUES (?, ?, ?, ?, ?, strftime('%s', 'now'))
+            ON CONFLICT(key) DO UPDATE SET
+                max_in_flight = excluded.max_in_flight,
+                rate = excluded.rate,
+                burst = excluded.burst,
+                tokens = MIN(COALESCE(tokens, excluded.tokens), COALESCE(excluded.burst, 0))
+            """,
+            (key, max_in_flight, rate, burst, burst),
+        )
+    notify_workers()  # a raised limit may unblock waiting jobs
+    return {"status": "updated", "key": key, "max_in_flight": max_in_flight, "rate": rate, "burst": burst}
+
+
+def remove_limit(key: str):
+    conn = get_connection()
+    with conn:
+        cur = conn.execute("DELETE FROM concurrency_limits WHERE key = ?", (key,))
+    if not cur.rowcount:
+        raise ValueError(f"No concurrency limit for key '{key}'.")
+    notify_workers()
+    return {"status": "removed", "key": key}
+
+
+# every limit with its current in-flight count
+def list_limits():
+    cur = get_connection().cursor()
+    cur.execute("SELECT * FROM concurrency_limits ORDER BY key")
+    limits = [dict(r) for r in cur.fetchall()]
+    for limit in limits:
+        limit["in_flight"] = _in_flight(cur, limit["key"])
+    return limits
+
+
+def has_limits(cur) -> bool:
+    cur.execute("SELECT 1 FROM concurrency_limits LIMIT 1")
+    return cur.fetchone() is not None
+
+
+def _in_flight(cur, key: str) -> int:
+    # served by the partial index idx_jobs_concurrency_processing
+    cur.execute("SELECT COUNT(*) FROM jobs WHERE state='processing' AND concurrency_key = ?", (key,))
+    return cur.fetchone()[0]
+
+
+# claim allowance per limited key, read inside the claim transaction:
+# {key: {"allow": jobs that may still start now, "tokens", "rate", "burst", "taken"}}
+def load_gate(cur, now: float) -> dict:
+    cur.execute("SELECT * FROM concurrency_limits")
+    gate = {}
+    for row in cur.fetchall():
+        allow = math.inf
+        tokens = None
+        if row["max_in_flight"] is not None:
+            allow = row["max_in_flight"] - _in_flight(cur, row["key"])
+        if row["rate"]:
+            elapsed = max(0.0, now - (row["refilled_at"] or now))
+            tokens = min(row["burst"], (row["tokens"] or 0) + elapsed * row["rate"])
+            allow = min(allow, math.floor(tokens))
+        gate[row["key"]] = {"allow": allow, "tokens": tokens, "rate": row["rate"], "taken": 0}
+    return gate
+
+
+def blocked_keys(gate: dict):
+    return [key for key, g in gate.items() if g["allow"] < 1]
+
+
+# split freshly claimed jobs (claim order) into the ones the limits admit and the ones to put back
+def admit(gate: dict, jobs):
+    admitted, rejected = [], []
+    for job in jobs:
+        g = gate.get(job.get("concurrency_key"))
+        if g is None:
+            admitted.append(job)
+        elif g["allow"] >= 1:
+            g["allow"] -= 1
+            g["taken"] += 1
+            admitted.append(job)
+        else:
+            rejected.append(job)
+    return admitted, rejected
+
+
+# persist the token buckets the claim drew from (same transaction)
+def save_gate(cur, gate: dict, now: float):
+    for key, g in gate.items():
+        if g["tokens"] is not None and g["taken"]:
+            cur.execute(
+                "UPDATE concurrency_limits SET tokens = ?, refilled_at = ? WHERE key = ?",
+                (g["tokens"] - g["taken"], now, key),
+            )
+
+
+# seconds until a key (its gate entry, after this claim's admit) earns its next token (None when
+# a token is left and only slots are missing, those free up with a wakeup when a keyed job finishes)
+def retry_after(g: dict):
+    if g["tokens"] is None:
+        return None
+    remaining = g["tokens"] - g["taken"]  # what save_gate persists
+    if remaining < 1:
+        return (1 - remaining) / g["rate"]
+    return None
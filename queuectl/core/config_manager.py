@@ -1,15 +1,26 @@
+import threading
 from queuectl.storage.db import get_connection
+from queuectl.core.notify import notify_workers
 
 """
 Listing and Managing Configuration Files
+
+- Cached reads for hot paths (worker polls, enqueue), revalidated through PRAGMA data_version
+- Broker workers have no database: their cached reads are served from the snapshot the broker sends
 """
 
+# Config table snapshot per thread (like the connection it is read through).
+# PRAGMA data_version changes whenever another connection commits, so a read costs
+# one pragma unless the database changed, and `config set` reaches running workers live.
+_cache = threading.local()
+# config table as last sent by the broker (worker start --broker), None when reading the database
+_remote = None
+
 def list_config():
     conn = get_connection()
     cur = conn.cursor()
     cur.execute("SELECT key, value FROM config")
     rows = cur.fetchall()
-    conn.close()
     return {r["key"]: r["value"] for r in rows}
 
 def get_config(key: str):
@@ -17,7 +28,6 @@ def get_config(key: str):
     cur = conn.cursor()
     cur.execute("SELECT value FROM config WHERE key = ?", (key,))
     row = cur.fetchone()
-    conn.close()
     if not row:
         raise ValueError(f"Configuration key '{key}' not found.")
     return row["value"]
@@ -25,15 +35,58 @@ def get_config(key: str):
 def set_config(key: str, value: str):
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO config (key, value)
-        VALUES (?, ?)
-        ON CONFLICT(key)
-        DO UPDATE SET value = excluded.value
-        """,
-        (key, value),
-    )
-    conn.commit()
-    conn.close()
+    with conn:
+        cur.execute(
+            """
+            INSERT INTO config (key, value)
+            VALUES (?, ?)
+            ON CONFLICT(key)
+            DO UPDATE SET value = excluded.value
+            """,
+            (key, value),
+        )
+    # data_version doesn't move for this connection's own commits
+    invalidate_config_cache()
+    notify_workers()  # idle workers re-read their settings now
     return {"status": "updated", "key": key, "value": value}
+
+
+def _config_snapshot():
+    if _remote is not None:
+        return _remote
+    conn = get_connection()
+    version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if getattr(_cache, "conn", None) is not conn or _cache.version != version:
+        rows = conn.execute("SELECT key, value FROM config").fetchall()
+        _cache.values = {r["key"]: r["value"] for r in rows}
+        _cache.conn, _cache.version = conn, version
+    return _cache.values
+
+
+def invalidate_config_cache():
+    _cache.version = None
+
+
+# the whole config table {key: value}, cached like get_cached_config
+def config_snapshot() -> dict:
+    return _config_snapshot()
+
+
+# serve this process's cached config reads from `values` (the broker's config) from now on
+def use_remote_config(values: dict):
+    global _remote
+    _remote = dict(values)
+
+
+# cached config read, KeyError if missing and no default
+def get_cached_config(key: str, default=None):
+    value = _config_snapshot().get(key)
+    if value is None:
+        if default is None:
+            raise KeyError(f"Configuration key '{key}' not found.")
+        return default
+    return value
+
+
+def get_config_int(key: str, default: int = None) -> int:
+    return int(get_cached_config(key, default))
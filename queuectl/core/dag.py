@@ -0,0 +1,90 @@
+import time
+from queuectl.storage.db import get_connection
+
+
+"""
+Job Dependencies ({"depends_on": ["parent1", ...], "on_dependency_failure": "cancel" | "hold"})
+
+- A job with unfinished parents is inserted 'blocked' with deps_remaining = parents not completed yet
+- Edges live in job_dependencies keyed by parent, so a finishing job touches only its own children
+- Completion (same transaction as the parent's state change): each child's counter is decremented
+  once per edge, children reaching 0 become 'pending' and due now (or at their run_at),
+  workers get a wakeup
+- Parent moved to the DLQ: 'cancel' children become 'cancelled', 'hold' children stay blocked until
+  the parent is retried from the DLQ and completes. A cancelled job never runs, so everything
+  blocked downstream of it is cancelled too, whatever its own policy
+- Parents must exist when a job is enqueued, so the graph can never contain a cycle
+"""
+
+
+# count `parent_id`'s completion for its blocked children, returns how many became pending
+def release_dependents(cur, parent_id: str) -> int:
+    cur.execute(
+        """
+        UPDATE jobs
+        SET deps_remaining = deps_remaining - 1,
+            state = CASE WHEN deps_remaining <= 1 THEN 'pending' ELSE state END,
+            updated_at = DATETIME('now'),
+            next_run_at = CASE WHEN deps_remaining <= 1 THEN MAX(next_run_at, ?) ELSE next_run_at END
+        WHERE state = 'blocked' AND id IN (
+            SELECT child_id FROM job_dependencies WHERE parent_id = ? AND done = 0
+        )
+        RETURNING state
+        """,
+        (int(time.time()), parent_id),
+    )
+    released = sum(1 for r in cur.fetchall() if r["state"] == "pending")
+    # counted once: a parent re-run after completing (`retry`) must not release children early
+    cur.execute("UPDATE job_dependencies SET done = 1 WHERE parent_id = ? AND done = 0", (parent_id,))
+    return released
+
+
+# `parent_id` is dead: cancel the children whose policy says so, then every blocked job below
+# them (a cancelled parent is final, 'hold' would wait forever). Returns the cancelled ids.
+def cancel_dependents(cur, parent_id: str):
+    cancelled = []
+    frontier = [(parent_id, "AND dep_failure = 'cancel'")]
+    while frontier:
+        parent, policy = frontier.pop()
+        cur.execute(
+            f"""
+            UPDATE jobs SET state = 'cancelled', updated_at = DATETIME('now')
+            WHERE state = 'blocked' {policy} AND id IN (
+                SELECT child_id FROM job_dependencies WHERE parent_id = ?
+            )
+            RETURNING id
+            """,
+            (parent,),
+        )
+        ids = [r["id"] for r in cur.fetchall()]
+        cancelled += ids
+        frontier += [(i, "") for i in ids]
+    return cancelled
+
+
+# `root` and everything downstream of it, each with its state, open dependency count and parents
+def dag_jobs(root: str):
+    cur = get_connection().cursor()
+    cur.execute("SELECT 1 FROM jobs WHERE id = ?", (root,))
+    if not cur.fetchone():
+        raise ValueError(f"No job found with id '{root}'")
+    cur.execute(
+        """
+        WITH RECURSIVE dag(id) AS (
+            SELECT ?
+            UNION
+            SELECT d.child_id FROM job_dependencies d JOIN dag ON d.parent_id = dag.id
+        )
+        SELECT j.id, j.state, j.deps_remaining, j.command,
+               (SELECT GROUP_CONCAT(parent_id, ',') FROM job_dependencies WHERE child_id = j.id) AS parents
+        FROM dag JOIN jobs j ON j.id = dag.id
+        ORDER BY j.created_at, j.id
+        """,
+        (root,),
+    )
+    jobs = []
+    for r in cur.fetchall():
+        job = dict(r)
+        job["parents"] = job["parents"].split(",") if job["parents"] else []
+        jobs.append(job)
+    return jobs
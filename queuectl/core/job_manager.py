@@ -1,7 +1,16 @@
 import json
+import shlex
+import sqlite3
+import time
+import base64
 from datetime import datetime, timedelta
-from queuectl.storage.db import get_connection, insert_job, list_jobs as db_list_jobs
-from queuectl.constants import VALID_STATES
+from queuectl.storage.db import get_connection, insert_job, insert_jobs, recount_job_counts, iter_jobs, list_jobs as db_list_jobs, insert_attempt
+from queuectl.core.config_manager import get_config_int, get_cached_config
+from queuectl.core.dag import cancel_dependents
+from queuectl.constants import VALID_STATES, SHUTDOWN_FILE
+from queuectl.core.notify import notify_workers
+from queuectl.core.callables import validate_spec
+from queuectl.core.limits import validate_limits
 import os
 from queuectl.storage.db import get_connection
 
@@ -18,30 +27,209 @@ Inserting Maintaing and Updating Job's Implementations
 - DLQ operations (listing, retrying)
 """
 
-# Enqueue jobs by taking only 'id' and 'command' as input, other columns are self determined
-def enqueue_job(job_json: str):
-    try:
-        data = json.loads(job_json)
-    except json.JSONDecodeError:
-        raise ValueError("Invalid JSON. Example: {\"id\": \"job1\", \"command\": \"echo 'Hi'\"}")
-
-    if not isinstance(data, dict):
+# 'run_at' as epoch seconds: a number is taken as is, a string as ISO 8601
+# ("2025-11-04T10:30:00Z", local time when it has no offset)
+def parse_run_at(value) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.strip().replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    raise ValueError("'run_at' must be epoch seconds or an ISO 8601 time, e.g. \"2025-11-04T10:30:00Z\".")
+
+
+# Parse and validate one job (JSON string or dict): 'id' and one of 'command' (a shell string),
+# 'argv' (a list, executed directly without a shell) or 'callable' ("pkg.module:func", run inside
+# the worker with optional 'args' / 'kwargs') are required, 'queue' (name), 'priority'
+# (int, higher runs first) and 'run_at' (not claimed before that time) are optional
+def parse_job(job):
+    if isinstance(job, (str, bytes)):
+        try:
+            job = json.loads(job)
+        except json.JSONDecodeError:
+            raise ValueError("Invalid JSON. Example: {\"id\": \"job1\", \"command\": \"echo 'Hi'\"}")
+
+    if not isinstance(job, dict):
         raise ValueError("Job must be a JSON object.")
 
-    allowed_keys = {"id", "command"}
-    extra = set(data.keys()) - allowed_keys
+    allowed_keys = {"id", "command", "argv", "callable", "args", "kwargs", "queue", "priority",
+                    "timeout_s", "max_rss_mb", "cpu_seconds", "concurrency_key", "dedupe_key",
+                    "cacheable", "inputs", "depends_on", "on_dependency_failure", "run_at"}
+    extra = set(job.keys()) - allowed_keys
     if extra:
-        raise ValueError(f"Invalid field(s): {', '.join(extra)}. Only 'id' and 'command' allowed.")
+        raise ValueError(
+            f"Invalid field(s): {', '.join(sorted(extra))}. Allowed: {', '.join(sorted(allowed_keys))}."
+        )
 
-    insert_job(data)
-    return {"status": "success", "message": f"Job '{data['id']}' added successfully."}
+    if "id" not in job:
+        raise ValueError("Missing required fields: id")
+    kinds = [k for k in ("command", "argv", "callable") if k in job]
+    if not kinds:
+        raise ValueError("Missing required fields: command (or argv / callable)")
+    if len(kinds) > 1:
+        raise ValueError(f"Give only one of {', '.join(repr(k) for k in kinds)}.")
+    if ("args" in job or "kwargs" in job) and "callable" not in job:
+        raise ValueError("'args' / 'kwargs' only apply to 'callable' jobs.")
+
+    if "argv" in job:
+        argv = job["argv"]
+        if not isinstance(argv, list) or not argv or not all(isinstance(a, str) for a in argv):
+            raise ValueError("'argv' must be a non-empty list of strings.")
+        # readable form for list / stats / logs, the worker runs argv itself
+        job = dict(job, command=shlex.join(argv))
+
+    if "callable" in job:
+        validate_spec(job["callable"])
+        if not isinstance(job.get("args", []), list):
+            raise ValueError("'args' must be a list.")
+        if not isinstance(job.get("kwargs", {}), dict):
+            raise ValueError("'kwargs' must be an object.")
+        call = job["callable"]
+        if job.get("args") or job.get("kwargs"):
+            call += " " + json.dumps({"args": job.get("args", []), "kwargs": job.get("kwargs", {})})
+        job = dict(job, command=call)
+
+    if "queue" in job and (not isinstance(job["queue"], str) or not job["queue"].strip()):
+        raise ValueError("'queue' must be a non-empty string.")
+    if "priority" in job and (not isinstance(job["priority"], int) or isinstance(job["priority"], bool)):
+        raise ValueError("'priority' must be an integer.")
+    if "concurrency_key" in job and (not isinstance(job["concurrency_key"], str) or not job["concurrency_key"].strip()):
+        raise ValueError("'concurrency_key' must be a non-empty string.")
+    if "dedupe_key" in job and (not isinstance(job["dedupe_key"], str) or not job["dedupe_key"].strip()):
+        raise ValueError("'dedupe_key' must be a non-empty string.")
+    if "cacheable" in job and not isinstance(job["cacheable"], bool):
+        raise ValueError("'cacheable' must be true or false.")
+    if "inputs" in job:
+        if not job.get("cacheable"):
+            raise ValueError("'inputs' only apply to 'cacheable' jobs.")
+        if not isinstance(job["inputs"], list) or not all(isinstance(p, str) and p for p in job["inputs"]):
+            raise ValueError("'inputs' must be a list of file paths.")
+    if "depends_on" in job:
+        parents = job["depends_on"]
+        if not isinstance(parents, list) or not all(isinstance(p, str) and p for p in parents):
+            raise ValueError("'depends_on' must be a list of job ids.")
+        if job["id"] in parents:
+            raise ValueError("A job can't depend on itself.")
+        policy = job.get("on_dependency_failure") or get_cached_config("dependency_failure", "cancel")
+        if policy not in ("cancel", "hold"):
+            raise ValueError("'on_dependency_failure' must be 'cancel' or 'hold'.")
+        job = dict(job, depends_on=list(dict.fromkeys(parents)), on_dependency_failure=policy)
+    elif "on_dependency_failure" in job:
+        raise ValueError("'on_dependency_failure' only applies to jobs with 'depends_on'.")
+    if "run_at" in job:
+        job = dict(job, run_at=parse_run_at(job["run_at"]))
+    validate_limits(job)
+    if "callable" in job and ("max_rss_mb" in job or "cpu_seconds" in job):
+        raise ValueError("'max_rss_mb' / 'cpu_seconds' don't apply to callable jobs (they share a process), use 'timeout_s'.")
+
+    return job
 
 
-# list all the jobs in the queue (sqlite3)
-def list_jobs(state=None):
+# Enqueue jobs by taking only 'id' and 'command' as input, other columns are self determined
+def enqueue_job(job_json: str):
+    data = parse_job(job_json)
+    job_id = insert_job(data, max_retries=get_config_int("max_retries"))
+    if job_id != data["id"]:
+        # same dedupe_key as a job that is still queued / running (or just completed)
+        return {"status": "deduped", "id": job_id,
+                "message": f"Job '{data['id']}' not added, dedupe_key '{data['dedupe_key']}' is held by job '{job_id}'."}
+    if data.get("depends_on"):
+        # blocked until its parents complete, nothing for the workers yet
+        return {"status": "success", "id": job_id,
+                "message": f"Job '{data['id']}' added, runs after {', '.join(data['depends_on'])}."}
+    if data.get("run_at", 0) > time.time():
+        # idle workers re-read the earliest due time every poll_interval and then sleep until it
+        run_at = datetime.fromtimestamp(data["run_at"]).strftime("%Y-%m-%d %H:%M:%S")
+        return {"status": "success", "id": job_id, "message": f"Job '{data['id']}' added, runs at {run_at}."}
+    notify_workers()
+    return {"status": "success", "id": job_id, "message": f"Job '{data['id']}' added successfully."}
+
+
+# Enqueue many jobs (JSON lines or dicts) streamed in chunked transactions.
+# Bad lines don't abort the batch: each invalid or duplicate line is passed to
+# on_error(line_no, message) if given, otherwise collected in the result's 'errors'.
+# Lines coalesced by dedupe_key are not errors, they are only counted ('deduped').
+def enqueue_many(jobs, batch_size: int = None, on_error=None):
+    batch_size = batch_size or get_config_int("enqueue_batch_size", 1000)
+    result = {"status": "success", "inserted": 0, "duplicates": 0, "deduped": 0, "invalid": 0, "errors": []}
+
+    def report(line_no, message):
+        if on_error:
+            on_error(line_no, message)
+        else:
+            result["errors"].append((line_no, message))
+
+    def flush(chunk):
+        inserted, duplicates, deduped, rejected = insert_jobs(chunk, max_retries=get_config_int("max_retries"))
+        result["inserted"] += inserted
+        result["deduped"] += len(deduped)
+        if inserted:
+            notify_workers()
+        result["duplicates"] += len(duplicates)
+        for line_no, job_id in duplicates:
+            report(line_no, f"Job with id '{job_id}' already exists.")
+        result["invalid"] += len(rejected)
+        for line_no, message in rejected:
+            report(line_no, message)
+
+    chunk = []
+    for line_no, job in enumerate(jobs, start=1):
+        if isinstance(job, (str, bytes)) and not job.strip():
+            continue
+        try:
+            data = parse_job(job)
+        except ValueError as e:
+            result["invalid"] += 1
+            report(line_no, str(e))
+            continue
+
+        chunk.append((line_no, data))
+        if len(chunk) >= batch_size:
+            flush(chunk)
+            chunk = []
+
+    if chunk:
+        flush(chunk)
+
+    return result
+
+
+# list jobs in the queue (sqlite3), streamed in (created_at, id) order.
+# `after` is an opaque cursor from encode_cursor(), since/until are ISO timestamps (UTC)
+def list_jobs(state=None, limit=None, after=None, since=None, until=None):
     if state and state not in VALID_STATES:
         raise ValueError(f"Invalid state '{state}'. Must be one of {VALID_STATES}.")
-    return db_list_jobs(state)
+    return iter_jobs(
+        state,
+        limit=limit,
+        after=decode_cursor(after) if after else None,
+        since=_db_timestamp(since) if since else None,
+        until=_db_timestamp(until) if until else None,
+    )
+
+
+# keyset cursor for the row after which the next page starts
+def encode_cursor(job: dict) -> str:
+    raw = json.dumps([job["created_at"], job["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, job_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return created_at, job_id
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor '{cursor}'.")
+
+
+# ISO date/datetime -> the 'YYYY-MM-DD HH:MM:SS' form created_at is stored in
+def _db_timestamp(value: str) -> str:
+    try:
+        return datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        raise ValueError(f"Invalid timestamp '{value}'. Use ISO format, e.g. 2025-11-04T10:30:00.")
 
 
 # function to update job state
@@ -54,64 +242,95 @@ def update_job_state(job_id: str, new_state: str):
     cur.execute("SELECT state FROM jobs WHERE id = ?", (job_id,))
     row = cur.fetchone()
     if not row:
-        conn.close()
         raise ValueError(f"No job found with id '{job_id}'")
 
-    cur.execute("UPDATE jobs SET state = ? WHERE id = ?", (new_state, job_id))
-    conn.commit()
-    conn.close()
+    with conn:
+        cur.execute("UPDATE jobs SET state = ? WHERE id = ?", (new_state, job_id))
     return {"status": "updated", "id": job_id, "new_state": new_state}
 
 
 # retry a job after it failed in the first go
-def retry_job(job_id: str):
+# `attempt` (worker.attempt_record) is the failed execution's timing, stored in the same transaction.
+# With `owner` (a worker pid) nothing changes unless that worker still holds the job's claim.
+def retry_job(job_id: str, attempt: dict = None, owner: int = None):
     conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, attempts, max_retries FROM jobs WHERE id = ?", (job_id,))
+    # Commits on success, rolls back if an update fails (the connection is shared)
+    with conn:
+        result = record_retry(conn.cursor(), job_id, attempt, owner)
+
+    # idle workers re-arm their sleep to the new earliest next_run_at
+    if result.get("state") == "pending":
+        notify_workers()
+    return result
+
+
+# retry_job's state change inside the caller's transaction (the broker batches many of them),
+# the caller sends the wakeup when the result's state is 'pending'
+def record_retry(cur, job_id: str, attempt: dict = None, owner: int = None):
+    cur.execute("SELECT id, state, attempts, max_retries FROM jobs WHERE id = ?", (job_id,))
     job = cur.fetchone()
 
     if not job:
-        conn.close()
         raise ValueError(f"No job found with id '{job_id}'")
+    if job["state"] in ("blocked", "cancelled"):
+        raise ValueError(f"Job '{job_id}' is {job['state']} by its dependencies, it can't be retried on its own.")
 
     # Increment attempts count
     attempts = int(job["attempts"]) + 1
     max_retries = int(job["max_retries"])
+    base = get_config_int("exp_backoff_base", 2)
+
+    owned = " AND state='processing' AND worker_pid=?" if owner is not None else ""
+    owner_args = (owner,) if owner is not None else ()
 
     if attempts >= max_retries:
         # Move job to Dead Letter Queue
         cur.execute(
-            "UPDATE jobs SET state='dead', attempts=?, updated_at=? WHERE id=?",
-            (attempts, datetime.utcnow().isoformat(), job_id),
+            "UPDATE jobs SET state='dead', attempts=?, updated_at=? WHERE id=?" + owned,
+            (attempts, datetime.utcnow().isoformat(), job_id, *owner_args),
         )
         msg = f"Job '{job_id}' moved to DLQ after {max_retries} retries."
     else:
-        # Re-enqueue job for retry
+        # Re-enqueue job for retry, due again after base ^ attempts seconds
         cur.execute(
             """
             UPDATE jobs
             SET state='pending',
                 attempts=?,
-                updated_at=? 
+                updated_at=?,
+                next_run_at=?
             WHERE id=?
-            """,
-            (attempts, datetime.utcnow().isoformat(), job_id),
+            """ + owned,
+            (attempts, datetime.utcnow().isoformat(), int(time.time()) + base ** attempts, job_id, *owner_args),
         )
         msg = f"Job '{job_id}' scheduled for retry #{attempts}."
 
-    conn.commit()
-    conn.close()
+    if not cur.rowcount:
+        # the lease ran out and the reaper already counted this attempt
+        if attempt:
+            insert_attempt(cur, dict(attempt, outcome="lease_lost"))
+        return {"status": "lost", "id": job_id, "attempts": int(job["attempts"]),
+                "message": f"Job '{job_id}' failed after its lease was reclaimed, result dropped."}
+    if attempt:
+        insert_attempt(cur, dict(attempt, outcome="dead" if attempts >= max_retries else "retry"))
+    if attempts >= max_retries:
+        cancelled = cancel_dependents(cur, job_id)
+        if cancelled:
+            msg += f" Cancelled {len(cancelled)} dependent job(s)."
+
+    return {"status": "retry", "id": job_id, "attempts": attempts,
+            "state": "dead" if attempts >= max_retries else "pending", "message": msg}
 
-    return {"status": "retry", "id": job_id, "attempts": attempts, "message": msg}
 
+# get summary of the queue (job_counts is maintained by triggers, no scan of jobs)
+def get_status_summary(recount: bool = False):
+    if recount:
+        recount_job_counts()
 
-# get summary of the queue
-def get_status_summary():
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute("SELECT state, COUNT(*) AS count FROM jobs GROUP BY state;")
+    cur.execute("SELECT state, SUM(count) AS count FROM job_counts GROUP BY state;")
     rows = cur.fetchall()
-    conn.close()
 
     summary = {r["state"]: r["count"] for r in rows}
     for s in VALID_STATES:
@@ -120,13 +339,31 @@ def get_status_summary():
 
 
 
+# per-queue breakdown {queue: {state: count}}, same counters as get_status_summary
+def get_queue_summary():
+    cur = get_connection().cursor()
+    cur.execute("SELECT queue, state, count FROM job_counts WHERE count != 0 ORDER BY queue;")
+    summary = {}
+    for r in cur.fetchall():
+        summary.setdefault(r["queue"], {s: 0 for s in VALID_STATES})[r["state"]] = r["count"]
+    return summary
+
+
+# True while the attempt writing `log_path` is still running (`logs --follow`)
+def is_attempt_running(job_id: str, log_path: str) -> bool:
+    cur = get_connection().cursor()
+    cur.execute("SELECT state FROM jobs WHERE id = ?", (job_id,))
+    row = cur.fetchone()
+    if not row or row["state"] != "processing":
+        return False
+    cur.execute("SELECT 1 FROM job_attempts WHERE job_id = ? AND log_path = ?", (job_id, log_path))
+    return cur.fetchone() is None
+
+
 # List all jobs currently in DLQ.
 def list_dlq():
     return db_list_jobs("dead")
 
-
-SHUTDOWN_FILE = os.path.expanduser("~/.queuectl/stop.flag")
-
 # manually move dlq jobs back to pending and re run those
 def retry_dlq(job_id: str):
     conn = get_connection()
@@ -136,19 +373,23 @@ def retry_dlq(job_id: str):
     cur.execute("SELECT id FROM jobs WHERE id=? AND state='dead'", (job_id,))
     job = cur.fetchone()
     if not job:
-        conn.close()
         raise ValueError(f"No DLQ job found with id '{job_id}'")
 
-    # Move to pending, mark force_retry
-    cur.execute("""
-        UPDATE jobs
-        SET state='pending',
-            force_retry=1,
-            updated_at=DATETIME('now')
-        WHERE id=? AND state='dead'
-    """, (job_id,))
-    conn.commit()
-    conn.close()
+    # Move to pending, mark force_retry (due immediately, no backoff)
+    try:
+        with conn:
+            cur.execute("""
+                UPDATE jobs
+                SET state='pending',
+                    force_retry=1,
+                    updated_at=DATETIME('now'),
+                    next_run_at=?
+                WHERE id=? AND state='dead'
+            """, (int(time.time()), job_id))
+    except sqlite3.IntegrityError:
+        # idx_jobs_dedupe_unfinished: a newer job with the same dedupe_key is already unfinished
+        raise ValueError(f"Job '{job_id}' not retried, another unfinished job has its dedupe_key.")
+    notify_workers()
 
     # Detect worker activity based on stop flag (fix this)
     if os.path.exists(SHUTDOWN_FILE):
@@ -0,0 +1,183 @@
+import os
+import sys
+import mmap
+import time
+import select
+import asyncio
+import shutil
+from collections import deque
+from urllib.parse import quote
+from queuectl.constants import LOGS_DIR
+from queuectl.core.config_manager import get_config_int
+
+
+"""
+Captured Job Output (~/.queuectl/logs/<job id>/<claim time>-<worker pid>.log, queuectl logs)
+
+- stdout + stderr of every command / argv job go to one file per attempt instead of the worker's terminal
+- Bounded: the first log_head_bytes are written as they arrive, after that only the last
+  log_tail_bytes are kept (in memory) and appended with a truncation marker when the job ends
+- Output is streamed in chunks, a job's full output is never held in memory
+- Capture ends when the job's own process has exited and the pipe is drained, not at EOF: a
+  background child that inherited the pipe doesn't keep the worker waiting
+- job_attempts.log_path points at each attempt's file, gc removes logs with their jobs
+"""
+
+CHUNK = 64 * 1024
+# reads left for a pipe once the job exited: what it wrote fits in a pipe buffer (max 1 MiB by default)
+DRAIN_READS = 16
+
+
+def job_log_dir(job_id: str) -> str:
+    return os.path.join(LOGS_DIR, quote(job_id, safe=""))
+
+
+# new log file path for this execution of a claimed job (names sort by claim time)
+def new_log_path(job) -> str:
+    claimed_ms = int((job.get("claimed_at") or time.time()) * 1000)
+    return os.path.join(job_log_dir(job["id"]), f"{claimed_ms}-{os.getpid()}.log")
+
+
+def capture_enabled() -> bool:
+    return get_config_int("log_capture", 1) != 0
+
+
+class LogWriter:
+    """
+    Head + tail capped sink for one attempt's output.
+    write() takes raw bytes as they come off the pipe, close() appends the tail.
+    """
+
+    def __init__(self, path: str, head_bytes: int = None, tail_bytes: int = None):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.head_left = head_bytes if head_bytes is not None else get_config_int("log_head_bytes", 1048576)
+        self.tail_bytes = tail_bytes if tail_bytes is not None else get_config_int("log_tail_bytes", 262144)
+        self.tail = deque()
+        self.tail_size = 0
+        self.dropped = 0
+        self.file = open(path, "wb", buffering=0)  # unbuffered, `logs --follow` sees output live
+
+    def write(self, data: bytes):
+        if self.head_left > 0:
+            head = data[:self.head_left]
+            self.file.write(head)
+            self.head_left -= len(head)
+            data = data[len(head):]
+        if not data:
+            return
+        self.tail.append(data)
+        self.tail_size += len(data)
+        # drop whole chunks from the front while the rest still covers the tail size
+        while self.tail and self.tail_size - len(self.tail[0]) >= self.tail_bytes:
+            self.tail_size -= len(self.tail[0])
+            self.dropped += len(self.tail.popleft())
+
+    def close(self):
+        tail = b"".join(self.tail)
+        if len(tail) > self.tail_bytes:
+            self.dropped += len(tail) - self.tail_bytes
+            tail = tail[len(tail) - self.tail_bytes:] if self.tail_bytes else b""
+        if self.dropped:
+            self.file.write(f"\n... [{self.dropped} bytes truncated] ...\n".encode())
+        self.file.write(tail)
+        self.file.close()
+
+
+# copy a pipe into the log (sync worker) until EOF or, with `proc` (a Popen), until it has exited
+# and the pipe stayed quiet for `interval`
+def pump(fd: int, writer: LogWriter, proc=None, interval: float = 0.1):
+    left = None  # reads left once proc exited
+    while left != 0:
+        if left is None and proc is not None and proc.poll() is not None:
+            left = DRAIN_READS
+        if proc is not None and not select.select([fd], [], [], interval)[0]:
+            if left is not None:
+                break
+            continue
+        data = os.read(fd, CHUNK)
+        if not data:
+            break
+        writer.write(data)
+        if left is not None:
+            left -= 1
+
+
+# pump() for the async worker: `reader` is an asyncio.StreamReader, `proc` an asyncio Process
+async def pump_async(reader, writer: LogWriter, proc, interval: float = 0.1):
+    left = None
+    while left != 0:
+        if left is None and proc.returncode is not None:
+            left = DRAIN_READS
+        try:
+            data = await asyncio.wait_for(reader.read(CHUNK), interval)
+        except asyncio.TimeoutError:
+            if left is not None:
+                break
+            continue
+        if not data:
+            break
+        writer.write(data)
+        if left is not None:
+            left -= 1
+
+
+# log file of one attempt: the given attempt number from job_attempts, otherwise the newest file
+def find_log(job_id: str, attempt: int = None):
+    if attempt is not None:
+        from queuectl.storage.db import get_connection
+        cur = get_connection().cursor()
+        cur.execute("SELECT log_path FROM job_attempts WHERE job_id = ? AND attempt = ?", (job_id, attempt))
+        row = cur.fetchone()
+        if not row:
+            raise ValueError(f"No attempt {attempt} recorded for job '{job_id}'.")
+        if not row["log_path"]:
+            raise ValueError(f"Attempt {attempt} of job '{job_id}' has no captured output.")
+        return row["log_path"]
+
+    directory = job_log_dir(job_id)
+    files = sorted(f for f in os.listdir(directory) if f.endswith(".log")) if os.path.isdir(directory) else []
+    if not files:
+        raise ValueError(f"No captured output for job '{job_id}'.")
+    return os.path.join(directory, files[-1])
+
+
+# write a log to `out` (a binary stream) through mmap, returns the bytes written
+def print_log(path: str, out=None, offset: int = 0) -> int:
+    out = out or sys.stdout.buffer
+    size = os.path.getsize(path)
+    if size <= offset:
+        return 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        for start in range(offset, size, CHUNK):
+            out.write(m[start:min(size, start + CHUNK)])
+    out.flush()
+    return size - offset
+
+
+# keep printing what the running attempt appends until it finishes
+def follow_log(path: str, still_running, out=None, interval: float = 0.25):
+    out = out or sys.stdout.buffer
+    offset = print_log(path, out)
+    while True:
+        running = still_running()
+        offset += print_log(path, out, offset)
+        if not running:
+            return
+        time.sleep(interval)
+
+
+# remove the logs of these jobs (gc, after their rows were archived)
+def remove_job_logs(job_ids):
+    for job_id in job_ids:
+        shutil.rmtree(job_log_dir(job_id), ignore_errors=True)
+
+
+def remove_log_files(paths):
+    for path in paths:
+        if not path:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+from queuectl.storage.db import get_connection, insert_attempt
+from queuectl.core.config_manager import get_config_int
+from queuectl.core.notify import notify_workers
+from queuectl.core.dag import cancel_dependents
+
+
+"""
+Claim Leases (jobs stuck in 'processing' after a worker died)
+
+- Every claim sets lease_expires_at = now + lease_seconds
+- Workers extend the leases of the jobs they hold from a heartbeat thread (every lease_seconds / 3)
+- The reaper (worker manager, every tick) returns expired 'processing' jobs to 'pending' in bounded
+  batches, counting the lost run as an attempt (DLQ once max_retries is reached)
+"""
+
+
+# extend this worker's leases, returns how many jobs it still holds
+def extend_leases(job_ids, lease_seconds: int = None) -> int:
+    job_ids = list(job_ids)
+    if not job_ids:
+        return 0
+    if lease_seconds is None:
+        lease_seconds = get_config_int("lease_seconds", 30)
+    conn = get_connection()
+    with conn:
+        return renew_leases(conn.cursor(), job_ids, time.time() + lease_seconds)
+
+
+# extend_leases inside the caller's transaction, for the claims of `owner`
+def renew_leases(cur, job_ids, until: float, owner: int = None) -> int:
+    if not job_ids:
+        return 0
+    placeholders = ",".join("?" * len(job_ids))
+    cur.execute(
+        f"UPDATE jobs SET lease_expires_at = ? "
+        f"WHERE state = 'processing' AND worker_pid = ? AND id IN ({placeholders})",
+        (until, os.getpid() if owner is None else owner, *job_ids),
+    )
+    return cur.rowcount
+
+
+# background heartbeat for the ids in `held` (a set the worker loop keeps current).
+# Returns the stop event, the thread uses its own connection (one per thread).
+# `extend(ids, lease_seconds)` renews them, broker workers pass one that asks the broker.
+def start_heartbeat(held: set, extend=extend_leases):
+    stop = threading.Event()
+
+    def beat():
+        while True:
+            lease_seconds = get_config_int("lease_seconds", 30)
+            if stop.wait(max(1.0, lease_seconds / 3)):
+                break
+            try:
+                extend(list(held), lease_seconds)  # list() snapshots the set under the GIL
+            except Exception as e:
+                print(f"[Worker {os.getpid()}] Heartbeat failed: {e}")
+
+    threading.Thread(target=beat, name="queuectl-heartbeat", daemon=True).start()
+    return stop
+
+
+# return expired 'processing' jobs to 'pending' (or 'dead'), in batches of reap_batch_size
+def reap_expired_leases(batch_size: int = None) -> int:
+    if batch_size is None:
+        batch_size = get_config_int("reap_batch_size", 500)
+    batch_size = max(1, batch_size)
+    conn = get_connection()
+    if not count_expired_leases():
+        return 0  # read only, no write lock taken on the usual empty pass
+    reaped = 0
+    while True:
+        now = time.time()
+        with conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE jobs
+                SET state = CASE WHEN attempts + 1 >= max_retries THEN 'dead' ELSE 'pending' END,
+                    attempts = attempts + 1,
+                    next_run_at = ?,
+                    updated_at = DATETIME('now')
+                WHERE id IN (
+                    SELECT id FROM jobs
+                    WHERE state = 'processing' AND lease_expires_at < ?
+                    LIMIT ?
+                )
+                RETURNING id, queue, command, state, worker_pid, claimed_at, lease_expires_at
+            """, (int(now), now, batch_size))
+            rows = cur.fetchall()
+            for r in rows:
+                if r["state"] == "dead":
+                    cancel_dependents(cur, r["id"])
+                insert_attempt(cur, {
+                    "job_id": r["id"],
+                    "queue": r["queue"],
+                    "command": r["command"],
+                    "worker_pid": r["worker_pid"],
+                    "claimed_at": r["claimed_at"],
+                    "finished_at": r["lease_expires_at"],
+                    "outcome": "lease_expired",
+                })
+        reaped += len(rows)
+        if len(rows) < batch_size:
+            break
+        time.sleep(0)  # let workers take the write lock between batches
+
+    if reaped:
+        notify_workers()
+    return reaped
+
+
+# 'processing' jobs whose lease has run out (not reaped yet). In-flight rows are few, the
+# state prefix of the existing indexes finds them, a dedicated lease index would only slow claims.
+def count_expired_leases() -> int:
+    cur = get_connection().cursor()
+    cur.execute(
+        "SELECT COUNT(*) AS n FROM jobs WHERE state = 'processing' AND lease_expires_at < ?",
+        (time.time(),),
+    )
+    return cur.fetchone()["n"]
+
+
+# jobs reclaimed by the reaper within the last window_s seconds
+def count_reclaimed(window_s: int = 3600) -> int:
+    cur = get_connection().cursor()
+    cur.execute(
+        "SELECT COUNT(*) AS n FROM job_attempts WHERE finished_at >= ? AND outcome = 'lease_expired'",
+        (time.time() - window_s,),
+    )
+    return cur.fetchone()["n"]
@@ -0,0 +1,130 @@
+import os
+import signal
+import threading
+from queuectl.core.config_manager import get_cached_config
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+
+"""
+Per-job Timeouts and Resource Limits (timeout_s, max_rss_mb, cpu_seconds)
+
+- Job fields override the job_timeout_s / job_max_rss_mb / job_cpu_seconds config defaults (0 = no limit)
+- timeout_s: a timer sends SIGTERM to the job's process group, SIGKILL kill_grace_s later
+- cpu_seconds: RLIMIT_CPU (the kernel sends SIGXCPU, then SIGKILL one second later)
+- max_rss_mb: RLIMIT_AS, Linux has no enforced RSS rlimit so the address space is capped instead
+- rlimits are set with prlimit() right after the spawn, which keeps the vfork fast path;
+  without prlimit they fall back to a preexec_fn
+- The failure reason ('timeout', 'cpu_limit', 'exit', 'error') is recorded with the attempt
+"""
+
+LIMIT_FIELDS = ("timeout_s", "max_rss_mb", "cpu_seconds")
+
+
+# effective limits of a claimed job, falsy values mean unlimited
+def job_limits(job) -> dict:
+    limits = {}
+    for field in LIMIT_FIELDS:
+        value = job.get(field)
+        if value is None:
+            value = get_cached_config(f"job_{field}", "0")
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            value = 0
+        limits[field] = value if value > 0 else None
+    return limits
+
+
+def validate_limits(job: dict):
+    for field in LIMIT_FIELDS:
+        if field not in job:
+            continue
+        value = job[field]
+        kinds = (int, float) if field == "timeout_s" else int
+        if isinstance(value, bool) or not isinstance(value, kinds) or value <= 0:
+            kind = "number" if field == "timeout_s" else "integer"
+            raise ValueError(f"'{field}' must be a positive {kind}.")
+
+
+def _rlimits(limits: dict):
+    if resource is None:
+        return []
+    rlimits = []
+    if limits.get("cpu_seconds"):
+        cpu = max(1, int(limits["cpu_seconds"]))
+        rlimits.append((resource.RLIMIT_CPU, (cpu, cpu + 1)))
+    if limits.get("max_rss_mb"):
+        size = int(limits["max_rss_mb"] * 1024 * 1024)
+        rlimits.append((resource.RLIMIT_AS, (size, size)))
+    return rlimits
+
+
+# Popen options for these limits, `default` unless rlimits need a preexec_fn (no prlimit())
+def spawn_options(limits: dict, default: dict) -> dict:
+    rlimits = _rlimits(limits)
+    if not rlimits or hasattr(resource, "prlimit"):
+        return default
+
+    def preexec():
+        os.setpgrp()
+        for which, value in rlimits:
+            resource.setrlimit(which, value)
+    return {"preexec_fn": preexec}
+
+
+# apply rlimits to a freshly spawned child (inherited by everything it starts)
+def apply_limits(pid: int, limits: dict):
+    if not hasattr(resource, "prlimit"):
+        return
+    for which, value in _rlimits(limits):
+        try:
+            resource.prlimit(pid, which, value)
+        except (ProcessLookupError, PermissionError):
+            pass  # already gone
+
+
+def kill_group(pgid: int, sig=signal.SIGKILL):
+    try:
+        os.killpg(pgid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+# timer that terminates the process group after timeout_s, returns (cancel, fired) or None
+def start_timeout(pgid: int, timeout_s: float):
+    if not timeout_s:
+        return None
+    fired = threading.Event()
+    grace = float(get_cached_config("kill_grace_s", "2") or 2)
+
+    def expire():
+        fired.set()
+        kill_group(pgid, signal.SIGTERM)
+        if not cancel.wait(grace):
+            kill_group(pgid, signal.SIGKILL)
+
+    cancel = threading.Event()
+    timer = threading.Timer(timeout_s, expire)
+    timer.daemon = True
+    timer.start()
+
+    def stop():
+        cancel.set()
+        timer.cancel()
+    return stop, fired
+
+
+# why a finished command failed, None on success
+def failure_reason(exit_code: int, limits: dict, timed_out: bool = False):
+    if timed_out:
+        return "timeout"
+    if exit_code == 0:
+        return None
+    if limits.get("cpu_seconds") and exit_code in (-signal.SIGXCPU, 128 + signal.SIGXCPU,
+                                                   -signal.SIGKILL, 128 + signal.SIGKILL):
+        return "cpu_limit"
+    return "exit"
@@ -0,0 +1,115 @@
+import os
+import glob
+import select
+import socket
+import time
+from queuectl.constants import WAKE_DIR, SCHEDULER_WAKE_DIR
+
+
+"""
+Local Wakeup Channel between Producers and Idle Workers
+
+- Each worker binds a Unix datagram socket under ~/.queuectl/wake/<pid>.sock
+- Enqueue / retry / DLQ retry send one byte to every socket there (fire and forget)
+- Idle workers block on their socket instead of sleeping a fixed poll_interval
+- Without AF_UNIX (or if binding fails) workers fall back to plain sleeps
+- Worker managers bind one under ~/.queuectl/wake/scheduler/, poked when schedules change
+"""
+
+
+# bind this process's wakeup socket (a worker's by default), None when unavailable
+def open_wake_socket(directory: str = WAKE_DIR, label: str = "Worker"):
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    path = os.path.join(directory, f"{os.getpid()}.sock")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        sock.setblocking(False)
+        return sock
+    except OSError as e:
+        print(f"[{label} {os.getpid()}] Wakeup socket unavailable ({e}), falling back to polling.")
+        return None
+
+
+def close_wake_socket(sock):
+    if sock is None:
+        return
+    path = sock.getsockname()
+    sock.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# block until a wakeup arrives or timeout (seconds) passes, True if woken
+def wait_for_wakeup(sock, timeout: float) -> bool:
+    timeout = max(0.0, timeout)
+    if sock is None:
+        time.sleep(timeout)
+        return False
+
+    ready, _, _ = select.select([sock], [], [], timeout)
+    if not ready:
+        return False
+    # drain, several producers may have poked us
+    try:
+        while sock.recv(64):
+            pass
+    except BlockingIOError:
+        pass
+    return True
+
+
+# wake one worker (by pid), e.g. so it notices a SIGTERM without waiting for its poll timeout
+def wake_worker(pid: int):
+    if not hasattr(socket, "AF_UNIX"):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(b"1", os.path.join(WAKE_DIR, f"{pid}.sock"))
+    except OSError:
+        pass
+    finally:
+        sock.close()
+
+
+# wake every idle worker on this host, never raises
+def notify_workers():
+    _notify_all(WAKE_DIR)
+
+
+# tell the worker managers' schedulers to reload their schedules
+def notify_scheduler():
+    _notify_all(SCHEDULER_WAKE_DIR)
+
+
+def _notify_all(directory: str):
+    if not hasattr(socket, "AF_UNIX"):
+        return
+    paths = glob.glob(os.path.join(directory, "*.sock"))
+    if not paths:
+        return
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        for path in paths:
+            try:
+                sock.sendto(b"1", path)
+            except BlockingIOError:
+                pass  # receiver buffer full, a wakeup is already pending
+            except (ConnectionRefusedError, FileNotFoundError):
+                # worker died without cleaning up
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            except OSError:
+                pass
+    finally:
+        sock.close()
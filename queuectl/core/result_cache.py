@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from queuectl.constants import CACHE_DIR
+from queuectl.storage.db import get_connection
+from queuectl.core.config_manager import get_config_int
+
+
+"""
+Content-addressed Result Cache ({"cacheable": true, "inputs": ["data/in.csv", ...]})
+
+- Key: sha256 over what the job runs (command / argv / callable + args) and, per input file,
+  its path, size, mtime and content hash, so touching or editing an input is a miss
+- Hit: the worker marks the job completed without spawning anything, the cached output is
+  hard-linked in as the attempt's log (reason 'cached' in job_attempts)
+- Only successful runs are stored, a failure may be transient and a cached one would burn
+  through the retries without ever running the job again
+- Entries: result_cache table + ~/.queuectl/cache/<key>.log, expire after cache_ttl_s,
+  least recently used ones are evicted once the outputs exceed cache_max_bytes
+- Hit / miss counters in cache_counters, shown by `status`
+"""
+
+# (path, size, mtime_ns) -> content sha256, inputs are only re-read when they change.
+# LRU, at most _MAX_DIGESTS entries: a long-running worker sees every version of every input.
+_digests = OrderedDict()
+_MAX_DIGESTS = 4096
+
+
+def _file_digest(path: str, st) -> str:
+    memo = (path, st.st_size, st.st_mtime_ns)
+    digest = _digests.get(memo)
+    if digest is not None:
+        _digests.move_to_end(memo)
+        return digest
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    digest = _digests[memo] = h.hexdigest()
+    if len(_digests) > _MAX_DIGESTS:
+        _digests.popitem(last=False)
+    return digest
+
+
+# cache key of a claimed cacheable job, None when an input can't be read (the job just runs)
+def cache_key(job):
+    inputs = json.loads(job["inputs"]) if job.get("inputs") else []
+    parts = {
+        "command": job["command"],
+        "argv": job.get("argv"),
+        "callable": job.get("callable"),
+        "call_args": job.get("call_args"),
+        "inputs": [],
+    }
+    try:
+        for path in inputs:
+            path = os.path.abspath(path)
+            st = os.stat(path)
+            parts["inputs"].append([path, st.st_size, st.st_mtime_ns, _file_digest(path, st)])
+    except OSError:
+        return None
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def _entry_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.log")
+
+
+def _count(cur, name: str):
+    cur.execute("UPDATE cache_counters SET value = value + 1 WHERE name = ?", (name,))
+
+
+# cached exit code for `key` (its output linked to log_path), None on a miss
+def lookup(key: str, log_path: str = None):
+    conn = get_connection()
+    cur = conn.cursor()
+    now = time.time()
+    with conn:
+        cur.execute(
+            "SELECT exit_code, has_output FROM result_cache WHERE key = ? AND created_at >= ?",
+            (key, now - get_config_int("cache_ttl_s", 86400)),
+        )
+        row = cur.fetchone()
+        if row and log_path and (not row["has_output"] or not _link(_entry_path(key), log_path)):
+            # stored without output (capture was off) or evicted under us: the attempt would point
+            # at a log that doesn't exist, run the job again
+            row = None
+        if row is None:
+            _count(cur, "misses")
+            return None
+        cur.execute("UPDATE result_cache SET last_used_at = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        _count(cur, "hits")
+    return row["exit_code"]
+
+
+# remember a successful run (its captured output, if any), then trim the cache
+def store(key: str, exit_code: int, log_path: str = None):
+    has_output = bool(log_path and os.path.exists(log_path))
+    size = 0
+    if has_output:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = f"{_entry_path(key)}.{os.getpid()}.tmp"
+        if not _link(log_path, tmp):
+            return
+        os.replace(tmp, _entry_path(key))
+        size = os.path.getsize(log_path)
+
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO result_cache (key, exit_code, has_output, size_bytes, created_at, last_used_at, hits)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+            ON CONFLICT(key) DO UPDATE SET
+                exit_code = excluded.exit_code,
+                has_output = excluded.has_output,
+                size_bytes = excluded.size_bytes,
+                created_at = excluded.created_at,
+                last_used_at = excluded.last_used_at
+            """,
+            (key, exit_code, int(has_output), size, now, now),
+        )
+    evict()
+
+
+# drop expired entries, then least recently used ones until the outputs fit cache_max_bytes
+def evict():
+    conn = get_connection()
+    cur = conn.cursor()
+    removed = []
+    with conn:
+        cur.execute(
+            "DELETE FROM result_cache WHERE created_at < ? RETURNING key",
+            (time.time() - get_config_int("cache_ttl_s", 86400),),
+        )
+        removed += [r["key"] for r in cur.fetchall()]
+
+        cur.execute("SELECT COALESCE(SUM(size_bytes), 0) AS total FROM result_cache")
+        excess = cur.fetchone()["total"] - get_config_int("cache_max_bytes", 268435456)
+        if excess > 0:
+            cur.execute("SELECT key, size_bytes FROM result_cache ORDER BY last_used_at")
+            victims = []
+            for row in cur.fetchall():
+                if excess <= 0:
+                    break
+                victims.append(row["key"])
+                excess -= row["size_bytes"]
+            cur.executemany("DELETE FROM result_cache WHERE key = ?", [(k,) for k in victims])
+            removed += victims
+
+    for key in removed:
+        try:
+            os.remove(_entry_path(key))
+        except OSError:
+            pass
+    return len(removed)
+
+
+# hard link (same filesystem, no copy), falling back to a copy
+def _link(src: str, dst: str) -> bool:
+    try:
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        try:
+            os.link(src, dst)
+        except OSError:
+            with open(src, "rb") as fin, open(dst, "wb") as fout:
+                while True:
+                    block = fin.read(1024 * 1024)
+                    if not block:
+                        break
+                    fout.write(block)
+        return True
+    except OSError:
+        return False
+
+
+# {entries, bytes, hits, misses} for `status`
+def cache_summary():
+    cur = get_connection().cursor()
+    cur.execute("SELECT COUNT(*) AS entries, COALESCE(SUM(size_bytes), 0) AS bytes FROM result_cache")
+    summary = dict(cur.fetchone())
+    cur.execute("SELECT name, value FROM cache_counters")
+    summary.update({r["name"]: r["value"] for r in cur.fetchall()})
+    return summary
@@ -0,0 +1,157 @@
+import os
+import time
+from datetime import datetime, timedelta
+from queuectl.storage.db import get_connection, DB_PATH
+from queuectl.core.config_manager import get_config_int, get_cached_config
+from queuectl.core.joblogs import remove_job_logs, remove_log_files
+
+
+"""
+Retention of Finished Jobs (queuectl gc, optional reaper in the worker manager)
+
+- Moves 'completed' / 'dead' / 'cancelled' jobs older than retention_days out of the hot jobs table
+- Target is the jobs_archive table, or a separate archive database file (archive_path)
+- Works in bounded batches, each its own short write transaction
+- Drops job_attempts timings older than the same window, captured logs go with their jobs / attempts
+- Optional vacuum: incremental when the database supports it, full VACUUM otherwise
+"""
+
+FINISHED_STATES = ("completed", "dead", "cancelled")
+ARCHIVE_TABLE = "jobs_archive"
+
+
+# archive every finished job older than the retention window, returns a report dict
+def run_gc(retention_days: int = None, batch_size: int = None, archive_path: str = None,
+           vacuum: bool = False):
+    if retention_days is None:
+        retention_days = get_config_int("retention_days", 7)
+    if batch_size is None:
+        batch_size = get_config_int("gc_batch_size", 500)
+    if archive_path is None:
+        archive_path = get_cached_config("archive_path", "")
+    batch_size = max(1, batch_size)
+
+    conn = get_connection()
+    schema = _attach_archive(conn, archive_path)
+    _sync_archive_columns(conn, schema)
+
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+    columns = ", ".join(_columns(conn, "main", "jobs"))
+    states = ",".join("?" * len(FINISHED_STATES))
+    size_before = _db_size(conn)
+
+    moved = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"SELECT id FROM jobs WHERE state IN ({states}) AND updated_at < ? LIMIT ?",
+                (*FINISHED_STATES, cutoff, batch_size),
+            )
+            ids = [r["id"] for r in cur.fetchall()]
+            if ids:
+                placeholders = ",".join("?" * len(ids))
+                cur.execute(
+                    f"INSERT INTO {schema}.{ARCHIVE_TABLE} ({columns}, archived_at) "
+                    f"SELECT {columns}, DATETIME('now') FROM jobs WHERE id IN ({placeholders})",
+                    ids,
+                )
+                cur.execute(f"DELETE FROM jobs WHERE id IN ({placeholders})", ids)
+                # their own dependency edges are spent (a finished job waits on nothing)
+                cur.execute(f"DELETE FROM job_dependencies WHERE child_id IN ({placeholders})", ids)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        remove_job_logs(ids)
+
+        moved += len(ids)
+        if len(ids) < batch_size:
+            break
+        time.sleep(0)  # let waiting writers (workers) take the lock between batches
+
+    # attempt timings past the same window (stats only look at recent ones)
+    attempts_cutoff = time.time() - retention_days * 86400
+    while True:
+        with conn:
+            deleted = conn.execute(
+                "DELETE FROM job_attempts WHERE rowid IN "
+                "(SELECT rowid FROM job_attempts WHERE finished_at < ? LIMIT ?) RETURNING log_path",
+                (attempts_cutoff, batch_size),
+            ).fetchall()
+        remove_log_files(r["log_path"] for r in deleted)
+        if len(deleted) < batch_size:
+            break
+        time.sleep(0)
+
+    freelist_bytes = _freelist_bytes(conn)
+    if vacuum:
+        vacuum_database(conn)
+    size_after = _db_size(conn)
+
+    return {
+        "status": "ok",
+        "moved": moved,
+        "cutoff": cutoff,
+        "archive": archive_path or f"{ARCHIVE_TABLE} table",
+        "bytes_reclaimed": max(0, size_before - size_after),
+        "bytes_free": _freelist_bytes(conn) if vacuum else freelist_bytes,
+    }
+
+
+# return free pages to the filesystem
+def vacuum_database(conn=None, step_pages: int = 1000):
+    conn = conn or get_connection()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        # incremental: free a bounded number of pages per statement
+        while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+            conn.execute(f"PRAGMA incremental_vacuum({step_pages})").fetchall()
+    else:
+        # full rebuild (also switches the file to incremental auto_vacuum, see db._apply_pragmas)
+        conn.execute("VACUUM")
+
+
+def _attach_archive(conn, archive_path: str) -> str:
+    if not archive_path:
+        return "main"
+    attached = {r["name"]: r["file"] for r in conn.execute("PRAGMA database_list").fetchall()}
+    if "archive" not in attached:
+        path = os.path.abspath(os.path.expanduser(archive_path))
+        if path == os.path.abspath(DB_PATH):
+            return "main"
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        conn.execute("PRAGMA archive.journal_mode = WAL")
+    return "archive"
+
+
+# archive table mirrors the jobs columns (added lazily as the jobs schema grows) + archived_at
+def _sync_archive_columns(conn, schema: str):
+    job_columns = conn.execute("PRAGMA main.table_info(jobs)").fetchall()
+    with conn:
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {schema}.{ARCHIVE_TABLE} (archived_at TEXT NOT NULL)"
+        )
+        existing = set(_columns(conn, schema, ARCHIVE_TABLE))
+        for col in job_columns:
+            if col["name"] not in existing:
+                conn.execute(
+                    f"ALTER TABLE {schema}.{ARCHIVE_TABLE} ADD COLUMN {col['name']} {col['type']}"
+                )
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {schema}.idx_{ARCHIVE_TABLE}_id ON {ARCHIVE_TABLE} (id)"
+        )
+
+
+def _columns(conn, schema: str, table: str):
+    return [r["name"] for r in conn.execute(f"PRAGMA {schema}.table_info({table})").fetchall()]
+
+
+def _db_size(conn) -> int:
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    return pages * conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+def _freelist_bytes(conn) -> int:
+    pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return pages * conn.execute("PRAGMA page_size").fetchone()[0]
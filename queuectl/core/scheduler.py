@@ -0,0 +1,285 @@
+import re
+import json
+import time
+import heapq
+import sqlite3
+from collections import deque
+from datetime import datetime, timedelta
+from queuectl.constants import SCHEDULER_WAKE_DIR
+from queuectl.storage.db import get_connection, insert_jobs
+from queuectl.core.config_manager import get_config_int
+from queuectl.core.job_manager import parse_job
+from queuectl.core.notify import open_wake_socket, close_wake_socket, wait_for_wakeup, notify_workers, notify_scheduler
+
+
+"""
+Recurring Jobs (queuectl schedule add|list|remove), fired by the worker manager
+
+- A schedule is a job template plus --cron "m h dom mon dow" (local time) or --every 30s / 5m / 2h / 1d
+- The manager keeps a min-heap of next fire times and sleeps until the earliest one (or a wakeup
+  from `schedule add/remove`), the schedules table is only re-read on a change or every
+  schedule_refresh_s, never per second
+- Due occurrences of all schedules are inserted in batched transactions as jobs '<name>@<fire time>'
+  with run_at = the fire time; the id makes a second insert of the same occurrence a no-op, so a
+  crash between the insert and advancing next_fire_at, or two managers, never run it twice
+- Misfires (occurrences more than schedule_misfire_grace_s late, e.g. after downtime):
+  run_once enqueues only the latest one, skip drops them all, catch_up enqueues each of them
+  (at most schedule_max_catchup)
+"""
+
+MISFIRE_POLICIES = ("run_once", "skip", "catch_up")
+
+_CRON_ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+# minute, hour, day of month, month, day of week (0 or 7 = Sunday)
+_CRON_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def _cron_field(text: str, lo: int, hi: int) -> set:
+    values = set()
+    for part in text.split(","):
+        m = re.fullmatch(r"(\*|(\d+)(?:-(\d+))?)(?:/(\d+))?", part)
+        if not m:
+            raise ValueError(f"Bad cron field '{text}'.")
+        if m.group(1) == "*":
+            start, end = lo, hi
+        else:
+            start = int(m.group(2))
+            end = int(m.group(3)) if m.group(3) else (hi if m.group(4) else start)
+        step = int(m.group(4) or 1)
+        if not lo <= start <= end <= hi or step < 1:
+            raise ValueError(f"Cron field '{text}' is out of range {lo}-{hi}.")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+# (minutes, hours, days, months, weekdays, any_day, any_weekday) of a 5-field cron expression
+def parse_cron(expr: str):
+    fields = _CRON_ALIASES.get(expr.strip(), expr).split()
+    if len(fields) != 5:
+        raise ValueError("Cron expression needs 5 fields: minute hour day-of-month month day-of-week.")
+    minutes, hours, days, months, weekdays = (
+        _cron_field(text, lo, hi) for text, (lo, hi) in zip(fields, _CRON_RANGES)
+    )
+    weekdays = {d % 7 for d in weekdays}
+    return minutes, hours, days, months, weekdays, fields[2] == "*", fields[4] == "*"
+
+
+# first time matching the cron spec strictly after `after` (epoch seconds)
+def next_cron(spec, after: float) -> float:
+    minutes, hours, days, months, weekdays, any_day, any_weekday = spec
+    t = datetime.fromtimestamp(after).replace(second=0, microsecond=0) + timedelta(minutes=1)
+    give_up = t + timedelta(days=5 * 366)
+    while t < give_up:
+        if t.month not in months:
+            t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            continue
+        # like cron: with both day fields restricted, either one matching is enough
+        day_match = t.day in days
+        weekday_match = (t.weekday() + 1) % 7 in weekdays
+        if any_day or any_weekday:
+            day_ok = day_match and weekday_match
+        else:
+            day_ok = day_match or weekday_match
+        if not day_ok:
+            t = t.replace(hour=0, minute=0) + timedelta(days=1)
+        elif t.hour not in hours:
+            t = t.replace(minute=0) + timedelta(hours=1)
+        elif t.minute not in minutes:
+            t += timedelta(minutes=1)
+        else:
+            return t.timestamp()
+    raise ValueError("Cron expression never fires.")
+
+
+# "90", "30s", "5m", "2h", "1d" -> seconds
+def parse_every(text) -> float:
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*", str(text))
+    if not m:
+        raise ValueError("--every takes a duration like 30s, 5m, 2h or 1d.")
+    seconds = float(m.group(1)) * _UNITS[m.group(2) or "s"]
+    if seconds < 1:
+        raise ValueError("--every must be at least 1 second.")
+    return seconds
+
+
+# fire time following `fired_at` for a schedules row
+def _following(row, fired_at: float) -> float:
+    if row["every_s"]:
+        return fired_at + row["every_s"]
+    return next_cron(parse_cron(row["cron"]), fired_at)
+
+
+def add_schedule(name: str, job_json: str, cron: str = None, every: str = None, misfire: str = "run_once"):
+    if not name or not name.strip() or "@" in name:
+        raise ValueError("Schedule name must be a non-empty string without '@'.")
+    if (cron is None) == (every is None):
+        raise ValueError("Give exactly one of --cron or --every.")
+    if misfire not in MISFIRE_POLICIES:
+        raise ValueError(f"--misfire must be one of {', '.join(MISFIRE_POLICIES)}.")
+    try:
+        template = json.loads(job_json)
+    except json.JSONDecodeError:
+        raise ValueError("Invalid JSON. Example: {\"command\": \"./nightly.sh\"}")
+    if not isinstance(template, dict):
+        raise ValueError("Job must be a JSON object.")
+    if "id" in template or "run_at" in template:
+        raise ValueError(f"Leave out 'id' and 'run_at', each occurrence runs as '{name}@<fire time>'.")
+    parse_job(dict(template, id=f"{name}@0"))
+
+    now = time.time()
+    every_s = parse_every(every) if every is not None else None
+    next_fire_at = now + every_s if every_s else next_cron(parse_cron(cron), now)
+
+    conn = get_connection()
+    with conn:
+        cur = conn.execute(
+            """
+            INSERT INTO schedules (name, job, cron, every_s, misfire, next_fire_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                job = excluded.job,
+                cron = excluded.cron,
+                every_s = excluded.every_s,
+                misfire = excluded.misfire,
+                next_fire_at = excluded.next_fire_at
+            RETURNING created_at
+            """,
+            (name, json.dumps(template), cron, every_s, misfire, next_fire_at, now),
+        )
+        replaced = cur.fetchone()["created_at"] != now
+    notify_scheduler()
+    return {"status": "updated" if replaced else "added", "name": name, "next_fire_at": next_fire_at}
+
+
+def remove_schedule(name: str):
+    conn = get_connection()
+    with conn:
+        cur = conn.execute("DELETE FROM schedules WHERE name = ?", (name,))
+    if not cur.rowcount:
+        raise ValueError(f"No schedule named '{name}'.")
+    notify_scheduler()
+    return {"status": "removed", "name": name}
+
+
+def list_schedules():
+    cur = get_connection().cursor()
+    cur.execute("SELECT * FROM schedules ORDER BY next_fire_at, name")
+    return [dict(r) for r in cur.fetchall()]
+
+
+# Occurrences of `row` to enqueue at `now`, and the fire time after them. Due ones that are all
+# within schedule_misfire_grace_s are enqueued as they are; once the oldest is later than that the
+# schedule misfired and its policy decides.
+def occurrences(row, now: float, grace: float, max_catchup: int):
+    due = deque(maxlen=max(1, max_catchup))  # catch_up enqueues only the newest ones
+    t = row["next_fire_at"]
+    misfired = now - t > grace
+    if row["every_s"] and misfired:
+        # long downtime: jump over occurrences that no policy would enqueue
+        t += max(0, int((now - t) // row["every_s"]) - due.maxlen) * row["every_s"]
+    while t <= now:
+        due.append(t)
+        t = _following(row, t)
+
+    fires = list(due)
+    if misfired and row["misfire"] == "run_once":
+        fires = fires[-1:]
+    elif misfired and row["misfire"] == "skip":
+        # the newest one still runs if it is itself on time
+        fires = [f for f in fires[-1:] if now - f <= grace]
+    return fires, t
+
+
+# Scheduler state of one worker manager: {"heap": [(next_fire_at, name)], "rows": {name: row},
+# "sock": wakeup socket, "refresh_at": monotonic time of the next safety reload}
+def open_scheduler():
+    state = {"heap": [], "rows": {}, "sock": open_wake_socket(SCHEDULER_WAKE_DIR, "Manager"), "refresh_at": 0.0}
+    load_schedules(state)
+    return state
+
+
+def close_scheduler(state):
+    close_wake_socket(state["sock"])
+
+
+def load_schedules(state):
+    state["rows"] = {row["name"]: row for row in list_schedules()}
+    state["heap"] = [(row["next_fire_at"], name) for name, row in state["rows"].items()]
+    heapq.heapify(state["heap"])
+    state["refresh_at"] = time.monotonic() + get_config_int("schedule_refresh_s", 60)
+
+
+# Enqueue everything that is due. All due schedules go into the same batched inserts, then their
+# next_fire_at moves on (compare-and-set, a schedule changed meanwhile is left alone and reloaded).
+# Returns the number of jobs inserted.
+def fire_due_schedules(state, now: float = None) -> int:
+    now = time.time() if now is None else now
+    heap, rows = state["heap"], state["rows"]
+    due = []
+    while heap and heap[0][0] <= now:
+        fire_at, name = heapq.heappop(heap)
+        row = rows.get(name)
+        if row is not None and row["next_fire_at"] == fire_at:
+            due.append(row)
+    if not due:
+        return 0
+
+    grace = get_config_int("schedule_misfire_grace_s", 60)
+    max_catchup = get_config_int("schedule_max_catchup", 100)
+    jobs, advanced = [], []
+    for row in due:
+        fires, next_fire_at = occurrences(row, now, grace, max_catchup)
+        template = json.loads(row["job"])
+        for fire_at in fires:
+            try:
+                jobs.append((row["name"], parse_job(dict(template, id=f"{row['name']}@{int(fire_at)}", run_at=fire_at))))
+            except ValueError as e:
+                print(f"[Manager] Schedule '{row['name']}' has an invalid job: {e}")
+                break
+        advanced.append((row, next_fire_at, fires[-1] if fires else row["last_fire_at"]))
+
+    inserted = 0
+    batch_size = get_config_int("enqueue_batch_size", 1000)
+    for i in range(0, len(jobs), batch_size):
+        count, _, _, rejected = insert_jobs(jobs[i:i + batch_size])
+        inserted += count  # duplicates: another manager (or a run before a crash) already did it
+        for name, message in rejected:
+            print(f"[Manager] Schedule '{name}' job not enqueued: {message}")
+
+    conn = get_connection()
+    with conn:
+        for row, next_fire_at, last_fire_at in advanced:
+            cur = conn.execute(
+                "UPDATE schedules SET next_fire_at = ?, last_fire_at = ? WHERE name = ? AND next_fire_at = ?",
+                (next_fire_at, last_fire_at, row["name"], row["next_fire_at"]),
+            )
+            if cur.rowcount:
+                row.update(next_fire_at=next_fire_at, last_fire_at=last_fire_at)
+                heapq.heappush(heap, (next_fire_at, row["name"]))
+            else:
+                state["refresh_at"] = 0.0
+    if inserted:
+        notify_workers()
+    return inserted
+
+
+# Sleep until the earliest fire time, at most max_wait seconds. A `schedule add/remove`
+# wakeup (or the schedule_refresh_s safety net) reloads the schedules.
+def wait_for_schedules(state, max_wait: float):
+    timeout = max_wait
+    if state["heap"]:
+        timeout = min(timeout, state["heap"][0][0] - time.time())
+    if wait_for_wakeup(state["sock"], timeout) or time.monotonic() >= state["refresh_at"]:
+        try:
+            load_schedules(state)
+        except sqlite3.Error as e:
+            print(f"[Manager] Reloading schedules failed: {e}")
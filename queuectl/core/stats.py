@@ -0,0 +1,122 @@
+import os
+import time
+from queuectl.storage.db import get_connection, iter_attempts
+
+
+"""
+Lifecycle Statistics (queuectl stats)
+
+- Reads the per-attempt timings the workers record in job_attempts
+- Queue wait (due -> started) and run time (started -> finished) percentiles over a time window
+- Grouped per queue or per command
+- Prometheus textfile export for node_exporter's textfile collector
+"""
+
+QUANTILES = (50, 95, 99)
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+# "90s" / "15m" / "1h" / "7d" (plain numbers are seconds) -> seconds
+def parse_window(value: str) -> int:
+    value = str(value).strip().lower()
+    unit = _UNITS.get(value[-1:]) if value else None
+    try:
+        seconds = int(float(value[:-1] if unit else value) * (unit or 1))
+    except ValueError:
+        raise ValueError(f"Invalid window '{value}'. Use e.g. 90s, 15m, 1h or 7d.")
+    if seconds <= 0:
+        raise ValueError("Window must be positive.")
+    return seconds
+
+
+# nearest-rank percentile of an already sorted list
+def nearest_rank(ordered, p: float):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(len(ordered) * p / 100 + 0.5) - 1))]
+
+
+# {group: {attempts, failed, timeouts, queue_wait_ms: {p50, p95, p99}, run_ms: {...}}} over the last window_s seconds
+def collect_stats(window_s: int = 3600, by: str = "queue"):
+    if by not in ("queue", "command"):
+        raise ValueError("Group by must be 'queue' or 'command'.")
+
+    groups = {}
+    for row in iter_attempts(since=time.time() - window_s):
+        g = groups.setdefault(row[by], {"attempts": 0, "failed": 0, "timeouts": 0, "waits": [], "runs": []})
+        g["attempts"] += 1
+        if row["outcome"] != "completed":
+            g["failed"] += 1
+        if row.get("reason") == "timeout":
+            g["timeouts"] += 1
+        if row["queue_wait_ms"] is not None:
+            g["waits"].append(row["queue_wait_ms"])
+        if row["duration_ms"] is not None:
+            g["runs"].append(row["duration_ms"])
+
+    stats = {}
+    for name in sorted(groups):
+        g = groups[name]
+        waits, runs = sorted(g["waits"]), sorted(g["runs"])
+        stats[name] = {
+            "attempts": g["attempts"],
+            "failed": g["failed"],
+            "timeouts": g["timeouts"],
+            "queue_wait_ms": {f"p{q}": nearest_rank(waits, q) for q in QUANTILES},
+            "run_ms": {f"p{q}": nearest_rank(runs, q) for q in QUANTILES},
+            "queue_wait_ms_sum": sum(waits),
+            "run_ms_sum": sum(runs),
+            # samples behind each sum: attempts without a start (lease expired) have no wait / run
+            "queue_wait_ms_count": len(waits),
+            "run_ms_count": len(runs),
+        }
+    return stats
+
+
+# Prometheus text exposition of per-queue stats plus the current job counts.
+# Written to a temp file and renamed, node_exporter never reads a half-written file.
+def write_prometheus(path: str, window_s: int = 3600):
+    lines = [
+        "# HELP queuectl_jobs Jobs per queue and state.",
+        "# TYPE queuectl_jobs gauge",
+    ]
+    cur = get_connection().cursor()
+    cur.execute("SELECT queue, state, count FROM job_counts ORDER BY queue, state")
+    for r in cur.fetchall():
+        lines.append(f'queuectl_jobs{{queue="{_label(r["queue"])}",state="{r["state"]}"}} {r["count"]}')
+
+    stats = collect_stats(window_s, by="queue")
+    for metric, key, help_text in (
+        ("queuectl_job_queue_wait_seconds", "queue_wait_ms", "Time from due to start"),
+        ("queuectl_job_run_seconds", "run_ms", "Time from start to finish"),
+    ):
+        lines.append(f"# HELP {metric} {help_text}, attempts finished in the last {window_s}s.")
+        lines.append(f"# TYPE {metric} summary")
+        for queue, s in stats.items():
+            label = f'queue="{_label(queue)}"'
+            for q in QUANTILES:
+                value = s[key][f"p{q}"]
+                if value is not None:
+                    lines.append(f'{metric}{{{label},quantile="{q / 100}"}} {value / 1000}')
+            lines.append(f"{metric}_sum{{{label}}} {s[key + '_sum'] / 1000}")
+            lines.append(f"{metric}_count{{{label}}} {s[key + '_count']}")
+
+    lines.append(f"# HELP queuectl_job_attempts_failed Failed attempts in the last {window_s}s.")
+    lines.append("# TYPE queuectl_job_attempts_failed gauge")
+    for queue, s in stats.items():
+        lines.append(f'queuectl_job_attempts_failed{{queue="{_label(queue)}"}} {s["failed"]}')
+
+    lines.append(f"# HELP queuectl_job_attempts_timed_out Attempts killed by their timeout in the last {window_s}s.")
+    lines.append("# TYPE queuectl_job_attempts_timed_out gauge")
+    for queue, s in stats.items():
+        lines.append(f'queuectl_job_attempts_timed_out{{queue="{_label(queue)}"}} {s["timeouts"]}')
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp, path)
+    return path
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -1,11 +1,22 @@
 import os
+import sys
+import json
 import time
 import subprocess
 import signal
-from datetime import datetime, timedelta
-from queuectl.storage.db import get_connection
-from queuectl.core.job_manager import retry_job
-from queuectl.storage.db import get_config_value
+import random
+from collections import deque
+from queuectl.storage.db import get_connection, insert_attempt
+from queuectl.core.job_manager import record_retry
+from queuectl.core.notify import open_wake_socket, close_wake_socket, wait_for_wakeup, notify_workers
+from queuectl.core.config_manager import get_config_int
+from queuectl.core.lease import start_heartbeat
+from queuectl.core.callables import run_callable, preload_modules, shutdown_pool
+from queuectl.core.joblogs import LogWriter, pump, new_log_path, capture_enabled
+from queuectl.core.concurrency import has_limits, load_gate, blocked_keys, admit, save_gate, retry_after
+from queuectl.core.result_cache import cache_key, lookup as cache_lookup, store as cache_store
+from queuectl.core.dag import release_dependents
+from queuectl.core.limits import job_limits, spawn_options, apply_limits, start_timeout, failure_reason
 import queuectl.constants as constants
 from queuectl.constants import SHUTDOWN_FILE
 
@@ -17,7 +28,8 @@ Each Worker's Functionality
 - Fetch Job (atomically, to avoid duplicate Jobs being executed)
 - Implementation of Exponential Backoff while Fetching Job
 - Executing Commands
-- Worker in Loop to execute commands coming in future (with polling to limit resource consumption)
+- Worker in Loop to execute commands coming in future (idle workers sleep until the next due job
+  or a wakeup from a producer, polling only as a fallback)
 """
 
 
@@ -39,86 +51,453 @@ signal.signal(signal.SIGINT, handle_sigterm)
 signal.signal(signal.SIGTERM, handle_sigterm)
 
 
+# claim failures since process start, by kind ('database is locked' vs anything else)
+claim_errors = {"locked": 0, "other": 0}
+# concurrency keys whose due jobs the last claim had to leave pending -> epoch to try them again
+# (their next token, or poll_interval for a full key; a keyed job finishing sends a wakeup).
+# Only those keys wait, every other job is claimed as soon as it is due.
+claim_held = {}
+
+
 # fetching jobs with locking (using SQLite3's to prevent duplicate execution)
-# Also atomically claim one pending job whose retry delay has elapsed. (implementation of execution delay)
-# if using force job then skip the execution delay
-def fetch_next_job():
+# Atomically claim up to `limit` pending jobs whose next_run_at has passed (retry delay already
+# folded into next_run_at by retry_job / retry_dlq / enqueue), highest priority first within a queue.
+# `queues` is an optional [(name, weight), ...] list (default: every queue with pending jobs, equal
+# weights): queues are tried in a weighted random order, each with one indexed UPDATE, all inside
+# one transaction.
+# While concurrency limits exist the transaction starts IMMEDIATE, so the in-flight counts and
+# token buckets it reads can't change before its own claims commit.
+def fetch_next_jobs(limit: int = 1, queues=None):
+    global claim_held
     conn = get_connection()
     cur = conn.cursor()
     try:
-        base = get_config_value("exp_backoff_base") or 2
-        conn.execute("BEGIN IMMEDIATE;")
-
-        cur.execute("""
-            SELECT id, command, attempts, max_retries, updated_at, force_retry
-            FROM jobs
-            WHERE state='pending'
-            ORDER BY created_at ASC
-        """)
-        jobs = cur.fetchall()
-
-        selected_job = None
-        now = datetime.utcnow()
-
-        for job in jobs:
-            attempts = int(job["attempts"])
-            force_retry = int(job["force_retry"])
-
-            if force_retry == 1:
-                selected_job = job
-                break
-
-            delay_seconds = base ** attempts if attempts > 0 else 0
-            updated_at = datetime.fromisoformat(job["updated_at"]) if job["updated_at"] else now
-
-            if now >= updated_at + timedelta(seconds=delay_seconds):
-                print("Ran after", delay_seconds, "seconds")
-                selected_job = job
-                break
-
-        if not selected_job:
-            conn.rollback()
-            conn.close()
-            return None
-
-        cur.execute("""
-            UPDATE jobs
-            SET state='processing', updated_at=DATETIME('now')
-            WHERE id=? AND state='pending'
-        """, (selected_job["id"],))
-
-        if cur.rowcount == 0:
-            conn.rollback()
-            conn.close()
-            return None
-
+        limited = has_limits(cur)
+        if limited:
+            conn.execute("BEGIN IMMEDIATE;")
+        claimed, claim_held = claim_jobs(cur, limit, queues, limited=limited)
         conn.commit()
-        return dict(selected_job)
+        return claimed
 
     except Exception as e:
         conn.rollback()
+        claim_errors["locked" if "locked" in str(e) else "other"] += 1
         print(f"[Worker {os.getpid()}] Error during job fetch: {e}")
+        return []
+
+
+# The claim itself, inside the caller's transaction (IMMEDIATE when `limited`, the broker runs
+# many workers' claims in one). `owner` is the worker_pid recorded on the claimed rows.
+# Returns (jobs, held): held maps the limited keys that actually kept a due job from being claimed
+# to when to try them again, so idle workers don't spin on those jobs' due time.
+def claim_jobs(cur, limit: int, queues=None, owner: int = None, limited: bool = None):
+    owner = os.getpid() if owner is None else owner
+    if limited is None:
+        limited = has_limits(cur)
+    now = time.time()
+    lease_until = now + get_config_int("lease_seconds", 30)
+    gate = load_gate(cur, now) if limited else None
+    claimed, held_keys = [], set()
+    for queue in weighted_queue_order(queues or _pending_queues(cur)):
+        claimed += _claim_admitted(cur, gate, now, lease_until, limit - len(claimed), queue, owner, held_keys)
+        if len(claimed) >= limit:
+            break
+    if gate:
+        save_gate(cur, gate, now)
+
+    held = {}
+    for key in held_keys:
+        wait = retry_after(gate[key])
+        held[key] = now + (wait if wait is not None else get_config_int("poll_interval", 2))
+    return claimed, held
+
+
+# queues that currently have pending jobs, from the trigger-maintained counters
+def _pending_queues(cur):
+    cur.execute("SELECT queue FROM job_counts WHERE state='pending' AND count > 0")
+    return [(r["queue"], 1.0) for r in cur.fetchall()]
+
+
+def _claim(cur, now: float, lease_until: float, limit: int, queue: str, owner: int, blocked=()):
+    # jobs of keys at their concurrency / rate limit are skipped by the claim itself
+    skip = ""
+    if blocked:
+        skip = f"AND (concurrency_key IS NULL OR concurrency_key NOT IN ({','.join('?' * len(blocked))}))"
+    # One seek per pending priority level, highest first: within a level the dispatch index is in
+    # next_run_at order, so the due rows are a range and not-yet-due ones (backoff, run_at) are never
+    # walked. Finding the next level is one more seek on the same index.
+    claimed = []
+    level = None
+    while len(claimed) < limit:
+        cur.execute(
+            "SELECT priority FROM jobs WHERE state='pending' AND queue = ? "
+            + ("AND priority < ? " if level is not None else "")
+            + "ORDER BY priority DESC LIMIT 1",
+            (queue, level) if level is not None else (queue,),
+        )
+        row = cur.fetchone()
+        if row is None:
+            break
+        level = row["priority"]
+        cur.execute(f"""
+            UPDATE jobs
+            SET state='processing', updated_at=DATETIME('now'), claimed_at=?, worker_pid=?, lease_expires_at=?
+            WHERE id IN (
+                SELECT id FROM jobs
+                WHERE state='pending' AND queue = ? AND priority = ? AND next_run_at <= ? {skip}
+                ORDER BY next_run_at, created_at
+                LIMIT ?
+            )
+            RETURNING id, command, attempts, max_retries, updated_at, force_retry, next_run_at, created_at,
+                      queue, priority, enqueued_at, claimed_at, worker_pid, argv, callable, call_args,
+                      timeout_s, max_rss_mb, cpu_seconds, concurrency_key, cacheable, inputs
+        """, (now, owner, lease_until, queue, level, int(now), *blocked, limit - len(claimed)))
+        # RETURNING order is unspecified, restore claim order
+        claimed += sorted((dict(r) for r in cur.fetchall()), key=lambda j: (j["next_run_at"], j["created_at"]))
+    return claimed
+
+
+# claim from one queue within the concurrency limits. A multi-row claim can take more jobs of a key
+# than it has room for: those go straight back to pending (same transaction) and the claim repeats
+# with that key blocked, at most once per limited key.
+# Keys that held back a due job of this queue (put back, or skipped by a short claim) go into `held`.
+def _claim_admitted(cur, gate, now: float, lease_until: float, limit: int, queue: str, owner: int,
+                    held: set = None):
+    if gate is None:
+        return _claim(cur, now, lease_until, limit, queue, owner)
+    held = set() if held is None else held
+    admitted = []
+    while len(admitted) < limit:
+        jobs = _claim(cur, now, lease_until, limit - len(admitted), queue, owner, blocked_keys(gate))
+        ok, rejected = admit(gate, jobs)
+        admitted += ok
+        if not rejected:
+            break
+        held.update(j["concurrency_key"] for j in rejected)
+        ids = [j["id"] for j in rejected]
+        cur.execute(
+            f"UPDATE jobs SET state='pending', claimed_at=NULL, worker_pid=NULL, lease_expires_at=NULL "
+            f"WHERE id IN ({','.join('?' * len(ids))})",
+            ids,
+        )
+    if len(admitted) < limit:
+        # the claim ran out of due jobs: did a blocked key leave one behind?
+        for key in set(blocked_keys(gate)) - held:
+            cur.execute(
+                "SELECT 1 FROM jobs WHERE state='pending' AND queue = ? AND next_run_at <= ? "
+                "AND concurrency_key = ? LIMIT 1",
+                (queue, int(now), key),
+            )
+            if cur.fetchone():
+                held.add(key)
+    return admitted
+
+
+# "high:5,default" -> [("high", 5.0), ("default", 1.0)]
+def parse_queues(spec: str):
+    if not spec:
         return None
-    finally:
-        conn.close()
+    queues = []
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition(":")
+        if not name:
+            continue
+        try:
+            weight = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError(f"Invalid weight in queue spec '{part}'.")
+        if weight <= 0:
+            raise ValueError(f"Queue weight must be positive in '{part}'.")
+        queues.append((name, weight))
+    return queues or None
 
 
+# weighted random permutation (each pick proportional to its weight among the remaining ones)
+def weighted_queue_order(queues):
+    return [name for name, weight in
+            sorted(queues, key=lambda q: random.random() ** (1.0 / q[1]), reverse=True)]
 
-# execute the command using subprocess
-def execute_command(cmd: str):
+
+# claim a single job (None when nothing is due)
+def fetch_next_job():
+    jobs = fetch_next_jobs(1)
+    return jobs[0] if jobs else None
+
+
+# hand claimed-but-never-started jobs back to the queue (prefetch buffer on shutdown)
+def release_jobs(job_ids):
+    if not job_ids:
+        return 0
+    conn = get_connection()
+    with conn:
+        released = requeue_claims(conn.cursor(), job_ids)
+    if released:
+        notify_workers()
+    return released
+
+
+# release_jobs inside the caller's transaction, for the claims of `owner`
+def requeue_claims(cur, job_ids, owner: int = None) -> int:
+    if not job_ids:
+        return 0
+    placeholders = ",".join("?" * len(job_ids))
+    cur.execute(
+        f"UPDATE jobs SET state='pending', claimed_at=NULL, worker_pid=NULL, lease_expires_at=NULL, "
+        f"updated_at=DATETIME('now') "
+        f"WHERE state='processing' AND worker_pid=? AND id IN ({placeholders})",
+        [os.getpid() if owner is None else owner, *job_ids],
+    )
+    return cur.rowcount
+
+
+# epoch of the earliest pending job (index on (state, queue, next_run_at)), None if nothing is pending.
+# Jobs of the `exclude` concurrency keys don't count.
+def next_due_at(queues=None, exclude=()):
+    cur = get_connection().cursor()
+    dues = []
+    for name, _ in queues or _pending_queues(cur):
+        if exclude:
+            # walks the index in due order, past the excluded keys' jobs only
+            cur.execute(
+                f"SELECT next_run_at AS due FROM jobs WHERE state='pending' AND queue=? "
+                f"AND (concurrency_key IS NULL OR concurrency_key NOT IN ({','.join('?' * len(exclude))})) "
+                f"ORDER BY next_run_at LIMIT 1",
+                (name, *exclude),
+            )
+            row = cur.fetchone()
+            due = row["due"] if row else None
+        else:
+            cur.execute("SELECT MIN(next_run_at) AS due FROM jobs WHERE state='pending' AND queue=?", (name,))
+            due = cur.fetchone()["due"]
+        if due is not None:
+            dues.append(due)
+    return min(dues) if dues else None
+
+
+# when an idle worker should claim next: the earliest due job of any key the last claim didn't
+# hold back, or the retry time of a held key (`held` defaults to this worker's claim_held)
+def next_claim_at(queues=None, held=None):
+    held = claim_held if held is None else held
+    due = next_due_at(queues, tuple(held))
+    if held:
+        retry = min(held.values())
+        due = retry if due is None else min(due, retry)
+    return due
+
+
+def should_stop():
+    return constants.SHUTDOWN or os.path.exists(SHUTDOWN_FILE)
+
+
+# idle wait: until the earliest next_run_at, a wakeup from a producer, or the stop flag.
+# Every poll_interval the due time is re-read (read only, no write lock) in case a wakeup was missed.
+def wait_for_work(wake_sock, queues=None):
+    while not should_stop():
+        poll_interval = get_config_int("poll_interval", 2)
+        due = next_claim_at(queues)
+        now = time.time()
+        if due is not None and due <= now:
+            return
+        timeout = poll_interval if due is None else min(poll_interval, due - now)
+        if wait_for_wakeup(wake_sock, timeout):
+            return
+
+
+
+# Own process group per job (a Ctrl+C on the worker doesn't reach it) without preexec_fn,
+# which forces CPython off its vfork / posix_spawn fast path and costs a full fork per job
+if sys.version_info >= (3, 11):
+    SPAWN_OPTIONS = {"process_group": 0}
+else:
+    SPAWN_OPTIONS = {"start_new_session": True}
+
+
+# argv list of an argv job, None for shell commands
+def job_argv(job):
+    return json.loads(job["argv"]) if job.get("argv") else None
+
+
+# execute the command using subprocess, returns (exit code, failure reason); the code is -1 if it
+# could not be run, the reason None on success (see limits.failure_reason).
+# With argv the program is executed directly, no /bin/sh in between.
+# With log_path stdout + stderr are streamed into that capped log instead of the worker's terminal.
+# `limits` (limits.job_limits) adds rlimits and a timeout that kills the job's process group.
+def run_command(cmd: str, argv=None, log_path: str = None, limits: dict = None):
+    args = argv or cmd
+    limits = limits or {}
+    timeout = None
     try:
         # result = subprocess.run(cmd, shell=True)
-        result = subprocess.run(cmd, shell=True, preexec_fn=os.setpgrp)
-        return result.returncode == 0
+        output = {}
+        writer = None
+        if log_path:
+            writer = LogWriter(log_path)
+            output = {"stdin": subprocess.DEVNULL, "stdout": subprocess.PIPE, "stderr": subprocess.STDOUT}
+        try:
+            proc = subprocess.Popen(args, shell=not argv, **output,
+                                    **spawn_options(limits, SPAWN_OPTIONS))
+            apply_limits(proc.pid, limits)
+            timeout = start_timeout(proc.pid, limits.get("timeout_s"))
+            if writer:
+                with proc.stdout:
+                    pump(proc.stdout.fileno(), writer, proc)
+            exit_code = proc.wait()
+        finally:
+            if writer:
+                writer.close()
+            if timeout:
+                timeout[0]()
+        return exit_code, failure_reason(exit_code, limits, bool(timeout and timeout[1].is_set()))
     except Exception as e:
         print(f"[Worker {os.getpid()}] Command error: {e}")
+        return -1, "error"
+
+
+# run a claimed job of any kind (callable, argv or shell command), returns (exit code, failure reason).
+# A cacheable job whose key is in the result cache doesn't run at all (reason 'cached').
+# Broker workers pass use_cache=False, the cache lives next to the database.
+def execute_job(job, log_path: str = None, use_cache: bool = True):
+    key = cache_key(job) if use_cache and job.get("cacheable") else None
+    if key:
+        exit_code = cache_lookup(key, log_path)
+        if exit_code is not None:
+            return exit_code, "cached"
+
+    if job.get("callable"):
+        exit_code, reason = run_callable(job)
+    else:
+        exit_code, reason = run_command(job["command"], job_argv(job), log_path, job_limits(job))
+    if key and exit_code == 0 and reason is None:
+        cache_store(key, exit_code, log_path)
+    return exit_code, reason
+
+
+# pre-run bookkeeping for a claimed job, False when the job must not run.
+# count_forced=False when the claim already counted a forced run (the broker does).
+def start_job(job, count_forced: bool = True) -> bool:
+    pid = os.getpid()
+    job_id = job["id"]
+
+    # attempts / max_retries / force_retry come back from the claim itself
+    attempts = int(job["attempts"])
+    max_retries = int(job["max_retries"])
+    force_retry = int(job["force_retry"])
+
+    if attempts > max_retries and not force_retry:
+        print(f"[Worker {pid}] Skipping job {job_id} (exceeded max retries).")
         return False
 
+    if force_retry and count_forced:
+        conn = get_connection()
+        with conn:
+            conn.execute("UPDATE jobs SET attempts = attempts + 1 WHERE id=?", (job_id,))
+        print(f"[Worker {pid}] Force retry: incremented attempts for job {job_id}.")
+    return True
+
+
+# timing of one execution, stored in job_attempts with the outcome.
+# Queue wait runs from when the job became due (enqueue, or the end of its backoff) to its start.
+def attempt_record(job, exit_code: int, started_at: float, finished_at: float = None,
+                   log_path: str = None, reason: str = None, owner: int = None) -> dict:
+    finished_at = finished_at or time.time()
+    ready_at = max(job.get("enqueued_at") or 0, job.get("next_run_at") or 0)
+    return {
+        "job_id": job["id"],
+        "queue": job.get("queue") or "default",
+        "command": job["command"],
+        "worker_pid": os.getpid() if owner is None else owner,
+        "claimed_at": job.get("claimed_at"),
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "queue_wait_ms": max(0, int((started_at - ready_at) * 1000)) if ready_at else None,
+        "duration_ms": int((finished_at - started_at) * 1000),
+        "exit_code": exit_code,
+        "log_path": log_path,
+        "reason": reason,
+    }
+
+
+# write the outcome back: completed, or a retry (backoff / DLQ), with the attempt's timing
+# recorded in the same transaction. Only while this worker still holds the claim: after its lease
+# expired the reaper may have handed the job to someone else.
+# `reason` tells a timeout or limit kill apart from a plain non-zero exit.
+def finish_job(job, exit_code: int, started_at: float, log_path: str = None, reason: str = None):
+    pid = os.getpid()
+    failure = failure_message(job, exit_code, reason)
+    if failure:
+        print(f"[Worker {pid}] {failure}")
+    conn = get_connection()
+    try:
+        with conn:
+            result = record_finish(conn.cursor(), job, exit_code, started_at, log_path, reason)
+    except Exception as e:
+        print(f"[Worker {pid}] Unexpected error recording job {job['id']}: {e}")
+        return
+    print(f"[Worker {pid}] {result['message']}")
+    if result["wake"]:
+        notify_workers()
+
 
-def run_worker_loop():
+# "Job X timed out. Retrying if possible..." for a failed run, None on success
+def failure_message(job, exit_code: int, reason: str = None):
+    job_id = job["id"]
+    if exit_code == 0 and reason in (None, "cached"):
+        return None
+    if reason == "timeout":
+        return f"Job {job_id} timed out. Retrying if possible..."
+    if reason == "cpu_limit":
+        return f"Job {job_id} exceeded its CPU limit. Retrying if possible..."
+    return f"Job {job_id} failed (exit code {exit_code}). Retrying if possible..."
+
+
+# finish_job's state change inside the caller's transaction (the broker batches many workers'),
+# for the claim of `owner`. Returns {"status", "message", "wake"}: wake is True when workers
+# should claim again (a concurrency slot freed up, dependents released, a retry re-queued).
+def record_finish(cur, job, exit_code: int, started_at: float, log_path: str = None, reason: str = None,
+                  owner: int = None, finished_at: float = None) -> dict:
+    owner = os.getpid() if owner is None else owner
+    job_id = job["id"]
+    attempt = attempt_record(job, exit_code, started_at, finished_at, log_path, reason, owner)
+
+    if exit_code == 0 and reason in (None, "cached"):
+        cur.execute(
+            "UPDATE jobs SET state='completed', updated_at=DATETIME('now'), force_retry=0 "
+            "WHERE id=? AND state='processing' AND worker_pid=?",
+            (job_id, owner),
+        )
+        owned = cur.rowcount > 0
+        insert_attempt(cur, dict(attempt, outcome="completed" if owned else "lease_lost"))
+        # dependents whose last open dependency this was become pending in the same commit
+        released = release_dependents(cur, job_id) if owned else 0
+        if owned and reason == "cached":
+            message = f"Job {job_id} completed from the result cache."
+        elif owned:
+            message = f"Job {job_id} completed successfully."
+        else:
+            message = f"Job {job_id} finished after its lease was reclaimed, result dropped."
+        return {"status": "completed" if owned else "lost", "message": message,
+                "wake": bool(job.get("concurrency_key") or released)}
+
+    try:
+        result = record_retry(cur, job_id, attempt=attempt, owner=owner)
+    except ValueError:
+        result = {"status": "missing", "message": f"Job {job_id} not found during retry."}
+    cur.execute("UPDATE jobs SET force_retry=0 WHERE id=? AND worker_pid=?", (job_id, owner))
+    return {"status": result["status"], "message": result["message"],
+            "wake": bool(job.get("concurrency_key") or result.get("state") == "pending")}
+
+
+def run_worker_loop(queues=None):
     pid = os.getpid()
-    poll_interval = int(get_config_value("poll_interval") or 2)
-    print(f"[Worker {pid}] Started")
+    buffer = deque()  # jobs claimed by this worker but not started yet
+    held = set()  # ids whose lease the heartbeat keeps extending (buffered + running)
+    heartbeat = start_heartbeat(held)
+    wake_sock = open_wake_socket()
+    preload_modules()
+    if queues:
+        print(f"[Worker {pid}] Started (queues: {', '.join(f'{n}:{w:g}' for n, w in queues)})")
+    else:
+        print(f"[Worker {pid}] Started")
 
     while not constants.SHUTDOWN:
         if os.path.exists(SHUTDOWN_FILE):
@@ -126,67 +505,40 @@ def run_worker_loop():
             print(f"[Worker {pid}] Detected stop flag — shutting down gracefully.")
             break
 
-        job = fetch_next_job()
-        if not job:
-            time.sleep(poll_interval)
-            continue
+        if not buffer:
+            # read every pass (cached), so `config set` applies to running workers
+            prefetch = max(1, get_config_int("prefetch", 1))
+            buffer.extend(fetch_next_jobs(prefetch, queues))
+            held.update(j["id"] for j in buffer)
+            if not buffer:
+                wait_for_work(wake_sock, queues)
+                continue
+
+        job = buffer.popleft()
 
         job_id = job["id"]
         cmd = job["command"]
         print(f"[Worker {pid}] Processing job : {job_id} : {cmd}")
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT attempts, max_retries, force_retry FROM jobs WHERE id=?", (job_id,))
-        job_meta = cur.fetchone()
-        conn.close()
-
-        if job_meta:
-            attempts = int(job_meta["attempts"])
-            max_retries = int(job_meta["max_retries"])
-            force_retry = int(job_meta["force_retry"])
-
-            if attempts > max_retries and not force_retry:
-                print(f"[Worker {pid}] Skipping job {job_id} (exceeded max retries).")
-                continue
-
-            if force_retry:
-                conn = get_connection()
-                cur = conn.cursor()
-                cur.execute("UPDATE jobs SET attempts = attempts + 1 WHERE id=?", (job_id,))
-                conn.commit()
-                conn.close()
-                print(f"[Worker {pid}] Force retry: incremented attempts for job {job_id}.")
-
-        success = execute_command(cmd)
-
-        conn = get_connection()
-        cur = conn.cursor()
+        if not start_job(job):
+            held.discard(job_id)
+            continue
 
-        if success:
-            cur.execute(
-                "UPDATE jobs SET state='completed', updated_at=DATETIME('now'), force_retry=0 WHERE id=?",
-                (job_id,),
-            )
-            conn.commit()
-            conn.close()
-            print(f"[Worker {pid}] Job {job_id} completed successfully.")
-        else:
-            print(f"[Worker {pid}] Job {job_id} failed. Retrying if possible...")
-            try:
-                result = retry_job(job_id)
-                print(f"[Worker {pid}] {result['message']}")
-            except ValueError:
-                print(f"[Worker {pid}] Job {job_id} not found during retry.")
-            except Exception as e:
-                print(f"[Worker {pid}] Unexpected retry error: {e}")
-            finally:
-                cur.execute("UPDATE jobs SET force_retry=0 WHERE id=?", (job_id,))
-                conn.commit()
-                conn.close()
+        log_path = new_log_path(job) if capture_enabled() and not job.get("callable") else None
+        started_at = time.time()
+        exit_code, reason = execute_job(job, log_path)
+        finish_job(job, exit_code, started_at, log_path, reason)
+        held.discard(job_id)
 
         if constants.SHUTDOWN:
             print(f"[Worker {pid}] Graceful shutdown, exiting after current job.")
             break
 
+    if buffer:
+        released = release_jobs([j["id"] for j in buffer])
+        print(f"[Worker {pid}] Released {released} prefetched job(s) back to pending.")
+
+    heartbeat.set()
+    shutdown_pool()
+    close_wake_socket(wake_sock)
     print(f"[Worker {pid}] Stopped.")
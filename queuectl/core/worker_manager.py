@@ -2,45 +2,246 @@ import os
 import time
 import signal
 from multiprocessing import Process
-from queuectl.core.worker import run_worker_loop
+from queuectl.storage.db import get_connection
+from queuectl.core.worker import run_worker_loop, next_due_at
+from queuectl.core.async_worker import run_async_worker_loop
+from queuectl.core.broker import run_broker_worker_loop
+import queuectl.constants as constants
 from queuectl.constants import SHUTDOWN_FILE
+from queuectl.core.notify import notify_workers, wake_worker
+from queuectl.core.config_manager import get_config_int, get_cached_config
+from queuectl.core.retention import run_gc
+from queuectl.core.lease import reap_expired_leases
+from queuectl.core.scheduler import open_scheduler, close_scheduler, fire_due_schedules, wait_for_schedules
 
 
 """
 Starting the Workers and Gracefully Stopping the Workers
+
+- Fixed pool (--count) or autoscaled pool (--min / --max) driven by due pending depth, the wait of the
+  oldest due job and host load, with a cooldown and a sustained-low period before shrinking
+- Crashed workers are respawned, retired ones finish their current job first
+- The manager also fires recurring schedules (see scheduler.py): its loop sleeps until the
+  earliest fire time instead of a fixed tick when that comes sooner
+- With --broker the workers claim through a broker (see broker.py) and the manager only supervises
+  them: leases, retention and schedules are the broker's job, it never opens the database
 """
 
 
 WORKERS = []
+RETIRING = set()  # pids asked to exit by the autoscaler, not respawned
+
 
+def spawn_worker(mode: str = "sync", concurrency: int = 1, queues=None, broker: str = None):
+    if broker:
+        p = Process(target=run_broker_worker_loop, args=(broker, queues))
+    elif mode == "async":
+        p = Process(target=run_async_worker_loop, args=(concurrency, queues))
+    else:
+        p = Process(target=run_worker_loop, args=(queues,))
+    p.start()
+    WORKERS.append(p)
+    return p
 
-# spawn worker processes
-def start_workers(count: int):
+
+# spawn worker processes, mode "async" runs up to `concurrency` jobs per process,
+# `queues` ([(name, weight), ...]) restricts which queues they claim from.
+# With max_workers the pool autoscales between min_workers and max_workers on the backlog.
+# Crashed workers (non-zero exit) are replaced in both modes.
+# `broker` ("host:port" / "unix:/path") runs sync workers that claim through that broker instead.
+def start_workers(count: int, mode: str = "sync", concurrency: int = 1, queues=None,
+                  min_workers: int = None, max_workers: int = None, broker: str = None):
+    autoscale = max_workers is not None
+    if broker and (mode == "async" or autoscale):
+        raise ValueError("--broker runs sync workers with a fixed --count (no --mode async, --min / --max).")
     if os.path.exists(SHUTDOWN_FILE):
         os.remove(SHUTDOWN_FILE)
 
+    if autoscale:
+        min_workers = min_workers or 0
+        if min_workers < 0 or max_workers < max(1, min_workers):
+            raise ValueError("Autoscaling needs 0 <= --min <= --max and --max >= 1.")
+        count = min_workers
+
     for i in range(count):
-        p = Process(target=run_worker_loop)
-        p.start()
-        WORKERS.append(p)
+        p = spawn_worker(mode, concurrency, queues, broker)
         print(f"[Manager] Worker ({i}) {p.pid} started")
 
-    print(f"[Manager] Running {count} workers. Press Ctrl+C to stop.")
+    if autoscale:
+        print(f"[Manager] Autoscaling between {min_workers} and {max_workers} workers. Press Ctrl+C to stop.")
+    else:
+        print(f"[Manager] Running {count} workers. Press Ctrl+C to stop.")
 
+    scaler = {"last_change": 0.0, "low_since": None}
+    next_gc = time.monotonic()
+    sched = open_scheduler() if not broker else None
     try:
-        while any(p.is_alive() for p in WORKERS):
-            time.sleep(2)
+        # the pool runs until the stop flag (or a signal), crashed workers are respawned meanwhile;
+        # only then does "every worker has exited" end the loop
+        while any(p.is_alive() for p in WORKERS) or not os.path.exists(SHUTDOWN_FILE):
+            if constants.SHUTDOWN:
+                # SIGTERM / SIGINT to the manager (handler from worker.py): stop the whole pool
+                stop_workers()
+                break
+            if not os.path.exists(SHUTDOWN_FILE):
+                replace_crashed(mode, concurrency, queues, broker)
+                if autoscale:
+                    autoscale_pool(scaler, min_workers, max_workers, mode, concurrency, queues)
+            if broker:
+                time.sleep(2)
+                continue
+            reap_leases()
+            next_gc = run_reaper(next_gc)
+            run_schedules(sched)
+            wait_for_schedules(sched, 2)
     except KeyboardInterrupt:
         print("[Manager] Caught KeyboardInterrupt, stopping workers...")
         stop_workers()
+    finally:
+        if sched is not None:
+            close_scheduler(sched)
 
     print("[Manager] All workers stopped.")
 
 
+# drop exited workers from the pool, respawning the ones that crashed
+def replace_crashed(mode: str, concurrency: int, queues, broker: str = None):
+    for p in [p for p in WORKERS if not p.is_alive()]:
+        p.join(timeout=0)
+        WORKERS.remove(p)
+        if p.pid in RETIRING:
+            RETIRING.discard(p.pid)
+            print(f"[Manager] Worker {p.pid} retired.")
+        elif p.exitcode:
+            new = spawn_worker(mode, concurrency, queues, broker)
+            print(f"[Manager] Worker {p.pid} crashed (exit code {p.exitcode}), respawned as {new.pid}")
+
+
+# what the autoscaler looks at: due pending jobs (not the ones waiting for a backoff or run_at,
+# counted up to `cap` per queue on idx_jobs_queue_due), how long the oldest due job has waited,
+# load per CPU
+def sample_backlog(queues=None, cap: int = 10000):
+    cur = get_connection().cursor()
+    now = int(time.time())
+    if not queues:
+        cur.execute("SELECT queue FROM job_counts WHERE state='pending' AND count > 0")
+        queues = [(r["queue"], 1.0) for r in cur.fetchall()]
+    pending = 0
+    for name, _ in queues:
+        cur.execute(
+            "SELECT COUNT(*) AS n FROM (SELECT 1 FROM jobs WHERE state='pending' AND queue=? AND next_run_at <= ? LIMIT ?)",
+            (name, now, cap),
+        )
+        pending += cur.fetchone()["n"]
+    due = next_due_at(queues)
+    oldest_wait = max(0.0, time.time() - due) if due is not None else 0.0
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        load = 0.0
+    return {"pending": pending, "oldest_wait": oldest_wait, "load": load}
+
+
+# Target pool size for one sample. Scale up as soon as the backlog needs more workers (or the oldest
+# due job waited too long) unless the host is already loaded, scale down one worker at a time only
+# after the backlog fit comfortably in fewer workers for autoscale_idle_seconds.
+def desired_workers(current: int, sample: dict, scaler: dict, min_workers: int, max_workers: int,
+                    per_worker: int) -> int:
+    now = time.monotonic()
+    if now - scaler["last_change"] < get_config_int("autoscale_cooldown", 10):
+        return current
+
+    needed = -(-sample["pending"] // per_worker)  # ceil
+    max_load = float(get_cached_config("autoscale_max_load", "1.5"))
+    too_slow = sample["oldest_wait"] > get_config_int("autoscale_max_wait", 5)
+    if current < min_workers:
+        return min_workers
+    if (needed > current or too_slow) and current < max_workers and sample["load"] < max_load:
+        scaler["low_since"] = None
+        return min(max_workers, max(needed, current + 1))
+
+    # hysteresis: shrink only while one worker fewer would still be under half busy
+    if current > min_workers and sample["pending"] <= (current - 1) * per_worker // 2 and not too_slow:
+        if scaler["low_since"] is None:
+            scaler["low_since"] = now
+        if now - scaler["low_since"] >= get_config_int("autoscale_idle_seconds", 30):
+            scaler["low_since"] = None
+            return current - 1
+    else:
+        scaler["low_since"] = None
+    return current
+
+
+def autoscale_pool(scaler: dict, min_workers: int, max_workers: int, mode: str, concurrency: int, queues):
+    active = [p for p in WORKERS if p.pid not in RETIRING]
+    per_worker = get_config_int("autoscale_jobs_per_worker", 10) * (concurrency if mode == "async" else 1)
+    try:
+        # more due jobs than max_workers can take changes nothing, no need to count them
+        sample = sample_backlog(queues, max_workers * max(1, per_worker) + 1)
+    except Exception as e:
+        print(f"[Manager] Autoscaler sample failed: {e}")
+        return
+    target = desired_workers(len(active), sample, scaler, min_workers, max_workers, max(1, per_worker))
+    if target == len(active):
+        return
+
+    reason = (f"pending {sample['pending']}, oldest due {sample['oldest_wait']:.1f}s ago, "
+              f"load {sample['load']:.2f}/cpu")
+    if target > len(active):
+        started = [spawn_worker(mode, concurrency, queues).pid for _ in range(target - len(active))]
+        print(f"[Manager] Scale up {len(active)} -> {target} ({reason}), started {started}")
+    else:
+        # newest first, it has the least warm state; it finishes its current job then exits
+        p = active[-1]
+        RETIRING.add(p.pid)
+        try:
+            os.kill(p.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        wake_worker(p.pid)
+        print(f"[Manager] Scale down {len(active)} -> {target} ({reason}), retiring {p.pid}")
+    scaler["last_change"] = time.monotonic()
+
+
+# hand jobs of dead workers (expired leases) back to the queue
+def reap_leases():
+    try:
+        reaped = reap_expired_leases()
+        if reaped:
+            print(f"[Manager] Reclaimed {reaped} job(s) with expired leases.")
+    except Exception as e:
+        print(f"[Manager] Lease reaper failed: {e}")
+
+
+# enqueue the occurrences of recurring schedules that are due
+def run_schedules(sched):
+    try:
+        fired = fire_due_schedules(sched)
+        if fired:
+            print(f"[Manager] Enqueued {fired} scheduled job(s).")
+    except Exception as e:
+        print(f"[Manager] Scheduler failed: {e}")
+
+
+# background retention: archive finished jobs every gc_interval seconds (0 disables)
+def run_reaper(next_gc: float) -> float:
+    interval = get_config_int("gc_interval", 0)
+    if interval <= 0 or time.monotonic() < next_gc:
+        return next_gc
+    try:
+        result = run_gc()
+        if result["moved"]:
+            print(f"[Manager] Archived {result['moved']} finished job(s) older than {result['cutoff']}.")
+    except Exception as e:
+        print(f"[Manager] Retention run failed: {e}")
+    return time.monotonic() + interval
+
+
 # gracefully stopping the workers (all the worker completes it's work before shutting down)
 def stop_workers():
     # stop flag creation to stop all the workers to further take any job
     open(SHUTDOWN_FILE, "w").close()
+    notify_workers()  # idle workers notice the flag now instead of at their next poll
     print("[Manager] Stop flag created, workers will exit gracefully.")
 
     term_wait = 3.0 # time before forcefully killing the processes
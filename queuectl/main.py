@@ -1,10 +1,23 @@
 import argparse
+import json
 import sys
+from datetime import datetime
 from queuectl.storage.db import init_db
 from queuectl.core import job_manager
 from queuectl.core import worker_manager
 from queuectl.constants import EXIT_OK, EXIT_ERR, EXIT_NOT_FOUND
 from queuectl.core.config_manager import list_config, set_config, get_config
+from queuectl.core import retention
+from queuectl.core import bench
+from queuectl.core import stats
+from queuectl.core import lease
+from queuectl.core import joblogs
+from queuectl.core import concurrency
+from queuectl.core import scheduler
+from queuectl.core import result_cache
+from queuectl.core import dag
+from queuectl.core import broker
+from queuectl.core.worker import parse_queues
 
 
 # checking the CLI (for testing)
@@ -12,9 +25,14 @@ from queuectl.core.config_manager import list_config, set_config, get_config
 #     print(True)
 #     return EXIT_OK
 
-# Add a job to the queue
+# Add a job to the queue, or stream many from a JSONL file / stdin
 def cmd_enqueue(args):
     try:
+        if args.file:
+            return enqueue_file(args.file, args.batch_size)
+        if not args.job_json:
+            print("ERROR: Provide a job JSON string or --file.", file=sys.stderr)
+            return EXIT_ERR
         result = job_manager.enqueue_job(args.job_json)
         print(result["message"])
         return EXIT_OK
@@ -23,21 +41,85 @@ def cmd_enqueue(args):
         return EXIT_ERR
 
 
-# List all jobs, or by the state
+def enqueue_file(path, batch_size):
+    def on_error(line_no, message):
+        print(f"line {line_no}: {message}", file=sys.stderr)
+
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        result = job_manager.enqueue_many(stream, batch_size=batch_size, on_error=on_error)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+    print(f"Enqueued {result['inserted']} job(s), "
+          f"{result['duplicates']} duplicate(s), {result['deduped']} deduplicated, {result['invalid']} invalid line(s).")
+    return EXIT_OK if not (result["duplicates"] or result["invalid"]) else EXIT_ERR
+
+
+# List all jobs, or by the state (streamed, so memory stays flat on large tables)
 def cmd_list(args):
     try:
-        jobs = job_manager.list_jobs(args.state)
-        if not jobs:
-            print("No jobs found.")
-            return EXIT_OK
+        if args.dag:
+            return list_dag(args.dag, args.format)
+        jobs = job_manager.list_jobs(args.state, limit=args.limit, after=args.after,
+                                     since=args.since, until=args.until)
+        count, last, columns = 0, None, None
         for job in jobs:
-            print(job)
+            if args.format == "jsonl":
+                print(json.dumps(job))
+            elif args.format == "tsv":
+                if columns is None:
+                    columns = list(job.keys())
+                    print("\t".join(columns))
+                print("\t".join(_tsv_field(job[c]) for c in columns))
+            else:
+                print(job)
+            count, last = count + 1, job
+
+        if not count and args.format == "text":
+            print("No jobs found.")
+        if args.limit and count == args.limit:
+            print(f"next page: --after {job_manager.encode_cursor(last)}", file=sys.stderr)
+        return EXIT_OK
+    except BrokenPipeError:
         return EXIT_OK
     except Exception as e:
         print(f"ERROR: {e}", file=sys.stderr)
         return EXIT_ERR
 
 
+# a job and everything downstream of it, with per-state progress
+def list_dag(root, fmt):
+    jobs = dag.dag_jobs(root)
+    if fmt == "jsonl":
+        for job in jobs:
+            print(json.dumps(job))
+        return EXIT_OK
+    if fmt == "tsv":
+        print("id\tstate\tdeps_remaining\tparents")
+        for job in jobs:
+            print(f"{_tsv_field(job['id'])}\t{job['state']}\t{job['deps_remaining']}\t{_tsv_field(','.join(job['parents']))}")
+        return EXIT_OK
+
+    for job in jobs:
+        waiting = f" (waiting on {job['deps_remaining']})" if job["state"] == "blocked" else ""
+        after = f"  <- {', '.join(job['parents'])}" if job["parents"] else ""
+        print(f"{job['id']:<24} {job['state']:<10}{waiting}{after}")
+    counts = {}
+    for job in jobs:
+        counts[job["state"]] = counts.get(job["state"], 0) + 1
+    done = counts.get("completed", 0)
+    print(f"DAG {root}: {done}/{len(jobs)} completed ({', '.join(f'{s} {n}' for s, n in sorted(counts.items()))})")
+    return EXIT_OK
+
+
+def _tsv_field(value):
+    if value is None:
+        return ""
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
 # # Manually change job state (for testing)
 # def cmd_update(args):
 #     try:
@@ -81,14 +163,229 @@ def cmd_dlq(args):
             return EXIT_NOT_FOUND
 
 
+# Start workers in the foreground
+def cmd_worker_start(args):
+    try:
+        queues = parse_queues(args.queues)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_ERR
+    if args.min is not None and args.max is None:
+        print("ERROR: --min needs --max (autoscaling bounds).", file=sys.stderr)
+        return EXIT_ERR
+    try:
+        return worker_manager.start_workers(args.count, args.mode, args.concurrency, queues,
+                                            min_workers=args.min, max_workers=args.max, broker=args.broker)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_ERR
+
+
+# Claim broker in the foreground, for workers on other hosts
+def cmd_broker(args):
+    try:
+        broker.serve(args.listen)
+        return EXIT_OK
+    except (ValueError, OSError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_ERR
+
+
 # Status
-def cmd_status(_):
-    summary = job_manager.get_status_summary()
+def cmd_status(args):
+    summary = job_manager.get_status_summary(recount=args.recount)
     print("Queue Status Summary:")
     for state, count in summary.items():
         print(f"  {state:10s}: {count}")
+
+    by_queue = job_manager.get_queue_summary()
+    if by_queue:
+        print("By Queue:")
+        for queue, counts in by_queue.items():
+            details = ", ".join(f"{state} {count}" for state, count in counts.items() if count)
+            print(f"  {queue}: {details or 'empty'}")
+
+    print("Leases:")
+    print(f"  {'expired':10s}: {lease.count_expired_leases()}  (processing, not reclaimed yet)")
+    print(f"  {'reclaimed':10s}: {lease.count_reclaimed()}  (last hour)")
+
+    cache = result_cache.cache_summary()
+    lookups = cache["hits"] + cache["misses"]
+    print("Result Cache:")
+    print(f"  {'entries':10s}: {cache['entries']}  ({cache['bytes'] / 1048576:.1f} MiB of output)")
+    print(f"  {'hits':10s}: {cache['hits']}" + (f"  ({100 * cache['hits'] / lookups:.1f}%)" if lookups else ""))
+    print(f"  {'misses':10s}: {cache['misses']}")
     return EXIT_OK
 
+# Archive finished jobs past retention
+def cmd_gc(args):
+    try:
+        result = retention.run_gc(
+            retention_days=args.retention_days,
+            batch_size=args.batch_size,
+            archive_path=args.archive,
+            vacuum=args.vacuum,
+        )
+        print(f"Archived {result['moved']} finished job(s) older than {result['cutoff']} to {result['archive']}.")
+        if args.vacuum:
+            print(f"Vacuum reclaimed {result['bytes_reclaimed']} bytes.")
+        else:
+            print(f"{result['bytes_free']} bytes free for reuse (run with --vacuum to return them to the filesystem).")
+        return EXIT_OK
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_ERR
+
+
+# Captured output of a job's latest (or given) attempt
+def cmd_logs(args):
+    try:
+        path = joblogs.find_log(args.id, args.attempt)
+        if not args.follow:
+            joblogs.print_log(path)
+            return EXIT_OK
+        joblogs.follow_log(path, lambda: job_manager.is_attempt_running(args.id, path))
+        return EXIT_OK
+    except BrokenPipeError:
+        return EXIT_OK
+    except KeyboardInterrupt:
+        return EXIT_OK
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_NOT_FOUND
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_ERR
+
+
+# Queue wait / run time percentiles from recorded attempts
+def cmd_stats(args):
+    try:
+        window = stats.parse_window(args.window)
+        if args.prometheus:
+            path = stats.write_prometheus(args.prometheus, window)
+            print(f"Wrote Prometheus metrics to {path}.")
+            return EXIT_OK
+
+        result = stats.collect_stats(window, by=args.by)
+        if args.json:
+            print(json.dumps(result, indent=2))
+            return EXIT_OK
+        if not result:
+            print(f"No attempts finished in the last {args.window}.")
+            return EXIT_OK
+
+        print(f"{args.by:<24} {'attempts':>8} {'failed':>6} {'timeout':>7}  {'wait p50/p95/p99 ms':>22}  {'run p50/p95/p99 ms':>22}")
+        for name, s in result.items():
+            wait = "/".join(str(s["queue_wait_ms"][p]) for p in ("p50", "p95", "p99"))
+            run = "/".join(str(s["run_ms"][p]) for p in ("p50", "p95", "p99"))
+            print(f"{name[:24]:<24} {s['attempts']:>8} {s['failed']:>6} {s['timeouts']:>7}  {wait:>22}  {run:>22}")
+        return EXIT_OK
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_ERR
+
+
+# Benchmark against a throwaway database
+def cmd_bench(args):
+    try:
+        report = bench.run_bench(
+            scenarios=args.scenario,
+            jobs=args.jobs,
+            workers=args.workers,
+            prefetch=args.prefetch,
+            latency_jobs=args.latency_jobs,
+            latency_workers=args.latency_workers,
+            spawns=args.spawns,
+        )
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_ERR
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2) if args.json else bench.format_report(report))
+
+    if args.baseline:
+        regressions = bench.compare_results(bench.load_report(args.baseline), report, args.tolerance)
+        for name, old, new in regressions:
+            print(f"REGRESSION {name}: {old} -> {new}", file=sys.stderr)
+        if regressions:
+            return EXIT_ERR
+    return EXIT_OK
+
+
+# Concurrency groups / rate limits per concurrency_key
+def cmd_concurrency(args):
+    try:
+        if args.action == "list":
+            limits = concurrency.list_limits()
+            if not limits:
+                print("No concurrency limits set.")
+                return EXIT_OK
+            print(f"{'key':<24} {'in flight':>9} {'max':>5} {'rate/s':>8} {'burst':>6}")
+            for limit in limits:
+                print(f"{limit['key'][:24]:<24} {limit['in_flight']:>9} {limit['max_in_flight'] or '-':>5} "
+                      f"{limit['rate'] or '-':>8} {limit['burst'] or '-':>6}")
+            return EXIT_OK
+
+        elif args.action == "set":
+            result = concurrency.set_limit(args.key, args.max, args.rate, args.burst)
+            print(f"Concurrency limit for '{result['key']}' set "
+                  f"(max {result['max_in_flight'] or '-'}, rate {result['rate'] or '-'}/s, burst {result['burst'] or '-'}).")
+            return EXIT_OK
+
+        elif args.action == "remove":
+            result = concurrency.remove_limit(args.key)
+            print(f"Concurrency limit for '{result['key']}' removed.")
+            return EXIT_OK
+
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_NOT_FOUND if args.action == "remove" else EXIT_ERR
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_ERR
+
+
+# Recurring jobs, fired by running worker managers
+def cmd_schedule(args):
+    try:
+        if args.action == "list":
+            schedules = scheduler.list_schedules()
+            if not schedules:
+                print("No schedules.")
+                return EXIT_OK
+            print(f"{'name':<20} {'next fire':<19}  {'last fire':<19}  {'misfire':<8}  spec")
+            for s in schedules:
+                spec = f"cron {s['cron']}" if s["cron"] else f"every {s['every_s']:g}s"
+                last = _local_time(s["last_fire_at"]) if s["last_fire_at"] else "-"
+                print(f"{s['name'][:20]:<20} {_local_time(s['next_fire_at']):<19}  {last:<19}  {s['misfire']:<8}  {spec}")
+            return EXIT_OK
+
+        elif args.action == "add":
+            result = scheduler.add_schedule(args.name, args.job_json, args.cron, args.every, args.misfire)
+            print(f"Schedule '{result['name']}' {result['status']}, next run at {_local_time(result['next_fire_at'])}.")
+            return EXIT_OK
+
+        elif args.action == "remove":
+            result = scheduler.remove_schedule(args.name)
+            print(f"Schedule '{result['name']}' removed.")
+            return EXIT_OK
+
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_NOT_FOUND if args.action == "remove" else EXIT_ERR
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_ERR
+
+
+def _local_time(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch).strftime("%Y-%m-%d %H:%M:%S")
+
+
 # Config
 def cmd_config(args):
     try:
@@ -120,8 +417,6 @@ def cmd_config(args):
         return EXIT_ERR
 
 def main():
-    init_db()
-
     parser = argparse.ArgumentParser(
         prog="queuectl",
         description="QueueCTL - Lightweight Job Queue CLI"
@@ -138,12 +433,20 @@ def main():
 
     # enqueue
     enqueue_parser = subparsers.add_parser("enqueue", help="Add a job")
-    enqueue_parser.add_argument("job_json", help="Job JSON string with id and command")
+    enqueue_parser.add_argument("job_json", nargs="?", help="Job JSON string with id and command")
+    enqueue_parser.add_argument("--file", help="JSONL file with one job per line ('-' for stdin)")
+    enqueue_parser.add_argument("--batch-size", type=int, help="Jobs per insert transaction (default: enqueue_batch_size config)")
     enqueue_parser.set_defaults(func=cmd_enqueue)
 
     # list
     list_parser = subparsers.add_parser("list", help="List jobs")
     list_parser.add_argument("--state", help="Filter by state", required=False)
+    list_parser.add_argument("--limit", type=int, help="Return at most N jobs (prints the next-page cursor)")
+    list_parser.add_argument("--after", help="Cursor from a previous page, resumes after that job")
+    list_parser.add_argument("--since", help="Only jobs created at or after this ISO time (UTC)")
+    list_parser.add_argument("--until", help="Only jobs created before this ISO time (UTC)")
+    list_parser.add_argument("--format", choices=["text", "jsonl", "tsv"], default="text", help="Output format")
+    list_parser.add_argument("--dag", metavar="ID", help="Show this job and everything that depends on it, with progress")
     list_parser.set_defaults(func=cmd_list)
 
     # update (for testing)
@@ -173,15 +476,111 @@ def main():
     worker_sub = worker_parser.add_subparsers(dest="action", required=True)
     worker_start = worker_sub.add_parser("start", help="Start worker processes")
     worker_start.add_argument("--count", type=int, default=1, help="Number of worker processes")
-    worker_start.set_defaults(func=lambda args: worker_manager.start_workers(args.count))
+    worker_start.add_argument("--mode", choices=["sync", "async"], default="sync",
+                              help="sync: one job at a time per process, async: asyncio event loop per process")
+    worker_start.add_argument("--concurrency", type=int, default=10,
+                              help="Jobs in flight per process in async mode")
+    worker_start.add_argument("--queues",
+                              help="Comma-separated queues with optional weights, e.g. high:5,default (default: all)")
+    worker_start.add_argument("--min", type=int, help="Autoscale: fewest worker processes to keep (default 0)")
+    worker_start.add_argument("--max", type=int, help="Autoscale: most worker processes, enables autoscaling (ignores --count)")
+    worker_start.add_argument("--broker", metavar="ADDR",
+                              help="Claim through the broker at host:port or unix:/path instead of opening the database (sync, fixed --count)")
+    worker_start.set_defaults(func=cmd_worker_start)
     worker_stop = worker_sub.add_parser("stop", help="Stop all workers gracefully")
     worker_stop.set_defaults(func=lambda args: worker_manager.stop_workers())
 
+    # broker
+    broker_parser = subparsers.add_parser("broker", help="Serve claims to workers on other hosts (owns the database)")
+    broker_parser.add_argument("--listen", default="127.0.0.1:7420",
+                               help="host:port or unix:/path to listen on (default: 127.0.0.1:7420)")
+    broker_parser.set_defaults(func=cmd_broker)
+
 
     # status
     status_parser = subparsers.add_parser("status", help="Show queue summary")
+    status_parser.add_argument("--recount", action="store_true",
+                               help="Rebuild the per-state counters from the jobs table first")
     status_parser.set_defaults(func=cmd_status)
 
+    # gc
+    gc_parser = subparsers.add_parser("gc", help="Archive finished jobs older than the retention window")
+    gc_parser.add_argument("--retention-days", type=int, help="Keep finished jobs this many days (default: retention_days config)")
+    gc_parser.add_argument("--batch-size", type=int, help="Jobs moved per transaction (default: gc_batch_size config)")
+    gc_parser.add_argument("--archive", help="Archive database file (default: archive_path config, empty = jobs_archive table)")
+    gc_parser.add_argument("--vacuum", action="store_true", help="Return freed pages to the filesystem afterwards")
+    gc_parser.set_defaults(func=cmd_gc)
+
+    # logs
+    logs_parser = subparsers.add_parser("logs", help="Show a job's captured output")
+    logs_parser.add_argument("id", help="Job ID")
+    logs_parser.add_argument("--attempt", type=int, help="Attempt number (default: the latest)")
+    logs_parser.add_argument("--follow", "-f", action="store_true", help="Keep printing output until the attempt finishes")
+    logs_parser.set_defaults(func=cmd_logs)
+
+    # stats
+    stats_parser = subparsers.add_parser("stats", help="Queue wait and run time percentiles of recent attempts")
+    stats_parser.add_argument("--window", default="1h", help="Only attempts finished within this window, e.g. 15m, 1h, 7d (default: 1h)")
+    stats_parser.add_argument("--by", choices=["queue", "command"], default="queue", help="Group by queue or command")
+    stats_parser.add_argument("--json", action="store_true", help="Print the stats as JSON")
+    stats_parser.add_argument("--prometheus", metavar="FILE", help="Write per-queue metrics in Prometheus text format (node_exporter textfile collector)")
+    stats_parser.set_defaults(func=cmd_stats)
+
+    # bench
+    bench_parser = subparsers.add_parser("bench", help="Measure enqueue / claim throughput and job latency on a throwaway database")
+    bench_parser.add_argument("--scenario", action="append", choices=bench.SCENARIOS,
+                              help="Scenario to run (repeatable, default: all)")
+    bench_parser.add_argument("--jobs", type=int, help="Jobs per enqueue / claim run (default: 5000)")
+    bench_parser.add_argument("--workers", type=int, nargs="+", help="Concurrent claimers to try (default: 1 4 16 64)")
+    bench_parser.add_argument("--prefetch", type=int, nargs="+", help="Jobs per claim to try in the claim / broker scenarios, each with every --workers count (default: 1)")
+    bench_parser.add_argument("--latency-jobs", type=int, help="Jobs sent through real workers (default: 500)")
+    bench_parser.add_argument("--latency-workers", type=int, help="Workers in the latency scenario (default: 4)")
+    bench_parser.add_argument("--spawns", type=int, help="Processes started per path in the spawn scenario (default: 300)")
+    bench_parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+    bench_parser.add_argument("--output", help="Also write the JSON report to this file")
+    bench_parser.add_argument("--baseline", help="Previous JSON report, exit 1 if a rate dropped beyond --tolerance")
+    bench_parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed rate drop vs --baseline (default: 0.1)")
+    bench_parser.set_defaults(func=cmd_bench)
+
+    # concurrency
+    concurrency_parser = subparsers.add_parser("concurrency", help="Limit jobs sharing a concurrency_key")
+    concurrency_sub = concurrency_parser.add_subparsers(dest="action", required=True)
+
+    concurrency_list = concurrency_sub.add_parser("list", help="List limits with current in-flight counts")
+    concurrency_list.set_defaults(func=cmd_concurrency)
+
+    concurrency_set = concurrency_sub.add_parser("set", help="Set (replace) the limits of a key")
+    concurrency_set.add_argument("key", help="concurrency_key of the jobs")
+    concurrency_set.add_argument("--max", type=int, help="Max jobs of this key running at once")
+    concurrency_set.add_argument("--rate", type=float, help="Max job starts per second (token bucket)")
+    concurrency_set.add_argument("--burst", type=float, help="Token bucket size (default: max(1, rate))")
+    concurrency_set.set_defaults(func=cmd_concurrency)
+
+    concurrency_remove = concurrency_sub.add_parser("remove", help="Remove the limits of a key")
+    concurrency_remove.add_argument("key", help="concurrency_key of the jobs")
+    concurrency_remove.set_defaults(func=cmd_concurrency)
+
+    # schedule
+    schedule_parser = subparsers.add_parser("schedule", help="Recurring jobs, enqueued by running worker managers")
+    schedule_sub = schedule_parser.add_subparsers(dest="action", required=True)
+
+    schedule_list = schedule_sub.add_parser("list", help="List schedules with their next and last fire times")
+    schedule_list.set_defaults(func=cmd_schedule)
+
+    schedule_add = schedule_sub.add_parser("add", help="Add (or replace) a schedule")
+    schedule_add.add_argument("name", help="Schedule name, occurrences run as jobs '<name>@<fire time>'")
+    schedule_add.add_argument("job_json", help="Job JSON without id, e.g. '{\"command\":\"./nightly.sh\"}'")
+    when = schedule_add.add_mutually_exclusive_group(required=True)
+    when.add_argument("--cron", help="'minute hour day-of-month month day-of-week' in local time, or @hourly / @daily / ...")
+    when.add_argument("--every", help="Fixed interval: 90, 30s, 5m, 2h or 1d")
+    schedule_add.add_argument("--misfire", choices=list(scheduler.MISFIRE_POLICIES), default="run_once",
+                              help="Occurrences missed while no manager ran: enqueue the latest (run_once), none (skip) or each (catch_up)")
+    schedule_add.set_defaults(func=cmd_schedule)
+
+    schedule_remove = schedule_sub.add_parser("remove", help="Remove a schedule (jobs already enqueued stay)")
+    schedule_remove.add_argument("name", help="Schedule name")
+    schedule_remove.set_defaults(func=cmd_schedule)
+
     # config
     config_parser = subparsers.add_parser("config", help="Manage configuration values")
     config_sub = config_parser.add_subparsers(dest="action", required=True)
@@ -201,6 +600,8 @@ def main():
 
     # Parse + execute
     args = parser.parse_args()
+    if not getattr(args, "broker", None):
+        init_db()  # broker workers have no database, it lives on the broker's host
     rc = args.func(args)
     sys.exit(rc)
 
@@ -1,18 +1,99 @@
 import sqlite3
+import json
 import os
-from datetime import datetime
+import time
+import threading
+from datetime import datetime, timezone
+from queuectl.constants import QUEUECTL_HOME
+
+# Database location: ~/.queuectl/jobs.db (or $QUEUECTL_HOME/jobs.db)
+DB_PATH = os.path.join(QUEUECTL_HOME, "jobs.db")
+
+# Connection tuning, each one can be overridden through the config table
+# (applied when a process/thread opens its connection)
+PRAGMA_DEFAULTS = {
+    "sqlite_journal_mode": "WAL",
+    "sqlite_synchronous": "NORMAL",
+    "sqlite_busy_timeout_ms": "5000",
+    "sqlite_cache_size": "-16000",  # negative = KiB, so ~16 MB of page cache
+}
+_JOURNAL_MODES = {"WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY"}
+_SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+# One connection per process and thread, see get_connection()
+_local = threading.local()
+# Connections inherited through fork, kept referenced so the child never closes the parent's handle
+_inherited = []
+_dir_ready = False
 
-# Database location: ~/.queuectl/jobs.db
-DB_PATH = os.path.expanduser("~/.queuectl/jobs.db")
 
 def get_connection():
-    """Create or connect to the SQLite database."""
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    """
+    Return this process/thread's SQLite connection, opening it on first use.
+    The connection is reused across calls, callers commit but do not close it.
+    A connection inherited from the parent process (fork in worker_manager)
+    is never reused or closed, the child opens its own.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        if _local.pid == os.getpid():
+            return conn
+        _inherited.append(conn)
+
+    global _dir_ready
+    if not _dir_ready:
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        _dir_ready = True
+
     conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    _apply_pragmas(conn)
+    _local.conn, _local.pid = conn, os.getpid()
     return conn
 
 
+def close_connection():
+    """Close this process/thread's connection (the next get_connection() reopens)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+
+
+def _apply_pragmas(conn):
+    """Apply PRAGMA_DEFAULTS, overridden by sqlite_* keys of the config table when present."""
+    settings = dict(PRAGMA_DEFAULTS)
+    try:
+        rows = conn.execute("SELECT key, value FROM config WHERE key LIKE 'sqlite%'").fetchall()
+        settings.update({r["key"]: r["value"] for r in rows if r["key"] in settings})
+    except sqlite3.OperationalError:
+        pass  # fresh database, config table not created yet
+
+    # PRAGMA values can't be bound as parameters, so only whitelisted values are interpolated
+    journal_mode = settings["sqlite_journal_mode"].upper()
+    synchronous = settings["sqlite_synchronous"].upper()
+    try:
+        busy_timeout = int(settings["sqlite_busy_timeout_ms"])
+        cache_size = int(settings["sqlite_cache_size"])
+    except ValueError:
+        print("[DB] Invalid sqlite_busy_timeout_ms/sqlite_cache_size config, using defaults.")
+        busy_timeout = int(PRAGMA_DEFAULTS["sqlite_busy_timeout_ms"])
+        cache_size = int(PRAGMA_DEFAULTS["sqlite_cache_size"])
+    if journal_mode not in _JOURNAL_MODES:
+        journal_mode = PRAGMA_DEFAULTS["sqlite_journal_mode"]
+    if synchronous not in _SYNCHRONOUS_MODES:
+        synchronous = PRAGMA_DEFAULTS["sqlite_synchronous"]
+
+    conn.execute(f"PRAGMA busy_timeout = {busy_timeout}")
+    # Incremental auto-vacuum lets `gc --vacuum` return pages without a full VACUUM. It must be
+    # set before the file is initialised (below, by journal_mode), older databases switch on their
+    # next full VACUUM.
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+    conn.execute(f"PRAGMA synchronous = {synchronous}")
+    conn.execute(f"PRAGMA cache_size = {cache_size}")
+
+
 def init_db():
     """Initialize the database with required tables and defaults."""
     conn = get_connection()
@@ -26,16 +107,44 @@ def init_db():
     );
     """)
 
-    cursor.execute("SELECT COUNT(*) AS cnt FROM config;")
-    if cursor.fetchone()["cnt"] == 0:
-        cursor.executemany(
-            "INSERT INTO config (key, value) VALUES (?, ?)",
-            [
-                ("max_retries", "3"),
-                ("exp_backoff_base", "2"),
-                ("poll_interval", "2"),
-            ],
-        )
+    # Defaults, keys added in later versions are filled in on existing databases too
+    cursor.executemany(
+        "INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)",
+        [
+            ("max_retries", "3"),
+            ("exp_backoff_base", "2"),
+            ("poll_interval", "2"),
+            ("prefetch", "1"),
+            ("enqueue_batch_size", "1000"),
+            ("retention_days", "7"),
+            ("gc_batch_size", "500"),
+            ("gc_interval", "0"),
+            ("archive_path", ""),
+            ("lease_seconds", "30"),
+            ("reap_batch_size", "500"),
+            ("autoscale_jobs_per_worker", "10"),
+            ("autoscale_max_wait", "5"),
+            ("autoscale_max_load", "1.5"),
+            ("autoscale_cooldown", "10"),
+            ("autoscale_idle_seconds", "30"),
+            ("preload", ""),
+            ("callable_isolation", "inline"),
+            ("log_capture", "1"),
+            ("log_head_bytes", "1048576"),
+            ("log_tail_bytes", "262144"),
+            ("job_timeout_s", "0"),
+            ("job_max_rss_mb", "0"),
+            ("job_cpu_seconds", "0"),
+            ("kill_grace_s", "2"),
+            ("dedupe_window_s", "0"),
+            ("cache_ttl_s", "86400"),
+            ("dependency_failure", "cancel"),
+            ("cache_max_bytes", "268435456"),
+            ("schedule_misfire_grace_s", "60"),
+            ("schedule_max_catchup", "100"),
+            ("schedule_refresh_s", "60"),
+        ] + list(PRAGMA_DEFAULTS.items()),
+    )
 
     # JOBS TABLE with force_retry column
     cursor.execute("""
@@ -47,7 +156,26 @@ def init_db():
         max_retries INTEGER NOT NULL DEFAULT 3,
         created_at TEXT NOT NULL DEFAULT (DATETIME('now')),
         updated_at TEXT,
-        force_retry INTEGER NOT NULL DEFAULT 0
+        force_retry INTEGER NOT NULL DEFAULT 0,
+        next_run_at INTEGER NOT NULL DEFAULT 0,
+        queue TEXT NOT NULL DEFAULT 'default',
+        priority INTEGER NOT NULL DEFAULT 0,
+        enqueued_at REAL,
+        claimed_at REAL,
+        worker_pid INTEGER,
+        lease_expires_at REAL,
+        argv TEXT,
+        callable TEXT,
+        call_args TEXT,
+        timeout_s REAL,
+        max_rss_mb INTEGER,
+        cpu_seconds INTEGER,
+        concurrency_key TEXT,
+        dedupe_key TEXT,
+        cacheable INTEGER NOT NULL DEFAULT 0,
+        inputs TEXT,
+        deps_remaining INTEGER NOT NULL DEFAULT 0,
+        dep_failure TEXT
     );
     """)
 
@@ -75,7 +203,285 @@ def init_db():
         # Column already exists — ignore
         pass
 
-    conn.close()
+    # Migration, add next_run_at (epoch seconds when a job becomes due) and backfill pending rows
+    try:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN next_run_at INTEGER NOT NULL DEFAULT 0;")
+        _backfill_next_run_at(cursor)
+        conn.commit()
+        print("[DB] Added missing column 'next_run_at' to jobs table.")
+    except sqlite3.OperationalError:
+        pass
+
+    # Migration, named queues and priorities
+    _add_column(conn, "queue", "TEXT NOT NULL DEFAULT 'default'")
+    _add_column(conn, "priority", "INTEGER NOT NULL DEFAULT 0")
+    # Migration, lifecycle timing (epoch seconds with fractions), the current claim's owner
+    _add_column(conn, "enqueued_at", "REAL")
+    _add_column(conn, "claimed_at", "REAL")
+    _add_column(conn, "worker_pid", "INTEGER")
+    # Migration, claim leases. Rows already processing get one lease from now, so a worker
+    # still running them keeps them and stuck ones are reclaimed after it runs out.
+    if _add_column(conn, "lease_expires_at", "REAL"):
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE state = 'processing'",
+                (time.time() + _config_int(cursor, "lease_seconds"),),
+            )
+
+    # Migration, argv jobs (JSON list run without a shell, command then only holds a readable form)
+    _add_column(conn, "argv", "TEXT")
+    # Migration, in-process callable jobs ("pkg.module:func", JSON {"args", "kwargs"})
+    _add_column(conn, "callable", "TEXT")
+    _add_column(conn, "call_args", "TEXT")
+    # Migration, per-job limits (NULL = the job_* config defaults)
+    _add_column(conn, "timeout_s", "REAL")
+    _add_column(conn, "max_rss_mb", "INTEGER")
+    _add_column(conn, "cpu_seconds", "INTEGER")
+    # Migration, concurrency groups (limits per key in concurrency_limits)
+    _add_column(conn, "concurrency_key", "TEXT")
+    # Migration, idempotency keys (at most one unfinished job per dedupe_key)
+    _add_column(conn, "dedupe_key", "TEXT")
+    # Migration, result cache opt-in (inputs: JSON list of files that are part of the cache key)
+    _add_column(conn, "cacheable", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "inputs", "TEXT")
+    # Migration, job dependencies (parents not completed yet, 'cancel' / 'hold' when one dies)
+    _add_column(conn, "deps_remaining", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "dep_failure", "TEXT")
+
+    # INDEX used by claims: highest priority due job of one queue
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_jobs_queue_dispatch
+    ON jobs (state, queue, priority DESC, next_run_at, created_at);
+    """)
+    # INDEX for the earliest due time of a queue (idle workers sleep until it)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue_due ON jobs (state, queue, next_run_at);")
+    # INDEX for the in-flight count of a concurrency key, checked by every claim while limits exist.
+    # Partial: only running keyed jobs, so it stays tiny and costs nothing for other jobs.
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_jobs_concurrency_processing
+    ON jobs (concurrency_key) WHERE state = 'processing' AND concurrency_key IS NOT NULL;
+    """)
+    # UNIQUE INDEX for dedupe_key over unfinished jobs, also serves the enqueue-time lookup.
+    # A second partial index finds recently completed jobs of a key (dedupe_window_s).
+    # (idx_jobs_dedupe_active predates the blocked state and didn't cover it)
+    cursor.execute("DROP INDEX IF EXISTS idx_jobs_dedupe_active;")
+    cursor.execute(f"""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedupe_unfinished
+    ON jobs (dedupe_key) WHERE dedupe_key IS NOT NULL AND {DEDUPE_ACTIVE};
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_jobs_dedupe_completed
+    ON jobs (dedupe_key, updated_at) WHERE dedupe_key IS NOT NULL AND state = 'completed';
+    """)
+    # superseded by the two per-queue indexes above, every extra index slows each state change
+    cursor.execute("DROP INDEX IF EXISTS idx_jobs_due;")
+    conn.commit()
+
+    # INDEXES for keyset pagination of `list` on (created_at, id), with and without a state filter
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at, id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state_created ON jobs (state, created_at, id);")
+    conn.commit()
+
+    # INDEX for retention: finished jobs by age
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state_updated ON jobs (state, updated_at);")
+    conn.commit()
+
+    # JOB_ATTEMPTS TABLE, one row per finished execution, written in the worker's finish transaction
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS job_attempts (
+        job_id TEXT NOT NULL,
+        attempt INTEGER NOT NULL,
+        queue TEXT NOT NULL,
+        command TEXT NOT NULL,
+        worker_pid INTEGER,
+        claimed_at REAL,
+        started_at REAL,
+        finished_at REAL NOT NULL,
+        queue_wait_ms INTEGER,
+        duration_ms INTEGER,
+        exit_code INTEGER,
+        outcome TEXT NOT NULL,
+        log_path TEXT,
+        reason TEXT
+    );
+    """)
+    # Migrations, captured output and failure reason ('timeout', 'cpu_limit', ...) per attempt
+    for column in ("log_path", "reason"):
+        try:
+            cursor.execute(f"ALTER TABLE job_attempts ADD COLUMN {column} TEXT;")
+        except sqlite3.OperationalError:
+            pass
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_attempts_job ON job_attempts (job_id, attempt);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_attempts_finished ON job_attempts (finished_at);")
+    conn.commit()
+
+    # RESULT_CACHE TABLE, successful results of cacheable jobs by content key (output in ~/.queuectl/cache)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS result_cache (
+        key TEXT PRIMARY KEY,
+        exit_code INTEGER NOT NULL,
+        has_output INTEGER NOT NULL DEFAULT 0,
+        size_bytes INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        last_used_at REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+    # INDEXES for TTL expiry and LRU eviction
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_created ON result_cache (created_at);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_used ON result_cache (last_used_at);")
+    # hit / miss counters for `status`
+    cursor.execute("CREATE TABLE IF NOT EXISTS cache_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0);")
+    cursor.execute("INSERT OR IGNORE INTO cache_counters (name, value) VALUES ('hits', 0), ('misses', 0);")
+    conn.commit()
+
+    # JOB_DEPENDENCIES TABLE, one row per depends_on edge. Keyed by parent, so a finishing job
+    # reaches exactly its children; `done` is set once the parent's completion was counted.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS job_dependencies (
+        parent_id TEXT NOT NULL,
+        child_id TEXT NOT NULL,
+        done INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (parent_id, child_id)
+    ) WITHOUT ROWID;
+    """)
+    # INDEX for walking a DAG upwards (`list --dag` shows each job's parents)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_dependencies_child ON job_dependencies (child_id);")
+    conn.commit()
+
+    # CONCURRENCY_LIMITS TABLE, max in-flight and token bucket (rate/s, burst) per concurrency_key
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS concurrency_limits (
+        key TEXT PRIMARY KEY,
+        max_in_flight INTEGER,
+        rate REAL,
+        burst REAL,
+        tokens REAL,
+        refilled_at REAL
+    );
+    """)
+    conn.commit()
+
+    # SCHEDULES TABLE, recurring jobs fired by the worker manager (job: JSON template without id)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS schedules (
+        name TEXT PRIMARY KEY,
+        job TEXT NOT NULL,
+        cron TEXT,
+        every_s REAL,
+        misfire TEXT NOT NULL DEFAULT 'run_once',
+        next_fire_at REAL NOT NULL,
+        last_fire_at REAL,
+        created_at REAL NOT NULL
+    );
+    """)
+    conn.commit()
+
+    # JOB_COUNTS TABLE, per (queue, state) row counts kept exact by triggers so status never scans jobs
+    conn.execute("BEGIN IMMEDIATE;")
+    cursor.execute("PRAGMA table_info(job_counts)")
+    counts_columns = {r["name"] for r in cursor.fetchall()}
+    counts_missing = "queue" not in counts_columns
+    if counts_missing:
+        # first run, or the older per-state-only layout: rebuild with queue
+        cursor.execute("DROP TRIGGER IF EXISTS trg_job_counts_insert;")
+        cursor.execute("DROP TRIGGER IF EXISTS trg_job_counts_delete;")
+        cursor.execute("DROP TRIGGER IF EXISTS trg_job_counts_update;")
+        cursor.execute("DROP TABLE IF EXISTS job_counts;")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS job_counts (
+        queue TEXT NOT NULL,
+        state TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (queue, state)
+    );
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_job_counts_insert
+    AFTER INSERT ON jobs
+    FOR EACH ROW
+    BEGIN
+        INSERT INTO job_counts (queue, state, count) VALUES (NEW.queue, NEW.state, 1)
+        ON CONFLICT(queue, state) DO UPDATE SET count = count + 1;
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_job_counts_delete
+    AFTER DELETE ON jobs
+    FOR EACH ROW
+    BEGIN
+        UPDATE job_counts SET count = count - 1 WHERE queue = OLD.queue AND state = OLD.state;
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_job_counts_update
+    AFTER UPDATE OF state, queue ON jobs
+    FOR EACH ROW
+    WHEN OLD.state IS NOT NEW.state OR OLD.queue IS NOT NEW.queue
+    BEGIN
+        UPDATE job_counts SET count = count - 1 WHERE queue = OLD.queue AND state = OLD.state;
+        INSERT INTO job_counts (queue, state, count) VALUES (NEW.queue, NEW.state, 1)
+        ON CONFLICT(queue, state) DO UPDATE SET count = count + 1;
+    END;
+    """)
+    if counts_missing:
+        _recount(cursor)
+    conn.commit()
+
+
+def _add_column(conn, name: str, definition: str) -> bool:
+    """Migration helper, add a jobs column if this database predates it."""
+    try:
+        conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition};")
+        conn.commit()
+        print(f"[DB] Added missing column '{name}' to jobs table.")
+        return True
+    except sqlite3.OperationalError:
+        # Column already exists — ignore
+        return False
+
+
+def _recount(cursor):
+    cursor.execute("DELETE FROM job_counts")
+    cursor.execute(
+        "INSERT INTO job_counts (queue, state, count) "
+        "SELECT queue, state, COUNT(*) FROM jobs GROUP BY queue, state"
+    )
+
+
+def recount_job_counts():
+    """Rebuild job_counts from a full scan of jobs (repair tool, takes the write lock)."""
+    conn = get_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        _recount(conn.cursor())
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def to_epoch(ts: str) -> int:
+    """Convert a stored UTC timestamp (ISO or DATETIME('now') format) to epoch seconds."""
+    return int(datetime.fromisoformat(ts).replace(tzinfo=timezone.utc).timestamp())
+
+
+def _backfill_next_run_at(cursor):
+    """Compute next_run_at for pending rows created before the column existed."""
+    cursor.execute("SELECT value FROM config WHERE key = 'exp_backoff_base'")
+    row = cursor.fetchone()
+    base = int(row["value"]) if row else 2
+
+    cursor.execute(
+        "SELECT id, attempts, force_retry, created_at, updated_at FROM jobs WHERE state = 'pending'"
+    )
+    updates = []
+    for job in cursor.fetchall():
+        attempts = int(job["attempts"])
+        delay = base ** attempts if attempts > 0 and not job["force_retry"] else 0
+        updates.append((to_epoch(job["updated_at"] or job["created_at"]) + delay, job["id"]))
+
+    cursor.executemany("UPDATE jobs SET next_run_at = ? WHERE id = ?", updates)
 
 
 
@@ -86,18 +492,147 @@ def get_config_value(key: str) -> int:
     cur = conn.cursor()
     cur.execute("SELECT value FROM config WHERE key = ?", (key,))
     row = cur.fetchone()
-    conn.close()
     if not row:
         raise KeyError(f"Configuration key '{key}' not found.")
     return int(row["value"])
 
 
-def insert_job(job_data: dict):
+def _config_int(cur, key: str) -> int:
+    """Read an integer config value through an already open cursor."""
+    cur.execute("SELECT value FROM config WHERE key = ?", (key,))
+    row = cur.fetchone()
+    if not row:
+        raise KeyError(f"Configuration key '{key}' not found.")
+    return int(row["value"])
+
+
+# Unfinished states, at most one job per dedupe_key among them (idx_jobs_dedupe_unfinished).
+# Queries repeat this exact term so the planner can use the partial index.
+DEDUPE_ACTIVE = "state IN ('pending', 'processing', 'failed', 'blocked')"
+
+
+def _find_dedupe(cur, keys) -> dict:
+    """
+    Map each of `keys` that is taken to the id of the job holding it: an
+    unfinished job, or one completed in the last dedupe_window_s seconds.
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+    window = _config_int(cur, "dedupe_window_s")
+    found = {}
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        # both lookups pinned to the dedupe indexes: with a long IN list the planner would
+        # rather scan every job in the state (or every recent completion)
+        if window > 0:
+            cur.execute(
+                f"SELECT dedupe_key, id FROM jobs INDEXED BY idx_jobs_dedupe_completed "
+                f"WHERE dedupe_key IN ({marks}) AND state = 'completed' "
+                f"AND updated_at >= DATETIME('now', ?)",
+                [*chunk, f"-{window} seconds"],
+            )
+            found.update((r["dedupe_key"], r["id"]) for r in cur.fetchall())
+        # unfinished holders win over completed ones
+        cur.execute(
+            f"SELECT dedupe_key, id FROM jobs INDEXED BY idx_jobs_dedupe_unfinished "
+            f"WHERE dedupe_key IN ({marks}) AND {DEDUPE_ACTIVE}",
+            chunk,
+        )
+        found.update((r["dedupe_key"], r["id"]) for r in cur.fetchall())
+    return found
+
+
+# Columns written on enqueue, everything else comes from the table defaults
+JOB_INSERT_COLUMNS = (
+    "id", "command", "max_retries", "next_run_at", "queue", "priority", "enqueued_at", "argv",
+    "callable", "call_args", "timeout_s", "max_rss_mb", "cpu_seconds", "concurrency_key", "dedupe_key",
+    "cacheable", "inputs", "state", "deps_remaining", "dep_failure",
+)
+_INSERT_SQL = (
+    f"INSERT INTO jobs ({', '.join(JOB_INSERT_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(JOB_INSERT_COLUMNS))})"
+)
+
+
+def _job_row(job: dict, max_retries: int, now: float) -> tuple:
+    return (
+        job["id"],
+        job["command"],
+        max_retries,
+        int(job.get("run_at") or now),
+        job.get("queue") or "default",
+        int(job.get("priority") or 0),
+        now,
+        json.dumps(job["argv"]) if job.get("argv") else None,
+        job.get("callable"),
+        json.dumps({"args": job.get("args", []), "kwargs": job.get("kwargs", {})})
+        if job.get("callable") else None,
+        job.get("timeout_s"),
+        job.get("max_rss_mb"),
+        job.get("cpu_seconds"),
+        job.get("concurrency_key"),
+        job.get("dedupe_key"),
+        int(bool(job.get("cacheable"))),
+        json.dumps(job["inputs"]) if job.get("inputs") else None,
+        job.get("state") or "pending",
+        job.get("deps_remaining") or 0,
+        job.get("on_dependency_failure") if job.get("depends_on") else None,
+    )
+
+
+def _parent_states(cur, jobs) -> dict:
+    """
+    State of every job named in the depends_on lists of `jobs`, looked up
+    in slices. Parents missing from the table are simply absent.
+    """
+    parents = list(dict.fromkeys(p for job in jobs for p in job.get("depends_on") or ()))
+    states = {}
+    for i in range(0, len(parents), 500):
+        chunk = parents[i:i + 500]
+        cur.execute(f"SELECT id, state FROM jobs WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+        states.update((r["id"], r["state"]) for r in cur.fetchall())
+    return states
+
+
+def _with_dependencies(job: dict, states: dict):
+    """
+    Starting state of a job from its parents' states: 'blocked' while any
+    parent isn't completed, 'cancelled' right away when one already failed
+    for good and the job's policy is 'cancel'. Returns (job, edges), edges
+    are (parent_id, child_id, done) rows; raises ValueError on an unknown parent.
+    """
+    parents = job.get("depends_on")
+    if not parents:
+        return job, []
+    unknown = [p for p in parents if p not in states]
+    if unknown:
+        raise ValueError(f"Unknown dependency: {', '.join(unknown)}")
+    remaining = sum(1 for p in parents if states[p] != "completed")
+    failed = any(states[p] in ("dead", "cancelled") for p in parents)
+    if failed and job.get("on_dependency_failure") == "cancel":
+        state = "cancelled"
+    else:
+        state = "blocked" if remaining else "pending"
+    edges = [(p, job["id"], int(states[p] == "completed")) for p in parents]
+    return dict(job, state=state, deps_remaining=remaining), edges
+
+
+_EDGE_SQL = "INSERT INTO job_dependencies (parent_id, child_id, done) VALUES (?, ?, ?)"
+
+
+def insert_job(job_data: dict, max_retries: int = None):
     """
     Insert a job into the jobs table.
-    The user may only provide 'id' and 'command'.
+    The user provides 'id' and 'command' (plus optional 'queue', 'priority'
+    and 'run_at', epoch seconds before which the job isn't claimed).
     All other values (state, attempts, max_retries, timestamps)
     are automatically filled based on system config.
+    Returns the id of the job that will do the work: job_data's own id, or
+    the existing job's id when its dedupe_key matches an unfinished one (or
+    one completed within dedupe_window_s), in which case nothing is inserted.
+    With depends_on the job starts 'blocked' until its parents complete.
     """
     if not isinstance(job_data, dict):
         raise TypeError("Job must be a dictionary.")
@@ -109,34 +644,170 @@ def insert_job(job_data: dict):
         raise ValueError(f"Missing required fields: {', '.join(missing)}")
 
     job_id = job_data["id"]
-    command = job_data["command"]
-
-    # Fetch default retry count from config
-    max_retries = get_config_value("max_retries")
 
     conn = get_connection()
     cur = conn.cursor()
 
+    # Default retry count from config, unless the caller already has it
+    if max_retries is None:
+        max_retries = _config_int(cur, "max_retries")
+
+    dedupe_key = job_data.get("dedupe_key")
     try:
-        cur.execute("""
-            INSERT INTO jobs (id, command, max_retries)
-            VALUES (?, ?, ?)
-        """, (job_id, command, max_retries))
+        if dedupe_key or job_data.get("depends_on"):
+            # lookups and insert under the write lock: two producers can't both miss the
+            # dedupe key, a parent can't complete between reading its state and the insert
+            conn.execute("BEGIN IMMEDIATE;")
+        if dedupe_key:
+            existing = _find_dedupe(cur, [dedupe_key]).get(dedupe_key)
+            if existing is not None:
+                return existing
+        job_data, edges = _with_dependencies(job_data, _parent_states(cur, [job_data]))
+        cur.execute(_INSERT_SQL, _job_row(job_data, max_retries, time.time()))
+        cur.executemany(_EDGE_SQL, edges)
+        return job_id
     except sqlite3.IntegrityError:
+        conn.rollback()
         raise ValueError(f"Job with id '{job_id}' already exists.")
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         conn.commit()
-        conn.close()
 
 
-def list_jobs(state: str = None):
-    """Fetch jobs from the database, optionally filtered by state."""
+def insert_jobs(jobs: list, max_retries: int = None):
+    """
+    Insert a chunk of already validated jobs in one transaction.
+    `jobs` is a list of (ref, job dict) tuples, `ref` is opaque to this
+    function (the caller's line number). Rows whose id already exists, in the
+    table or earlier in the chunk, are skipped and returned as duplicates.
+    Rows whose dedupe_key matches an existing job (see insert_job) or an
+    earlier row of the chunk are skipped and returned as deduped.
+    depends_on may name jobs in the table or earlier in the chunk, rows
+    naming any other job are skipped and returned as rejected.
+    Returns (inserted_count, [(ref, id), ...] duplicates,
+    [(ref, id, existing id), ...] deduped, [(ref, message), ...] rejected).
+    """
     conn = get_connection()
     cur = conn.cursor()
-    if state:
-        cur.execute("SELECT * FROM jobs WHERE state = ? ORDER BY created_at", (state,))
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        if max_retries is None:
+            max_retries = _config_int(cur, "max_retries")
+
+        # Existing ids, looked up in slices to stay under SQLite's variable limit
+        ids = [job["id"] for _, job in jobs]
+        existing = set()
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cur.execute(
+                f"SELECT id FROM jobs WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            )
+            existing.update(r["id"] for r in cur.fetchall())
+        # Jobs already holding these dedupe keys (only looked up when the chunk has any)
+        holders = _find_dedupe(cur, [job["dedupe_key"] for _, job in jobs if job.get("dedupe_key")])
+        # States of the parents named in depends_on, jobs of this chunk are added as they're inserted
+        states = _parent_states(cur, [job for _, job in jobs])
+
+        now = time.time()
+        rows, edges, duplicates, deduped, rejected = [], [], [], [], []
+        for ref, job in jobs:
+            if job["id"] in existing:
+                duplicates.append((ref, job["id"]))
+                continue
+            key = job.get("dedupe_key")
+            if key and key in holders:
+                deduped.append((ref, job["id"], holders[key]))
+                continue
+            try:
+                job, job_edges = _with_dependencies(job, states)
+            except ValueError as e:
+                rejected.append((ref, str(e)))
+                continue
+            existing.add(job["id"])
+            if key:
+                holders[key] = job["id"]
+            states[job["id"]] = job.get("state") or "pending"
+            rows.append(_job_row(job, max_retries, now))
+            edges += job_edges
+
+        cur.executemany(_INSERT_SQL, rows)
+        cur.executemany(_EDGE_SQL, edges)
+        conn.commit()
+        return len(rows), duplicates, deduped, rejected
+    except Exception:
+        conn.rollback()
+        raise
+
+
+ATTEMPT_COLUMNS = (
+    "job_id", "queue", "command", "worker_pid", "claimed_at", "started_at", "finished_at",
+    "queue_wait_ms", "duration_ms", "exit_code", "outcome", "log_path",
+    "reason",
+)
+
+
+def insert_attempt(cur, attempt: dict):
+    """
+    Record one finished execution through the caller's cursor, so it commits
+    (or rolls back) with the job's own state change. The attempt number is
+    the job's next one in job_attempts.
+    """
+    cur.execute(
+        f"INSERT INTO job_attempts (attempt, {', '.join(ATTEMPT_COLUMNS)}) "
+        f"VALUES ((SELECT COUNT(*) + 1 FROM job_attempts WHERE job_id = ?), "
+        f"{', '.join('?' * len(ATTEMPT_COLUMNS))})",
+        (attempt["job_id"], *(attempt.get(c) for c in ATTEMPT_COLUMNS)),
+    )
+
+
+def iter_attempts(since: float = None):
+    """Stream job_attempts rows finished at or after `since` (epoch seconds)."""
+    cur = get_connection().cursor()
+    if since is None:
+        cur.execute("SELECT * FROM job_attempts")
     else:
-        cur.execute("SELECT * FROM jobs ORDER BY created_at")
-    rows = [dict(r) for r in cur.fetchall()]
-    conn.close()
-    return rows
+        cur.execute("SELECT * FROM job_attempts WHERE finished_at >= ?", (since,))
+    for row in cur:
+        yield dict(row)
+
+
+def iter_jobs(state: str = None, limit: int = None, after: tuple = None,
+              since: str = None, until: str = None):
+    """
+    Stream jobs ordered by (created_at, id) straight from the cursor.
+    after:        (created_at, id) keyset cursor, only rows strictly after it
+    since/until:  created_at bounds, 'YYYY-MM-DD HH:MM:SS' (inclusive / exclusive)
+    """
+    clauses, params = [], []
+    if state:
+        clauses.append("state = ?")
+        params.append(state)
+    if after:
+        clauses.append("(created_at, id) > (?, ?)")
+        params.extend(after)
+    if since:
+        clauses.append("created_at >= ?")
+        params.append(since)
+    if until:
+        clauses.append("created_at < ?")
+        params.append(until)
+
+    sql = "SELECT * FROM jobs"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY created_at, id"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    cur = get_connection().cursor()
+    cur.execute(sql, params)
+    for row in cur:
+        yield dict(row)
+
+
+def list_jobs(state: str = None):
+    """Fetch jobs from the database, optionally filtered by state."""
+    return list(iter_jobs(state))